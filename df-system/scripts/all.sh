@@ -1,4 +1,6 @@
-mkdir -p /tmp/dfpy
+mkdir -p /tmp/dfpy /root/.dfpy
+# restore volsym checkpoints, so volsym only queries blocks since last run
+mv ~/.dfcsv/volsym-checkpoint-*.json /tmp/dfpy/ 2>/dev/null
 date=`date -dlast-thursday '+%Y-%m-%d'`
 now=`date '+%Y-%m-%d'`
 nm=`date +%u`
@@ -9,29 +11,37 @@ then
 fi
 echo $date
 
-dfpy_docker getrate OCEAN $date $now /app/data
-dfpy_docker getrate ETH $date $now /app/data
-dfpy_docker getrate BNB $date $now /app/data
-dfpy_docker getrate EWT $date $now /app/data
-dfpy_docker getrate MOVR $date $now /app/data
-dfpy_docker getrate MATIC $date $now /app/data
-
-dfpy_docker volsym $date latest 50 /app/data 1 && 
-dfpy_docker volsym $date latest 50 /app/data 56 && 
-dfpy_docker volsym $date latest 50 /app/data 137 &&
-dfpy_docker volsym $date latest 50 /app/data 246 && 
-dfpy_docker volsym $date latest 50 /app/data 1285 && 
-
-dfpy_docker vebals  $date latest 50 /app/data 1 &&
-dfpy_docker vebals  $date latest 1 /app/data 1 &&
-dfpy_docker allocations $date latest 50 /app/data 1 
-dfpy_docker allocations $date latest 1 /app/data 1
+# run all subcommands in one warm 'dftool serve', rather than a fresh
+# container + process each. Output goes to /tmp/dfpy = /app/data
+# stop it on any exit, eg a failed or interrupted run. Quiet since --rm
+# removes it after the stop at the end
+trap 'docker stop dfpy_serve >/dev/null 2>&1' EXIT
+dfpy_docker_serve || exit 1
+dfpy_submit() {
+        python3 /app/df-py/util/dfserver.py /tmp/dfpy/dftool.sock "$@"
+}
+
+dfpy_submit getrate OCEAN $date $now /app/data
+dfpy_submit getrate ETH $date $now /app/data
+dfpy_submit getrate BNB $date $now /app/data
+dfpy_submit getrate EWT $date $now /app/data
+dfpy_submit getrate MOVR $date $now /app/data
+dfpy_submit getrate MATIC $date $now /app/data
+
+dfpy_submit volsym_all $date latest 50 /app/data 1,56,137,246,1285 1 1 && 
+
+dfpy_submit vebals  $date latest 50 /app/data 1 1 4 events &&
+dfpy_submit vebals  $date latest 1 /app/data 1 &&
+dfpy_submit allocations $date latest 50 /app/data 1 1 4 events
+dfpy_submit allocations $date latest 1 /app/data 1
 
 cp /tmp/dfpy/rate-OCEAN.csv /tmp/dfpy/rate-MOCEAN.csv
 sed -i -e 's/MOCEAN/OCEAN/g' /tmp/dfpy/rate-MOCEAN.csv
 
-dfpy_docker calc /app/data 0 $date OCEAN
+dfpy_submit calc /app/data 0 $date OCEAN
+
+dfpy_submit calculate_passive 1 $date /app/data
 
-dfpy_docker calculate_passive 1 $date /app/data
+docker stop dfpy_serve
 
 mv /tmp/dfpy/* ~/.dfcsv/
@@ -1,7 +1,9 @@
-mkdir -p /tmp/dfpy
-dfpy_docker nftinfo /app/data 1
-dfpy_docker nftinfo /app/data 56
-dfpy_docker nftinfo /app/data 137
-dfpy_docker nftinfo /app/data 246
-dfpy_docker nftinfo /app/data 1285
+mkdir -p /tmp/dfpy /root/.dfpy
+# restore previous nftinfo csvs & checkpoints, so nftinfo only queries changes
+cp ~/.dfcsv/nftinfo* /tmp/dfpy/ 2>/dev/null
+dfpy_docker nftinfo /app/data 1 latest 1
+dfpy_docker nftinfo /app/data 56 latest 1
+dfpy_docker nftinfo /app/data 137 latest 1
+dfpy_docker nftinfo /app/data 246 latest 1
+dfpy_docker nftinfo /app/data 1285 latest 1
 mv /tmp/dfpy/nftinfo* ~/.dfcsv
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Benchmark query.queryAllocationsFromEvents() against query.queryAllocations()
+at NSAMP=50, on a synthetic week of veAllocate allocations.
+
+The subgraph is faked at graphutil.submitQuery(), so it serves both paged
+queries and the aliased multi-block queries of paginatedQueryBlocks(). Each
+request costs LATENCY_S, so the timings reflect the # round trips, plus
+local compute.
+
+Usage: python tests/bench_allocations.py [N_LPS N_UPDATES]
+  N_LPS -- number of LPs that allocate. Default: 5000
+  N_UPDATES -- number of allocation updates during the week. Default: 2000
+"""
+import bisect
+import inspect
+import math
+import os
+import re
+import sys
+import time
+from unittest.mock import patch
+
+import numpy as np
+
+# this part is required to access "util"
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(currentdir))
+
+# pylint: disable=wrong-import-position
+from util import query
+from util.blockrange import BlockRange
+
+CHAINID = 1
+ST, FIN = 16_000_000, 16_050_000  # ~1 week of blocks
+NSAMP = 50
+N_NFTS = 500
+ALLOCS_PER_LP = 3
+LATENCY_S = 0.05  # per request
+
+# a root field of a query, as built by graphutil._pageField():
+# [alias: ]entity(args) { id fields }. Fields have no parentheses
+ROOT_FIELD_RE = re.compile(r"(?:(\w+): )?(\w+)\(([^()]*)\)")
+
+
+class FakeSubgraph:
+    """Serves veAllocateUsers snapshots and veAllocationUpdates"""
+
+    def __init__(self, n_LPs: int, n_updates: int, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        nfts = [f"0x{j:040x}" for j in range(N_NFTS)]
+
+        # [(LP_addr, nft_addr)] : sorted list of (block, allocated)
+        self.history: dict = {}
+        for i in range(n_LPs):
+            LP_addr = f"0x{i + 1:040x}"
+            for j in rng.choice(N_NFTS, ALLOCS_PER_LP, replace=False):
+                allocated = float(rng.integers(1, 10000))
+                self.history[(LP_addr, nfts[j])] = [(ST - 1, allocated)]
+
+        keys = list(self.history)
+        for _ in range(n_updates):
+            key = keys[rng.integers(len(keys))]
+            block = int(rng.integers(ST + 1, FIN + 1))
+            allocated = float(rng.integers(0, 10000))
+            bisect.insort(self.history[key], (block, allocated))
+
+        self.n_requests = 0
+        self._results: dict = {}  # [query key] : all records, sorted by id
+
+    def submitQuery(self, query_s, chainID, use_cache=True):
+        # pylint: disable=unused-argument
+        data = {}
+        for alias, entity, args in ROOT_FIELD_RE.findall(query_s):
+            if entity == "veAllocateUsers":
+                block = int(re.search(r"block: {number: (\d+)}", args).group(1))
+                key = (entity, block)
+                if key not in self._results:
+                    self._results[key] = self._usersAt(block)
+            else:
+                st = int(re.search(r"block_gt: (\d+)", args).group(1))
+                fin = int(re.search(r"block_lte: (\d+)", args).group(1))
+                key = (entity, st, fin)
+                if key not in self._results:
+                    self._results[key] = self._updates(st, fin)
+            records = self._results[key]  # sorted by id
+
+            # page like the subgraph: by id, after the cursor
+            last_id = re.search(r'id_gt: "([^"]*)"', args)
+            i = 0
+            if last_id is not None:
+                ids = [r["id"] for r in records]
+                i = bisect.bisect_right(ids, last_id.group(1))
+            first = int(re.search(r"first: (\d+)", args).group(1))
+            data[alias or entity] = records[i : i + first]
+
+        self.n_requests += 1
+        time.sleep(LATENCY_S)
+        return {"data": data}
+
+    def _usersAt(self, block):
+        users: dict = {}
+        for (LP_addr, nft_addr), updates in self.history.items():
+            i = bisect.bisect_right(updates, (block, math.inf)) - 1
+            if i < 0:
+                continue
+            alloc = {
+                "allocated": str(updates[i][1]),
+                "chainId": str(CHAINID),
+                "nftAddress": nft_addr,
+            }
+            users.setdefault(LP_addr, []).append(alloc)
+        records = [{"id": LP_addr, "veAllocation": a} for LP_addr, a in users.items()]
+        return sorted(records, key=lambda r: r["id"])
+
+    def _updates(self, st, fin):
+        records = [
+            {
+                "id": f"{block:012d}-{LP_addr}-{nft_addr}-{i}",
+                "block": str(block),
+                "eventIndex": i,  # same order as _usersAt() sees them
+                "allocatedTotal": str(allocated),
+                "veAllocation": {
+                    "allocationUser": {"id": LP_addr},
+                    "chainId": str(CHAINID),
+                    "nftAddress": nft_addr,
+                },
+            }
+            for (LP_addr, nft_addr), updates in self.history.items()
+            for i, (block, allocated) in enumerate(updates)
+            if st < block <= fin
+        ]
+        return sorted(records, key=lambda r: r["id"])
+
+
+def maxAbsDiff(allocs1: dict, allocs2: dict) -> float:
+    diff = 0.0
+    for nft_addr in set(allocs1[CHAINID]) | set(allocs2[CHAINID]):
+        LPs1 = allocs1[CHAINID].get(nft_addr, {})
+        LPs2 = allocs2[CHAINID].get(nft_addr, {})
+        for LP_addr in set(LPs1) | set(LPs2):
+            diff = max(diff, abs(LPs1.get(LP_addr, 0.0) - LPs2.get(LP_addr, 0.0)))
+    return diff
+
+
+def bench(n_LPs: int, n_updates: int):
+    print(f"N_LPS={n_LPs}, N_UPDATES={n_updates}, blocks {ST}..{FIN}:")
+    subgraph = FakeSubgraph(n_LPs, n_updates)
+    rng = BlockRange(ST, FIN, NSAMP, random_seed=42)
+
+    with patch("util.graphutil.submitQuery", side_effect=subgraph.submitQuery), patch(
+        "util.graphutil.USE_CACHE", False
+    ):
+        t0 = time.time()
+        allocs_sampled = query.queryAllocations(rng, CHAINID)
+        t_sampled = time.time() - t0
+        n_sampled, subgraph.n_requests = subgraph.n_requests, 0
+
+        t0 = time.time()
+        allocs_events = query.queryAllocationsFromEvents(rng, CHAINID)
+        t_events = time.time() - t0
+
+    print(f"  sample (NSAMP={NSAMP}): {t_sampled:.2f} s, {n_sampled} requests")
+    print(f"  events:             {t_events:.2f} s, {subgraph.n_requests} requests")
+    print(f"  speedup: {t_sampled / t_events:.1f}x")
+    diff = maxAbsDiff(allocs_sampled, allocs_events)
+    print(f"  max |sampled - exact| percent: {diff:.2e}")
+
+
+def main():
+    argv = sys.argv[1:]
+    n_LPs, n_updates = (int(argv[0]), int(argv[1])) if argv else (5000, 2000)
+    bench(n_LPs, n_updates)
+
+
+if __name__ == "__main__":
+    main()
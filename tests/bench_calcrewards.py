@@ -0,0 +1,69 @@
+"""
+Benchmark calcrewards._calcRewardsUsd(), dense and sparse, against the original
+per-cell loop.
+
+Usage: python tests/bench_calcrewards.py [N_I N_J] [--skip-loop]
+  N_I -- number of LPs (rows). If not given, runs 10k x 500 and 100k x 1000
+  N_J -- number of (chain, nft) pairs (columns)
+  --skip-loop -- only time the vectorized version (the loop is slow at 100k)
+"""
+import inspect
+import os
+import sys
+import time
+
+import numpy as np
+import scipy
+
+# this part is required to access "util"
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(currentdir))
+
+# pylint: disable=wrong-import-position
+from util.calcrewards import _calcRewardsUsd
+from util.test.calcrewards_reference import calcRewardsUsdLoop, randomInputs
+
+SIZES = [(10_000, 500), (100_000, 1000)]
+N_REPEATS = 3
+
+
+def bench(N_i: int, N_j: int, do_loop: bool):
+    print(f"N_i={N_i}, N_j={N_j}:")
+    S, V_USD, C = randomInputs(N_i, N_j)
+    args = (S, V_USD, C, 0.5, 150000.0, True, True)
+
+    t_vec = np.inf
+    for _ in range(N_REPEATS):  # best-of-N, to ignore allocator noise
+        t0 = time.time()
+        R_vec = _calcRewardsUsd(*args)
+        t_vec = min(t_vec, time.time() - t0)
+    print(f"  vectorized: {t_vec:.3f} s (best of {N_REPEATS})")
+
+    S_sparse = scipy.sparse.csc_matrix(S)
+    t0 = time.time()
+    R_sparse = _calcRewardsUsd(S_sparse, *args[1:])
+    print(f"  sparse:     {time.time() - t0:.3f} s")
+    print(f"  sparse == dense: {np.array_equal(R_sparse.toarray(), R_vec)}")
+
+    if not do_loop:
+        return
+
+    t0 = time.time()
+    R_loop = calcRewardsUsdLoop(*args)
+    t_loop = time.time() - t0
+    print(f"  loop:       {t_loop:.3f} s")
+    print(f"  speedup:    {t_loop / t_vec:.1f}x")
+    print(f"  bit-identical: {np.array_equal(R_vec, R_loop)}")
+
+
+def main():
+    _calcRewardsUsd(*randomInputs(10, 5), 0.5, 1.0, True, True)  # warm up imports
+    do_loop = "--skip-loop" not in sys.argv
+    argv = [arg for arg in sys.argv[1:] if arg != "--skip-loop"]
+    sizes = SIZES if not argv else [(int(argv[0]), int(argv[1]))]
+    for N_i, N_j in sizes:
+        bench(N_i, N_j, do_loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark the startup time of each dftool subcommand: the time for
+'./dftool SUBCOMMAND' with no args to import everything, print its help
+and exit. Every cron invocation pays this before doing any work.
+
+Also times the import of util.dftool_module alone, and of the modules
+that subcommands import in their do_*() functions.
+
+Each run must exit like it should: 1 for a subcommand's help (0 for
+'help'), 0 for an import, and without a traceback. Otherwise it's
+reported as failed, since a crash on import would look like a fast startup.
+
+Usage: python tests/bench_startup.py [N_RUNS] [MAX_S]
+  N_RUNS -- # runs per subcommand; the median is reported. Default: 3
+  MAX_S -- if given, exit with 1 if any median is above this, so that
+    startup regressions fail CI. Failed runs always exit with 1
+"""
+import inspect
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# this part is required to find "dftool"
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+ROOT_DIR = os.path.dirname(currentdir)
+
+# not startup: 'compile' compiles all contracts, 'newacct' takes no args so
+# it runs, on the dev chain
+SKIP = ["compile", "newacct"]
+
+# exit code with no args: 1 from printing the help, except these
+EXPECTED_CODES = {"help": 0, "help_short": 0, "help_long": 0}
+
+# imported by subcommands in their do_*() functions
+HANDLER_MODULES = [
+    "util.calcrewards",
+    "util.challenge.judge",
+    "util.dispense",
+    "util.getrate",
+    "util.oceantestutil",
+    "util.vesting_schedule",
+]
+
+
+def subcommands() -> list:
+    """Return the dftool subcommands, from the do_*() functions"""
+    with open(os.path.join(ROOT_DIR, "util", "dftool_module.py"), "r") as f:
+        s = f.read()
+    return [
+        name for name in re.findall(r"^def do_(\w+)\(", s, re.M) if name not in SKIP
+    ]
+
+
+def timeCmd(cmd: list, n_runs: int, expected_code: int) -> float:
+    """Return the median wall time of running cmd, in s. Raise
+    RuntimeError if a run exits with another code, or with a traceback"""
+    times = []
+    for _ in range(n_runs):
+        t0 = time.time()
+        result = subprocess.run(cmd, cwd=ROOT_DIR, capture_output=True, check=False)
+        times.append(time.time() - t0)
+
+        stderr = result.stderr.decode(errors="replace")
+        if result.returncode != expected_code or "Traceback" in stderr:
+            last_line = stderr.strip().splitlines()[-1:] or [""]
+            raise RuntimeError(f"exit code {result.returncode}. {last_line[0]}")
+    return statistics.median(times)
+
+
+def main():
+    argv = sys.argv[1:]
+    n_runs = int(argv[0]) if argv else 3
+    max_s = float(argv[1]) if len(argv) > 1 else None
+
+    python = sys.executable
+    failed = []
+
+    def timeOrFail(name: str, cmd: list, t_minus: float = 0.0) -> str:
+        try:
+            return f"{timeCmd(cmd, n_runs, 0) - t_minus:.2f} s"
+        except RuntimeError as e:
+            failed.append(name)
+            return f"FAILED: {e}"
+
+    t_python = timeCmd([python, "-c", "pass"], n_runs, 0)
+    t_module = timeOrFail(
+        "util.dftool_module", [python, "-c", "import util.dftool_module"]
+    )
+    print(f"python alone:                {t_python:.2f} s")
+    print(f"import util.dftool_module:   {t_module}")
+    for module in HANDLER_MODULES:
+        t = timeOrFail(module, [python, "-c", f"import {module}"], t_python)
+        print(f"  + import {module}: {t}")
+
+    print(f"\n'./dftool SUBCOMMAND' (no args), median of {n_runs}:")
+    slow = []
+    for name in subcommands():
+        try:
+            t = timeCmd([python, "dftool", name], n_runs, EXPECTED_CODES.get(name, 1))
+        except RuntimeError as e:
+            failed.append(name)
+            print(f"  {name:22s} FAILED: {e}")
+            continue
+        print(f"  {name:22s} {t:.2f} s")
+        if max_s is not None and t > max_s:
+            slow.append(name)
+
+    if slow:
+        print(f"\nSlower than {max_s} s: {', '.join(slow)}")
+    if failed:
+        print(f"\nFailed: {', '.join(failed)}")
+    if slow or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple, Union
+
+from enforce_typing import enforce_types
+
+from util.networkutil import DEV_CHAINID
+
+# dir of files of known (block, timestamp) points, one file per chain
+BLOCK_INDEX_DIR = os.getenv("BLOCK_INDEX_DIR", "~/.dfpy/block_index")
+
+# only save blocks at least this old, so that reorgs can't change them
+BLOCK_INDEX_MIN_AGE_S = 3600
+
+_INDEXES: Dict[int, "BlockIndex"] = {}  # [chainID] : index
+_LOCK = threading.Lock()  # guards _INDEXES
+
+
+@enforce_types
+class BlockIndex:
+    """
+    Sparse index of known (block, timestamp) points of a chain.
+
+    Filled in as block timestamps get fetched, and saved to cache_file so
+    that later runs start with all points found so far. If cache_file is
+    None, it's in-memory only.
+    """
+
+    def __init__(self, cache_file: Optional[str]):
+        self.cache_file = None if cache_file is None else os.path.expanduser(cache_file)
+        points = sorted(self._loadCache()) if self.cache_file is not None else []
+        self._blocks: List[int] = [block for block, _ in points]  # sorted
+        self._timestamps: List[int] = [ts for _, ts in points]  # of each block
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def add(self, block: int, timestamp: int):
+        """Record the timestamp of a block"""
+        with self._lock:
+            i = bisect.bisect_left(self._blocks, block)
+            if i < len(self._blocks) and self._blocks[i] == block:
+                self._timestamps[i] = timestamp
+            else:
+                self._blocks.insert(i, block)
+                self._timestamps.insert(i, timestamp)
+
+    def bracket(
+        self, timestamp: Union[float, int]
+    ) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+        @description
+          Return the nearest known points around timestamp. Since
+          timestamps never decrease with block #, the first block at or
+          after timestamp is in (lo block, hi block].
+
+        @return
+          lo -- (block, timestamp) of the last known block before
+            timestamp, or None if there's none
+          hi -- (block, timestamp) of the first known block at or after
+            timestamp, or None if there's none
+        """
+        with self._lock:
+            i = bisect.bisect_left(self._timestamps, timestamp)
+            lo = (self._blocks[i - 1], self._timestamps[i - 1]) if i > 0 else None
+            hi = None
+            if i < len(self._blocks):
+                hi = (self._blocks[i], self._timestamps[i])
+        return (lo, hi)
+
+    def save(self):
+        """Merge points old enough into cache_file. Nothing if in-memory"""
+        if self.cache_file is None:
+            return
+        max_timestamp = time.time() - BLOCK_INDEX_MIN_AGE_S
+        points = dict(self._loadCache())  # may have points of other processes
+        with self._lock:
+            for block, timestamp in zip(self._blocks, self._timestamps):
+                if timestamp <= max_timestamp:
+                    points[block] = timestamp
+
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_filename = f"{self.cache_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(sorted(points.items()), f)
+        os.replace(tmp_filename, self.cache_file)
+
+    def _loadCache(self) -> List[Tuple[int, int]]:
+        try:
+            with open(self.cache_file, "r") as f:
+                return [(int(block), int(ts)) for block, ts in json.load(f)]
+        except (OSError, ValueError):  # not cached yet, or partial
+            return []
+
+
+@enforce_types
+def getBlockIndex(chainID: int) -> BlockIndex:
+    """
+    @description
+      Return the BlockIndex of this chain, shared by the whole process.
+      Except on the dev chain, which gets reset: then a new in-memory one.
+    """
+    if chainID == DEV_CHAINID:
+        return BlockIndex(None)
+    with _LOCK:
+        if chainID not in _INDEXES:
+            cache_file = os.path.join(BLOCK_INDEX_DIR, f"{chainID}.json")
+            _INDEXES[chainID] = BlockIndex(cache_file)
+        return _INDEXES[chainID]
@@ -1,4 +1,6 @@
 import sys
+from typing import List, Optional
+
 import numpy
 from enforce_typing import enforce_types
 from util.blocktime import getstfinBlocks
@@ -6,13 +8,27 @@ from util.blocktime import getstfinBlocks
 
 @enforce_types
 class BlockRange:
-    def __init__(self, st: int, fin: int, num_samples: int, random_seed=None):
+    def __init__(
+        self,
+        st: int,
+        fin: int,
+        num_samples: int,
+        random_seed=None,
+        stratified: bool = False,
+    ):
         """
         @arguments
           st -- start block
           fin -- end block
           num_samples -- # blocks to randomly sample from (without replacement)
           random_seed -- pass in an integer for predictable sampling
+          stratified -- if True, split [st, fin] into num_samples equal-width
+            strata and sample one block from each. Lower-variance averages
+
+        @notes
+          Memory use is O(num_samples), whatever the size of [st, fin]. The
+          sampling uses its own numpy Generator, so it doesn't touch the
+          global numpy rng.
         """
         assert st >= 0
         assert fin > 0
@@ -21,24 +37,27 @@ class BlockRange:
 
         self.st: int = st
         self.fin: int = fin
-
-        cand_blocks = list(range(st, fin + 1))  # []
+        self._max_block: Optional[int] = None  # see filterByMaxBlock()
 
         if num_samples == 1:
             print("WARNING: num_samples=1, so not sampling")
-            self._blocks = [fin]
+            self._blocks: List[int] = [fin]
             return
 
-        num_samples = min(num_samples, len(cand_blocks))
-        if random_seed is not None:
-            numpy.random.seed(random_seed)
+        num_cands = fin - st + 1
+        num_samples = min(num_samples, num_cands)
+        rng = numpy.random.default_rng(random_seed)
+        if stratified:
+            offsets = _sampleStrata(rng, num_cands, num_samples)
+        else:
+            offsets = _sampleWithoutReplacement(rng, num_cands, num_samples)
 
-        self._blocks = sorted(
-            numpy.random.choice(cand_blocks, num_samples, replace=False)
-        )
+        self._blocks = [st + offset for offset in sorted(offsets)]
 
     def getBlocks(self) -> list:
-        return self._blocks
+        if self._max_block is None:
+            return list(self._blocks)
+        return [b for b in self._blocks if b <= self._max_block]
 
     def numBlocks(self) -> int:
         return len(self.getBlocks())
@@ -47,13 +66,12 @@ class BlockRange:
         """
         @arguments
           max_block -- maximum block number to include in the range
-        """
-        new_blocks = []
-        for b in self.getBlocks():
-            if b <= max_block:
-                new_blocks.append(b)
 
-        self._blocks = new_blocks
+        @notes
+          Lazy: the sampled blocks are kept, and filtered on getBlocks()
+        """
+        if self._max_block is None or max_block < self._max_block:
+            self._max_block = max_block
 
     def __str__(self):
         return (
@@ -63,13 +81,39 @@ class BlockRange:
         )
 
 
-def create_range(chain, st, fin, samples, rndseed) -> BlockRange:
+@enforce_types
+def _sampleWithoutReplacement(rng: numpy.random.Generator, n: int, k: int) -> List[int]:
+    """
+    @description
+      Sample k distinct ints from [0, n), in O(k) time and memory.
+      Robert Floyd's algorithm: each int is equally likely in the sample.
+    """
+    sample: set = set()
+    for j in range(n - k, n):
+        t = int(rng.integers(0, j + 1))
+        sample.add(j if t in sample else t)
+    return list(sample)
+
+
+@enforce_types
+def _sampleStrata(rng: numpy.random.Generator, n: int, k: int) -> List[int]:
+    """Sample one int from each of k equal-width strata of [0, n)"""
+    sample = []
+    for i in range(k):
+        lo, hi = i * n // k, (i + 1) * n // k  # stratum is [lo, hi)
+        sample.append(int(rng.integers(lo, hi)))
+    return sample
+
+
+def create_range(
+    chain, st, fin, samples, rndseed, stratified: bool = False
+) -> BlockRange:
     if st == "api" or fin == "api":
         print("dfblocks has been deprecated")
         sys.exit()
 
     st_block, fin_block = getstfinBlocks(chain, st, fin)
-    rng = BlockRange(st_block, fin_block, samples, rndseed)
+    rng = BlockRange(st_block, fin_block, samples, rndseed, stratified)
     rng.filterByMaxBlock(len(chain) - 5)
 
     return rng
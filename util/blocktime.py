@@ -1,9 +1,26 @@
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from math import ceil
-from typing import Union
+import threading
+from typing import Dict, List, Optional, Union
 
+import brownie
 from enforce_typing import enforce_types
-from scipy import optimize
+import requests
+
+from util.blockindex import BlockIndex, getBlockIndex
+from util.networkutil import DEV_CHAINID
+
+# max # re-estimates in ethCalcBlockNumber()
+ETH_CALC_MAX_STEPS = 8
+
+# max # headers per batched JSON-RPC request
+HEADER_BATCH_SIZE = 8
+
+# in-process LRU cache of block timestamps, shared by all lookups
+HEADER_CACHE_SIZE = 4096
+_HEADER_CACHE: OrderedDict = OrderedDict()  # [(chainID, block)] : timestamp
+_HEADER_LOCK = threading.Lock()  # guards _HEADER_CACHE
 
 
 @enforce_types
@@ -104,64 +121,89 @@ def timestampToFutureBlock(chain, timestamp: Union[float, int]) -> int:
 
 @enforce_types
 def timestampToBlock(chain, timestamp: Union[float, int]) -> int:
-    """Example: 1648872899.0 --> 4928"""
-
-    class C:
-        def __init__(self, target_timestamp):
-            self.target_timestamp = target_timestamp
-
-        def timeSinceTimestamp(self, block_i):
-            block_timestamp = chain[int(block_i)].timestamp
-            return block_timestamp - self.target_timestamp
-
-    f = C(timestamp).timeSinceTimestamp
-    a = 0
-    b = len(chain) - 1
-
-    if f(a) > 0 and f(b) > 0:  # corner case: everything's in the past
-        return 0
+    """
+    @description
+      Example: 1648872899.0 --> 4928
 
-    if f(a) < 0 and f(b) < 0:  # corner case: everything's in the future
-        return len(chain)
+      Interpolation search for the first block at or after timestamp,
+      between the nearest blocks of known timestamp. Known timestamps are
+      kept in the chain's BlockIndex on disk. So a timestamp that's been
+      looked up before is resolved without any RPC calls.
 
-    # pylint: disable=unused-variable
-    (block_i, results) = optimize.bisect(f, a, b, xtol=0.4, full_output=True)
+    @return
+      block -- int. 0 if timestamp is before the first block; len(chain)
+        if it's after the last block
+    """
+    index = getBlockIndex(chain.id)
+    lo, hi = index.bracket(timestamp)
+
+    if lo is None:
+        lo = (0, _blockTimestamp(chain, index, 0))
+        if lo[1] >= timestamp:  # corner case: everything's in the future
+            return 0
+
+    if hi is None:
+        last_block = len(chain) - 1
+        hi = (last_block, _blockTimestamp(chain, index, last_block))
+        if hi[1] < timestamp:  # corner case: everything's in the past
+            return last_block + 1
+
+    # invariant: lo timestamp < timestamp <= hi timestamp
+    (lo_block, lo_ts), (hi_block, hi_ts) = lo, hi
+    n_probes = 0
+    while hi_block - lo_block > 1:
+        if n_probes % 2 == 0:  # interpolate
+            frac = (timestamp - lo_ts) / (hi_ts - lo_ts)
+            block = lo_block + int(frac * (hi_block - lo_block))
+        else:  # bisect, to bound the # probes if block times are irregular
+            block = (lo_block + hi_block) // 2
+        block = min(max(block, lo_block + 1), hi_block - 1)
+
+        block_ts = _blockTimestamp(chain, index, block)
+        if block_ts < timestamp:
+            lo_block, lo_ts = block, block_ts
+        else:
+            hi_block, hi_ts = block, block_ts
+        n_probes += 1
+
+    if n_probes > 0:
+        index.save()
+    return hi_block
 
-    # uncomment to debug
-    # ---
-    # print(f"iterations = {results.iterations}")
-    # print(f"function calls = {results.function_calls}")
-    # print(f"converged? {results.converged}")
-    # print(f"cause of termination? {results.flag}")
-    # print("")
-    # print(f"target timestamp = {timestamp}")
-    # print(f"distToTargetTimestamp(a=0) = {f(0)}")
-    # print(f"distToTargetTimestamp(b={b}) = {f(b)}")
-    # print(f"distToTargetTimestamp(result=block_i={block_i}) = {f(block_i)}")
-    # ---
 
-    return int(block_i)
+@enforce_types
+def _blockTimestamp(chain, index: BlockIndex, block: int) -> int:
+    """Fetch the timestamp of a block, and record it in index"""
+    timestamp = _blockTimestamps(chain, [block])[0]
+    index.add(block, timestamp)
+    return timestamp
 
 
 @enforce_types
 def ethTimestamptoBlock(chain, timestamp: Union[float, int]) -> int:
     """Example: 1648872899.0 --> 4928"""
-    current_block = chain[-1].number
-    current_time = chain[-1].timestamp
+    head = chain[-1]
     return ethCalcBlockNumber(
-        int(current_time), int(current_block), int(timestamp), chain
+        int(head.timestamp), int(head.number), int(timestamp), chain
     )
 
 
 @enforce_types
-def ethCalcBlockNumber(ts: int, block: int, target_ts: int, chain):
+def ethCalcBlockNumber(ts: int, block: int, target_ts: int, chain) -> int:
+    """
+    @description
+      Estimate the block at target_ts, from a block and its timestamp ts,
+      at the average block time. Re-estimate from the estimated block
+      until it's within 5 blocks of target_ts, up to ETH_CALC_MAX_STEPS
+      times. ethFindClosestBlock() then finds the exact block.
+    """
     AVG_BLOCK_TIME = 12.06  # seconds
-    diff = target_ts - ts
-    diff_blocks = int(diff // AVG_BLOCK_TIME)
-    block += diff_blocks
-    ts_found = chain[block].timestamp
-    if abs(ts_found - target_ts) > 12 * 5:
-        return ethCalcBlockNumber(ts_found, block, target_ts, chain)
+    for _ in range(ETH_CALC_MAX_STEPS):
+        diff = target_ts - ts
+        block = max(0, block + int(diff // AVG_BLOCK_TIME))
+        ts = _blockTimestamps(chain, [block])[0]
+        if abs(ts - target_ts) <= 12 * 5:
+            break
 
     return block
 
@@ -171,36 +213,154 @@ def ethFindClosestBlock(chain, block_number: int, timestamp: Union[float, int])
     """
     @arguments
         chain -- brownie.networks.chain
-        block_number -- int
+        block_number -- int, a guess of the block
         timestamp -- int
     @return
         block_number -- int
     @description
-        Finds the closest block number to given timestamp
+        Finds the closest block number to given timestamp. On a tie, the
+        later block.
+
+        Galloping search from block_number: steps of 1, 2, 4, .. blocks
+        until timestamp is bracketed, then a k-ary search of the bracket.
+        Each round fetches HEADER_BATCH_SIZE headers in one batched
+        request, so it takes O(log distance) requests.
     """
+    timestamps: Dict[int, int] = {}  # block : timestamp, of fetched blocks
+
+    def fetch(blocks: List[int]):
+        blocks = sorted(set(blocks) - set(timestamps))
+        timestamps.update(zip(blocks, _blockTimestamps(chain, blocks)))
+
+    # gallop, to bracket the first block at or after timestamp in (lo, hi].
+    # lo = -1 means there's no block before; hi = end, no block after
+    end = None  # len(chain), only queried if needed
+    fetch([block_number])
+    if timestamps[block_number] < timestamp:
+        lo, hi, end = block_number, None, len(chain)
+        step = 1
+        while hi is None:
+            probes = [min(lo + step * 2**k, end - 1) for k in range(HEADER_BATCH_SIZE)]
+            fetch(probes)
+            for block in probes:
+                if timestamps[block] >= timestamp:
+                    hi = block
+                    break
+                lo = block
+            if hi is None and lo == end - 1:
+                hi = end
+            step *= 2**HEADER_BATCH_SIZE
+    else:
+        lo, hi = None, block_number
+        step = 1
+        while lo is None:
+            probes = [max(hi - step * 2**k, 0) for k in range(HEADER_BATCH_SIZE)]
+            fetch(probes)
+            for block in probes:
+                if timestamps[block] < timestamp:
+                    lo = block
+                    break
+                hi = block
+            if lo is None and hi == 0:
+                lo = -1
+            step *= 2**HEADER_BATCH_SIZE
+
+    # k-ary search
+    while hi - lo > 1:
+        n_probes = min(HEADER_BATCH_SIZE, hi - lo - 1)
+        probes = [lo + (hi - lo) * (i + 1) // (n_probes + 1) for i in range(n_probes)]
+        fetch(probes)
+        for block in probes:
+            if timestamps[block] < timestamp:
+                lo = block
+            else:
+                hi = block
+                break
 
-    block_ts = chain[block_number].timestamp
-    found = block_number
+    if lo == -1:
+        return hi
+    if hi == end:
+        return lo
+    if abs(timestamps[lo] - timestamp) < abs(timestamps[hi] - timestamp):
+        return lo
+    return hi
 
-    last = None
-    if block_ts > timestamp:
-        # search backwards
-        while True:
-            last = found
-            found -= 1
-            if chain[found].timestamp < timestamp:
-                break
 
-    else:
-        # search forwards
-        while True:
-            last = found
-            found += 1
-            if chain[found].timestamp > timestamp:
-                break
-    if abs(chain[last].timestamp - timestamp) < abs(chain[found].timestamp - timestamp):
-        found = last
-    return found
+@enforce_types
+def _blockTimestamps(chain, blocks: List[int]) -> List[int]:
+    """
+    @description
+      Return the timestamps of the given blocks. Headers not in the
+      in-process LRU cache are fetched with one batched JSON-RPC request.
+      Not cached on the dev chain, which gets reset.
+    """
+    cacheable = chain.id != DEV_CHAINID
+    timestamps: Dict[int, int] = {}
+    if cacheable:
+        with _HEADER_LOCK:
+            for block in blocks:
+                if (chain.id, block) in _HEADER_CACHE:
+                    _HEADER_CACHE.move_to_end((chain.id, block))
+                    timestamps[block] = _HEADER_CACHE[(chain.id, block)]
+
+    missing = [block for block in dict.fromkeys(blocks) if block not in timestamps]
+    if missing:
+        fetched = _fetchBlockTimestamps(chain, missing)
+        timestamps.update(fetched)
+        if cacheable:
+            with _HEADER_LOCK:
+                for block, timestamp in fetched.items():
+                    _HEADER_CACHE[(chain.id, block)] = timestamp
+                while len(_HEADER_CACHE) > HEADER_CACHE_SIZE:
+                    _HEADER_CACHE.popitem(last=False)
+
+    return [timestamps[block] for block in blocks]
+
+
+@enforce_types
+def _fetchBlockTimestamps(chain, blocks: List[int]) -> Dict[int, int]:
+    """
+    @description
+      Fetch the timestamps of blocks, in one batched JSON-RPC request if
+      the rpc is http. Any block the batch didn't return is fetched alone.
+
+    @return
+      timestamps -- dict of [block] : timestamp
+    """
+    timestamps: Dict[int, int] = {}
+    uri = _batchRpcUri(chain)
+    if uri is not None and len(blocks) > 1:
+        calls = [
+            {
+                "jsonrpc": "2.0",
+                "id": i,
+                "method": "eth_getBlockByNumber",
+                "params": [hex(block), False],
+            }
+            for i, block in enumerate(blocks)
+        ]
+        resp = requests.post(uri, json=calls, timeout=30)
+        results = resp.json() if resp.status_code == 200 else None
+        if isinstance(results, list):  # else the rpc doesn't do batches
+            for result in results:
+                if isinstance(result.get("result"), dict):
+                    block = blocks[result["id"]]
+                    timestamps[block] = int(result["result"]["timestamp"], 16)
+
+    for block in blocks:
+        if block not in timestamps:
+            timestamps[block] = int(chain[block].timestamp)
+    return timestamps
+
+
+def _batchRpcUri(chain) -> Optional[str]:
+    """Return the http uri of brownie's rpc if chain is brownie's, else None"""
+    if chain is not brownie.network.chain:
+        return None
+    uri = getattr(brownie.web3.provider, "endpoint_uri", None)
+    if isinstance(uri, str) and uri.startswith("http"):
+        return uri
+    return None
 
 
 @enforce_types
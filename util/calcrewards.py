@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from enforce_typing import enforce_types
 import numpy as np
@@ -11,6 +11,15 @@ from util.constants import MAX_N_RANK_ASSETS, RANK_SCALE_OP
 # Weekly Percent Yield needs to be 1.5717%., for max APY of 125%
 TARGET_WPY = 0.015717
 
+# Represent stakes S as a sparse matrix if the fraction of nonzero {i,j}
+# entries is below this. Most LPs allocate to just a handful of nfts
+SPARSE_MAX_DENSITY = 0.05
+
+# (LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j). See _getKeysTuple()
+KeysTuple = Tuple[
+    List[str], List[Tuple[int, str]], Dict[str, int], Dict[Tuple[int, str], int]
+]
+
 
 @enforce_types
 def getDfWeekNumber(dt: datetime) -> int:
@@ -110,40 +119,84 @@ def calcRewards(
 def _getKeysTuple(
     stakes: Dict[int, Dict[str, Dict[str, float]]],
     nftvols_USD: Dict[int, Dict[str, str]],
-) -> Tuple[List[str], List[Tuple[int, str]]]:
-    """@return -- tuple of (LP_addrs_list, chain_nft_tups)"""
+) -> KeysTuple:
+    """
+    @return
+      keys_tup -- tuple of:
+        LP_addrs -- list of LP addrs, indexed by i
+        chain_nft_tups -- list of (chainID, nft_addr), indexed by j
+        LP_addr_to_i -- dict of [LP_addr] : i. Inverse of LP_addrs
+        chain_nft_to_j -- dict of [(chainID, nft_addr)] : j. Inverse of tups
+
+    @notes
+      The dicts are built once here, so that the array builders and
+      _rewardArrayToDicts() look up rows & columns in O(1).
+    """
     chain_nft_tups = _getChainNftTups(stakes, nftvols_USD)
     LP_addrs = _getLpAddrs(stakes)
-    return (LP_addrs, chain_nft_tups)
+    LP_addr_to_i = {LP_addr: i for i, LP_addr in enumerate(LP_addrs)}
+    chain_nft_to_j = {tup: j for j, tup in enumerate(chain_nft_tups)}
+    return (LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j)
 
 
 @enforce_types
 def _stakeVolDictsToArrays(
     stakes: Dict[int, Dict[str, Dict[str, float]]],
     nftvols_USD: Dict[int, Dict[str, str]],
-    keys_tup: Tuple[List[str], List[Tuple[int, str]]],
-) -> Tuple[np.ndarray, np.ndarray]:
+    keys_tup: KeysTuple,
+    sparse_S: Optional[bool] = None,
+) -> Tuple[Union[np.ndarray, scipy.sparse.csc_matrix], np.ndarray]:
     """
     @arguments
       stakes - dict of [chainID][nft_addr][LP_addr] : veOCEAN_float
       nftvols_USD -- dict of [chainID][nft_addr] : vol_USD_float
-      keys_tup -- tuple of (LP_addrs_list, chain_nft_tups)
+      keys_tup -- tuple of (LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j)
+      sparse_S -- return S as sparse? If None, decide via SPARSE_MAX_DENSITY
 
     @return
-      S -- 2d array of [LP i, chain_nft j] -- stake for each {i,j}, in veOCEAN
+      S -- 2d array of [LP i, chain_nft j] -- stake for each {i,j}, in veOCEAN.
+        A scipy.sparse.csc_matrix if sparse, otherwise an np.ndarray
       V_USD -- 1d array of [chain_nft j] -- nftvol for each {j}, in USD
     """
-    LP_addrs, chain_nft_tups = keys_tup
+    LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j = keys_tup
     N_j = len(chain_nft_tups)
     N_i = len(LP_addrs)
 
-    S = np.zeros((N_i, N_j), dtype=float)
+    # gather the nonzero {i,j} entries of S. Linear in # stake entries
+    I: List[int] = []
+    J: List[int] = []
+    stakes_IJ: List[float] = []
+    for chainID, stakes_at_chain in stakes.items():
+        for nft_addr, stakes_at_nft in stakes_at_chain.items():
+            j = chain_nft_to_j.get((chainID, nft_addr))
+            if j is None:  # nft without volume
+                continue
+            for LP_addr, stake in stakes_at_nft.items():
+                I.append(LP_addr_to_i[LP_addr])
+                J.append(j)
+                stakes_IJ.append(stake)
+
+    # nft j's vol is multiplied by the # LPs N_i. The DCV bound relies on this.
+    # Summed N_i times rather than multiplied, to stay bit-identical to adding
+    # it once per LP. cumsum adds in order, unlike sum()
     V_USD = np.zeros(N_j, dtype=float)
+    vol_to_sum: Dict[float, float] = {}
     for j, (chainID, nft_addr) in enumerate(chain_nft_tups):
-        for i, LP_addr in enumerate(LP_addrs):
-            assert nft_addr in stakes[chainID], "each tup should be in stakes"
-            S[i, j] = stakes[chainID][nft_addr].get(LP_addr, 0.0)
-            V_USD[j] += nftvols_USD[chainID].get(nft_addr, 0.0)
+        assert nft_addr in stakes[chainID], "each tup should be in stakes"
+        vol = nftvols_USD[chainID].get(nft_addr, 0.0)
+        if vol not in vol_to_sum:
+            vol_to_sum[vol] = np.cumsum(np.full(N_i, vol))[-1] if N_i else 0.0
+        V_USD[j] = vol_to_sum[vol]
+
+    if sparse_S is None:
+        sparse_S = len(stakes_IJ) < SPARSE_MAX_DENSITY * N_i * N_j
+
+    if sparse_S:
+        S = scipy.sparse.csc_matrix((stakes_IJ, (I, J)), shape=(N_i, N_j))
+        S.sort_indices()
+    else:
+        S = np.zeros((N_i, N_j), dtype=float)
+        S[I, J] = stakes_IJ
 
     return S, V_USD
 
@@ -151,12 +204,12 @@ def _stakeVolDictsToArrays(
 @enforce_types
 def _ownerDictToArray(
     owners: Dict[int, Dict[str, str]],
-    keys_tup: Tuple[List[str], List[Tuple[int, str]]],
+    keys_tup: KeysTuple,
 ) -> np.ndarray:
     """
     @arguments
       owners -- dict of [chainID][nft_addr] : owner_addr
-      keys_tup -- tuple of (LP_addrs_list, chain_nft_tups)
+      keys_tup -- tuple of (LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j)
 
     @return
       C -- 1d array of [chain_nft j] -- the LP i that created j
@@ -165,33 +218,31 @@ def _ownerDictToArray(
       If a owner of an nft didn't LP anywhere, then it won't have an LP i.
       In this case, P[chain_nft j] will be set to -1
     """
-    LP_addrs, chain_nft_tups = keys_tup
+    _, chain_nft_tups, LP_addr_to_i, _ = keys_tup
     N_j = len(chain_nft_tups)
 
     C = np.zeros(N_j, dtype=int)
     for j, (chainID, nft_addr) in enumerate(chain_nft_tups):
         owner_addr = owners[chainID][nft_addr]
-        if owner_addr not in LP_addrs:
-            C[j] = -1
-        else:
-            C[j] = LP_addrs.index(owner_addr)
+        C[j] = LP_addr_to_i.get(owner_addr, -1)
 
     return C
 
 
 @enforce_types
 def _calcRewardsUsd(
-    S: np.ndarray,
+    S: Union[np.ndarray, scipy.sparse.csc_matrix],
     V_USD: np.ndarray,
     C: np.ndarray,
     DCV_multiplier: float,
     OCEAN_avail: float,
     do_pubrewards: bool,
     do_rank: bool,
-) -> np.ndarray:
+) -> Union[np.ndarray, scipy.sparse.csc_matrix]:
     """
     @arguments
-      S -- 2d array of [LP i, chain_nft j] -- stake for each {i,j}, in veOCEAN
+      S -- 2d array of [LP i, chain_nft j] -- stake for each {i,j}, in veOCEAN.
+        Dense np.ndarray, or sparse csc_matrix
       V_USD -- 1d array of [chain_nft j] -- nftvol for each {j}, in USD
       C -- 1d array of [chain_nft j] -- the LP i that created j. -1 if not LP
       DCV_multiplier -- via calcDcvMultiplier(DF_week). Is an arg to help test.
@@ -200,20 +251,14 @@ def _calcRewardsUsd(
       do_rank -- allocate OCEAN to assets by DCV rank, vs pro-rata
 
     @return
-      R -- 2d array of [LP i, chain_nft j] -- rewards denominated in OCEAN
+      R -- 2d array of [LP i, chain_nft j] -- rewards denominated in OCEAN.
+        Sparse csc_matrix if S is sparse, otherwise dense np.ndarray
     """
-    N_i, N_j = S.shape
+    is_sparse = scipy.sparse.issparse(S)
 
     # corner case
     if np.sum(V_USD) == 0.0:
-        return np.zeros((N_i, N_j), dtype=float)
-
-    # modify S's: owners get rewarded as if 2x stake on their asset
-    if do_pubrewards:
-        S = np.copy(S)
-        for j in range(N_j):
-            if C[j] != -1:  # -1 = owner didn't stake
-                S[C[j], j] *= 2.0
+        return _zeroRewards(S.shape, is_sparse)
 
     # perc_per_j
     if do_rank:
@@ -222,47 +267,137 @@ def _calcRewardsUsd(
         perc_per_j = V_USD / np.sum(V_USD)
 
     # compute rewards
-    R = np.zeros((N_i, N_j), dtype=float)
-    for j in range(N_j):
-        stake_j = sum(S[:, j])
-        DCV_j = V_USD[j]
-        if stake_j == 0.0 or DCV_j == 0.0:
-            continue
-
-        for i in range(N_i):
-            perc_at_j = perc_per_j[j]
-
-            stake_ij = S[i, j]
-            perc_at_ij = stake_ij / stake_j
-
-            # main formula!
-            R[i, j] = min(
-                perc_at_j * perc_at_ij * OCEAN_avail,
-                stake_ij * TARGET_WPY,  # bound rewards by max APY
-                DCV_j * DCV_multiplier,  # bound rewards by DCV
-            )
+    args = (V_USD, C, perc_per_j, DCV_multiplier, OCEAN_avail, do_pubrewards)
+    if is_sparse:
+        R = _calcRewardsUsdSparse(S, *args)
+        R_vals = R.data  # view of the nonzero entries, for in-place updates
+    else:
+        R = _calcRewardsUsdDense(S, *args)
+        R_vals = R
 
     # filter negligible values
-    R[R < 0.000001] = 0.0
+    R_vals[R_vals < 0.000001] = 0.0
+    if is_sparse:
+        R.eliminate_zeros()
+        R_vals = R.data
 
-    if np.sum(R) == 0.0:
-        return np.zeros((N_i, N_j), dtype=float)
+    if np.sum(R_vals) == 0.0:
+        return _zeroRewards(S.shape, is_sparse)
 
     # postcondition: nans
-    assert not np.isnan(np.min(R)), R
+    assert not np.isnan(np.min(R_vals)), R
 
     # postcondition: sum is ok. First check within a tol; shrink if needed
-    sum1 = np.sum(R)
+    sum1 = np.sum(R_vals)
     tol = 1e-13
     assert sum1 <= OCEAN_avail * (1 + tol), (sum1, OCEAN_avail, R)
     if sum1 > OCEAN_avail:
-        R /= 1 + tol
-    sum2 = np.sum(R)
+        R_vals /= 1 + tol
+    sum2 = np.sum(R_vals)
     assert sum1 <= OCEAN_avail * (1 + tol), (sum2, OCEAN_avail, R)
 
     return R
 
 
+@enforce_types
+def _calcRewardsUsdDense(
+    S: np.ndarray,
+    V_USD: np.ndarray,
+    C: np.ndarray,
+    perc_per_j: np.ndarray,
+    DCV_multiplier: float,
+    OCEAN_avail: float,
+    do_pubrewards: bool,
+) -> np.ndarray:
+    """Main formula of _calcRewardsUsd(), for dense S. Returns dense R"""
+    N_i, N_j = S.shape
+
+    # modify S's: owners get rewarded as if 2x stake on their asset
+    if do_pubrewards:
+        S = np.copy(S)
+        J_owned = np.where(C != -1)[0]  # -1 = owner didn't stake
+        S[C[J_owned], J_owned] *= 2.0
+
+    # compute rewards. Only for j's with both stake and DCV; others stay 0.
+    # Ops are in-place where possible: at 100k LPs, temporaries dominate time
+    stake_per_j = np.sum(S, axis=0)  # row-by-row, same order as python sum()
+    J = np.where((stake_per_j != 0.0) & (V_USD != 0.0))[0]
+    R = np.zeros((N_i, N_j), dtype=float)
+    if len(J) > 0:
+        S_J = S[:, J]  # a copy, so ok to modify
+
+        # main formula! Per-cell min of three bounds:
+        # -perc_at_j * perc_at_ij * OCEAN_avail
+        # -stake_ij * TARGET_WPY  (bound rewards by max APY)
+        # -DCV_j * DCV_multiplier  (bound rewards by DCV)
+        R_J = S_J / stake_per_j[J]  # perc_at_ij
+        R_J *= perc_per_j[J]
+        R_J *= OCEAN_avail
+        S_J *= TARGET_WPY
+        np.minimum(R_J, S_J, out=R_J)
+        np.minimum(R_J, V_USD[J] * DCV_multiplier, out=R_J)
+        R[:, J] = R_J
+
+    return R
+
+
+@enforce_types
+def _calcRewardsUsdSparse(
+    S: scipy.sparse.csc_matrix,
+    V_USD: np.ndarray,
+    C: np.ndarray,
+    perc_per_j: np.ndarray,
+    DCV_multiplier: float,
+    OCEAN_avail: float,
+    do_pubrewards: bool,
+) -> scipy.sparse.csc_matrix:
+    """
+    Main formula of _calcRewardsUsd(), for sparse S. Returns sparse R.
+
+    R_ij is 0 wherever S_ij is 0, so R has the same structure as S, and
+    we only compute on the stored entries. Results equal the dense path.
+    """
+    N_j = S.shape[1]
+    S = S.copy()
+    S.sort_indices()  # rows ascending within each column, like dense
+
+    # j for each stored entry
+    cols = np.repeat(np.arange(N_j), np.diff(S.indptr))
+
+    # modify S's: owners get rewarded as if 2x stake on their asset
+    if do_pubrewards:
+        S.data[S.indices == C[cols]] *= 2.0  # -1 = owner didn't stake
+
+    # compute rewards. Only for j's with both stake and DCV; others stay 0
+    stake_per_j = np.bincount(cols, weights=S.data, minlength=N_j)  # in order
+    J_ok = (stake_per_j != 0.0) & (V_USD != 0.0)
+    K = np.where(J_ok[cols])[0]  # stored entries to compute on
+    cols_K = cols[K]
+    S_K = S.data[K]
+
+    # main formula! Per-cell min of three bounds. See _calcRewardsUsdDense()
+    R_K = S_K / stake_per_j[cols_K]  # perc_at_ij
+    R_K *= perc_per_j[cols_K]
+    R_K *= OCEAN_avail
+    S_K *= TARGET_WPY
+    np.minimum(R_K, S_K, out=R_K)
+    np.minimum(R_K, V_USD[cols_K] * DCV_multiplier, out=R_K)
+
+    R_data = np.zeros(len(S.data), dtype=float)
+    R_data[K] = R_K
+    return scipy.sparse.csc_matrix((R_data, S.indices, S.indptr), shape=S.shape)
+
+
+@enforce_types
+def _zeroRewards(
+    shape: Tuple[int, int], is_sparse: bool
+) -> Union[np.ndarray, scipy.sparse.csc_matrix]:
+    """Return an all-zero R, in the same representation as S"""
+    if is_sparse:
+        return scipy.sparse.csc_matrix(shape, dtype=float)
+    return np.zeros(shape, dtype=float)
+
+
 def _rankBasedAllocate(
     V_USD: np.ndarray,
     max_n_rank_assets: int = MAX_N_RANK_ASSETS,
@@ -326,13 +461,14 @@ def _rankBasedAllocate(
 
 @enforce_types
 def _rewardArrayToDicts(
-    R: np.ndarray,
-    keys_tup: Tuple[List[str], List[Tuple[int, str]]],
+    R: Union[np.ndarray, scipy.sparse.csc_matrix],
+    keys_tup: KeysTuple,
 ) -> Tuple[dict, dict]:
     """
     @arguments
-      R -- 2d array of [LP i, chain_nft j]; each entry is denominated in OCEAN
-      keys_tup -- tuple of (LP_addrs_list, chain_nft_tups)
+      R -- 2d array of [LP i, chain_nft j]; each entry is denominated in OCEAN.
+        Dense np.ndarray, or sparse csc_matrix
+      keys_tup -- tuple of (LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j)
 
     @return
       rewardsperlp -- dict of [chainID][LP_addr] : OCEAN_reward_float
@@ -342,27 +478,37 @@ def _rewardArrayToDicts(
       In the return dicts, chainID is the chain of the nft, not the
       chain where rewards go.
     """
-    LP_addrs, chain_nft_tups = keys_tup
+    LP_addrs, chain_nft_tups, _, _ = keys_tup
+
+    # nonzero entries, ordered by i then j
+    if scipy.sparse.issparse(R):
+        R_coo = R.tocoo()
+        order = np.lexsort((R_coo.col, R_coo.row))
+        I, J, R_IJ = R_coo.row[order], R_coo.col[order], R_coo.data[order]
+    else:
+        I, J = np.nonzero(R)
+        R_IJ = R[I, J]
+    assert np.all(R_IJ >= 0.0), R_IJ[R_IJ < 0.0]
 
     rewardsperlp: dict = {}
     rewardsinfo: dict = {}
-    for i, LP_addr in enumerate(LP_addrs):
-        for j, (chainID, nft_addr) in enumerate(chain_nft_tups):
-            assert R[i, j] >= 0.0, R[i, j]
-            if R[i, j] == 0.0:
-                continue
-
-            if chainID not in rewardsperlp:
-                rewardsperlp[chainID] = {}
-            if LP_addr not in rewardsperlp[chainID]:
-                rewardsperlp[chainID][LP_addr] = 0.0
-            rewardsperlp[chainID][LP_addr] += R[i, j]
-
-            if chainID not in rewardsinfo:
-                rewardsinfo[chainID] = {}
-            if nft_addr not in rewardsinfo[chainID]:
-                rewardsinfo[chainID][nft_addr] = {}
-            rewardsinfo[chainID][nft_addr][LP_addr] = R[i, j]
+    for i, j, R_ij in zip(I.tolist(), J.tolist(), R_IJ.tolist()):
+        if R_ij == 0.0:
+            continue
+        LP_addr = LP_addrs[i]
+        chainID, nft_addr = chain_nft_tups[j]
+
+        if chainID not in rewardsperlp:
+            rewardsperlp[chainID] = {}
+        if LP_addr not in rewardsperlp[chainID]:
+            rewardsperlp[chainID][LP_addr] = 0.0
+        rewardsperlp[chainID][LP_addr] += R_ij
+
+        if chainID not in rewardsinfo:
+            rewardsinfo[chainID] = {}
+        if nft_addr not in rewardsinfo[chainID]:
+            rewardsinfo[chainID][nft_addr] = {}
+        rewardsinfo[chainID][nft_addr][LP_addr] = R_ij
 
     return rewardsperlp, rewardsinfo
 
@@ -1,9 +1,36 @@
-import brownie
+import threading
 
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 
 AQUARIUS_BASE_URL = "https://v4.aquarius.oceanprotocol.com"
-BROWNIE_PROJECT = brownie.project.load("./", name="MyProject")
+
+_BROWNIE_PROJECT = None
+_BROWNIE_PROJECT_LOCK = threading.Lock()  # guards _BROWNIE_PROJECT
+
+
+def getBrownieProject():
+    """
+    Return the brownie project of this repo's contracts. Loaded on first
+    call, since loading compiles or reads every contract: most dftool
+    commands never need it.
+    """
+    global _BROWNIE_PROJECT
+    with _BROWNIE_PROJECT_LOCK:
+        if _BROWNIE_PROJECT is None:
+            import brownie  # pylint: disable=import-outside-toplevel
+
+            _BROWNIE_PROJECT = brownie.project.load("./", name="MyProject")
+        return _BROWNIE_PROJECT
+
+
+class _LazyBrownieProject:
+    """Stands in for the brownie project, loading it on first attribute use"""
+
+    def __getattr__(self, name: str):
+        return getattr(getBrownieProject(), name)
+
+
+BROWNIE_PROJECT = _LazyBrownieProject()  # eg BROWNIE_PROJECT.Simpletoken
 
 MAX_ALLOCATE = 10000.0
 ACTIVE_REWARDS_MULTIPLIER = 0.5
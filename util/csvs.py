@@ -1,5 +1,6 @@
 import csv
 import glob
+import json
 import os
 import re
 from typing import Any, Dict, List, Tuple
@@ -417,6 +418,48 @@ def chainIDforNftinfoCsv(filename) -> int:
     return _lastInt(filename)
 
 
+@enforce_types
+def saveNftinfoCheckpoint(checkpoint: dict, csv_dir: str, chainID: int):
+    """
+    @description
+      Save the nftinfo checkpoint for this chain, overwriting any previous one.
+
+    @arguments
+      checkpoint -- dict with "chainID", "fin" (block # of nftinfo csv),
+        "full_at" (unix time of the last full query)
+      csv_dir -- directory that holds csv files
+      chainID -- which network
+    """
+    assert os.path.exists(csv_dir), csv_dir
+    filename = nftinfoCheckpointFilename(csv_dir, chainID)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_filename, filename)  # so a crash never leaves a partial file
+    print(f"Saved {filename} at block {checkpoint['fin']}")
+
+
+@enforce_types
+def loadNftinfoCheckpoint(csv_dir: str, chainID: int) -> dict:
+    """
+    @description
+      Load the nftinfo checkpoint for this chain. Empty dict if there's none.
+    """
+    filename = nftinfoCheckpointFilename(csv_dir, chainID)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        checkpoint = json.load(f)
+    print(f"Loaded {filename}")
+    return checkpoint
+
+
+@enforce_types
+def nftinfoCheckpointFilename(csv_dir: str, chainID: int) -> str:
+    """Returns the nftinfo checkpoint filename for a given chainID"""
+    return os.path.join(csv_dir, f"nftinfo-checkpoint-{chainID}.json")
+
+
 # ========================================================================
 # nftvols csvs
 
@@ -520,6 +563,51 @@ def chainIDforNftvolsCsv(filename) -> int:
     return _lastInt(filename)
 
 
+# ========================================================================
+# volsym checkpoint (json, not csv: it holds nested partial aggregates)
+
+
+@enforce_types
+def saveVolsymCheckpoint(checkpoint: dict, csv_dir: str, chainID: int):
+    """
+    @description
+      Save the volsym checkpoint for this chain, overwriting any previous one.
+
+    @arguments
+      checkpoint -- dict, see query._updateVolsCheckpoint()
+      csv_dir -- directory that holds csv files
+      chainID -- which network
+    """
+    assert os.path.exists(csv_dir), csv_dir
+    filename = volsymCheckpointFilename(csv_dir, chainID)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_filename, filename)  # so a crash never leaves a partial file
+    print(f"Saved {filename} at block {checkpoint['fin']}")
+
+
+@enforce_types
+def loadVolsymCheckpoint(csv_dir: str, chainID: int) -> dict:
+    """
+    @description
+      Load the volsym checkpoint for this chain. Empty dict if there's none.
+    """
+    filename = volsymCheckpointFilename(csv_dir, chainID)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        checkpoint = json.load(f)
+    print(f"Loaded {filename}")
+    return checkpoint
+
+
+@enforce_types
+def volsymCheckpointFilename(csv_dir: str, chainID: int) -> str:
+    """Returns the volsym checkpoint filename for a given chainID"""
+    return os.path.join(csv_dir, f"volsym-checkpoint-{chainID}.json")
+
+
 # ========================================================================
 # owners csvs
 
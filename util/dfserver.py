@@ -0,0 +1,189 @@
+# Long-lived dftool process: 'dftool serve SOCKET_PATH' runs subcommands sent
+# over a local Unix socket, so that they don't each pay for importing brownie,
+# loading the project and connecting to the chain.
+#
+# Protocol: the client sends one json line {"argv": [SUBCOMMAND, ARG1, ..]}.
+# The server replies with json lines {"output": TEXT} as the subcommand prints,
+# then {"returncode": N}. One connection per subcommand.
+#
+# The client, submit(), only needs the standard library. From a shell:
+#   python util/dfserver.py SOCKET_PATH SUBCOMMAND ARG1 ARG2 ..
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Callable, TextIO
+
+# subcommands that can't run inside the server
+NOT_SERVED = ["serve"]
+
+
+class _SocketWriter:
+    """Text stream that sends each write to the client as an output message"""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()  # subcommands may print from threads
+        self._closed = False
+
+    def write(self, s: str) -> int:
+        if s:
+            self._send({"output": s})
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def sendReturncode(self, returncode: int):
+        self._send({"returncode": returncode})
+
+    def _send(self, msg: dict):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._wfile.write((json.dumps(msg) + "\n").encode())
+                self._wfile.flush()
+            except OSError:
+                # client went away. Keep running the subcommand regardless,
+                # like a cli command whose terminal closed
+                self._closed = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        out = _SocketWriter(self.wfile)
+        try:
+            argv = json.loads(self.rfile.readline())["argv"]
+            assert isinstance(argv, list) and all(isinstance(a, str) for a in argv)
+        except (ValueError, KeyError, TypeError, AssertionError):
+            out.write("Bad request. Expected a json line {'argv': [..]}\n")
+            out.sendReturncode(1)
+            return
+        out.sendReturncode(runCommand(self.server.main_f, argv, out))
+
+
+class DftoolServer(socketserver.UnixStreamServer):
+    """
+    Unix socket server that runs one subcommand at a time, in the server
+    process. Subcommands share its sys.argv, stdout and brownie network.
+    """
+
+    def __init__(self, socket_path: str, main_f: Callable[[], None]):
+        self.main_f = main_f
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # stale, from a server that got killed
+        super().__init__(socket_path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def runCommand(main_f: Callable[[], None], argv: list, out: TextIO) -> int:
+    """
+    @description
+      Run a subcommand like 'dftool ARGV..' does, with its output to out.
+
+    @arguments
+      main_f -- function that runs the subcommand in sys.argv, eg _do_main
+      argv -- [SUBCOMMAND, ARG1, ARG2, ..]
+      out -- where stdout and stderr go
+
+    @return
+      returncode -- what 'dftool ARGV..' would exit with
+    """
+    if argv and argv[0] in NOT_SERVED:
+        out.write(f"'dftool {argv[0]}' can't run inside 'dftool serve'\n")
+        return 1
+
+    prev_argv = sys.argv
+    sys.argv = ["dftool"] + argv
+    try:
+        with redirect_stdout(out), redirect_stderr(out):
+            try:
+                main_f()
+            except SystemExit as e:
+                return _exitCode(e.code)
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+                return 1
+        return 0
+    finally:
+        sys.argv = prev_argv
+
+
+def _exitCode(code) -> int:
+    """Return the returncode of sys.exit(code), like the interpreter does"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def serve(socket_path: str, main_f: Callable[[], None]):
+    """
+    @description
+      Run subcommands sent to socket_path, until SIGTERM or ctrl-c.
+      A running subcommand gets interrupted, then the socket is removed.
+
+    @arguments
+      socket_path -- path of the Unix socket to create
+      main_f -- function that runs the subcommand in sys.argv, eg _do_main
+    """
+
+    def _interrupt(signum, frame):  # pylint: disable=unused-argument
+        # not SystemExit, which runCommand() takes as the subcommand's exit
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    with DftoolServer(socket_path, main_f) as server:
+        print(f"dftool serve: listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("dftool serve: stopped")
+
+
+def submit(socket_path: str, argv: list, out: TextIO = sys.stdout) -> int:
+    """
+    @description
+      Run a subcommand in the 'dftool serve' listening on socket_path.
+
+    @arguments
+      socket_path -- path of the server's Unix socket
+      argv -- [SUBCOMMAND, ARG1, ARG2, ..]
+      out -- where the subcommand's output goes, as it prints
+
+    @return
+      returncode -- of the subcommand. 1 if the server closed the
+        connection before the subcommand finished
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps({"argv": argv}) + "\n").encode())
+        with sock.makefile("r") as f:
+            for line in f:
+                msg = json.loads(line)
+                if "returncode" in msg:
+                    return msg["returncode"]
+                out.write(msg["output"])
+                out.flush()
+
+    out.write("dftool serve closed the connection\n")
+    return 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python util/dfserver.py SOCKET_PATH SUBCOMMAND ARG1 ARG2 ..")
+        sys.exit(1)
+    sys.exit(submit(sys.argv[1], sys.argv[2:]))
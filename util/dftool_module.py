@@ -1,36 +1,30 @@
-# pylint: disable=too-many-lines,too-many-statements
+# pylint: disable=too-many-lines,too-many-statements,import-outside-toplevel
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import functools
 import os
 import sys
+import time
 
 import brownie
 from enforce_typing import enforce_types
 from web3.middleware import geth_poa_middleware
 
+# subcommand-specific modules are imported in their do_*() functions, so that
+# every dftool call doesn't pay for them. Eg util.challenge imports ccxt
 from util import (
-    allocations,
     blockrange,
-    calcrewards,
     constants,
     csvs,
-    dispense,
-    getrate,
+    graphutil,
     networkutil,
     query,
 )
 from util.base18 import from_wei
 from util.blocktime import getfinBlock, timestrToTimestamp
-from util.calcrewards import calcRewards
-from util.challenge import judge
 from util.constants import BROWNIE_PROJECT as B
 from util.multisig import send_multisig_tx
 from util.networkutil import DEV_CHAINID, chainIdToMultisigAddr
-from util.oceantestutil import (
-    randomConsumeFREs,
-    randomCreateDataNFTWithFREs,
-    randomLockAndAllocate,
-)
 from util.oceanutil import (
     FeeDistributor,
     OCEANtoken,
@@ -38,7 +32,6 @@ from util.oceanutil import (
     veAllocate,
 )
 from util.retry import retryFunction
-from util.vesting_schedule import getActiveRewardAmountForWeekEth
 
 brownie.network.web3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
@@ -46,6 +39,13 @@ CHAINID_EXAMPLES = (
     f"{DEV_CHAINID} for development, 1 for (eth) mainnet, 137 for polygon"
 )
 
+# calculate_passive check mode: # random balances to compare to the chain
+N_PASSIVE_CHECKS = 100
+
+# incremental 'dftool nftinfo' still does a full query this often, to catch
+# nfts that Aquarius indexed after the run that saw them created
+NFTINFO_FULL_REFRESH_S = 24 * 3600
+
 # ========================================================================
 HELP_SHORT = """Data Farming tool, for use by OPF.
 
@@ -55,15 +55,17 @@ Usage: dftool compile|getrate|volsym|.. ARG1 ARG2 ..
 
   dftool compile - compile contracts
   dftool getrate TOKEN_SYMBOL ST FIN CSV_DIR [RETRIES]
-  dftool volsym ST FIN NSAMP CSV_DIR CHAINID [RETRIES] - query chain, output volumes, symbols, owners
-  dftool allocations ST FIN NSAMP CSV_DIR CHAINID [RETRIES]
-  dftool vebals ST FIN NSAMP CSV_DIR CHAINID [RETRIES]
+  dftool volsym ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [INCREMENTAL] - query chain, output volumes, symbols, owners
+  dftool volsym_all ST FIN NSAMP CSV_DIR CHAINIDS [RETRIES] [INCREMENTAL] - volsym for many chains at once
+  dftool allocations ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [CONCURRENCY] [ENGINE]
+  dftool vebals ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [CONCURRENCY] [ENGINE]
   dftool challenge_data CSV_DIR [DEADLINE] [RETRIES]
   dftool predictoor_data CSV_DIR CHAINID [RETRIES]
   dftool calc CSV_DIR TOT_OCEAN [START_DATE] [IGNORED] - from stakes/etc csvs, output rewards csvs across Volume + Challenge + Predictoor DF
   dftool dispense_active CSV_DIR [CHAINID] [DFREWARDS_ADDR] [TOKEN_ADDR] [BATCH_NBR] - from rewards, dispense funds
   dftool dispense_passive CHAINID AMOUNT
-  dftool nftinfo CSV_DIR CHAINID -- Query chain, output nft info csv
+  dftool nftinfo CSV_DIR CHAINID [FIN] [INCREMENTAL] -- Query chain, output nft info csv
+  dftool serve SOCKET_PATH - run subcommands sent to a Unix socket, in one warm process
 """
 
 HELP_LONG = (
@@ -115,19 +117,21 @@ def do_help_long(status_code=0):
 def do_volsym():
     HELP = f"""Query chain, output volumes, symbols, owners
 
-Usage: dftool volsym ST FIN NSAMP CSV_DIR CHAINID [RETRIES]
+Usage: dftool volsym ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [INCREMENTAL]
   ST -- first block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM
   FIN -- last block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM | latest
   NSAMP -- # blocks to sample liquidity from, from blocks [ST, ST+1, .., FIN]
   CSV_DIR -- output dir for stakes-CHAINID.csv, etc
   CHAINID -- {CHAINID_EXAMPLES}
   RETRIES -- # times to retry failed queries
+  INCREMENTAL -- 1 to only query blocks after volsym-checkpoint-CHAINID.json
+    in CSV_DIR, then update it. Default 0
 
 Uses these envvars:
   ADDRESS_FILE -- eg: export ADDRESS_FILE={networkutil.chainIdToAddressFile(chainID=DEV_CHAINID)}
   SECRET_SEED -- secret integer used to seed the rng
 """
-    if len(sys.argv) not in [2 + 5, 2 + 6]:
+    if len(sys.argv) not in [2 + 5, 2 + 6, 2 + 7]:
         print(HELP)
         sys.exit(1)
 
@@ -137,8 +141,11 @@ Uses these envvars:
     CSV_DIR = sys.argv[5]
     CHAINID = int(sys.argv[6])
     RETRIES = 1
-    if len(sys.argv) == 2 + 6:
+    if len(sys.argv) >= 2 + 6:
         RETRIES = int(sys.argv[7])
+    INCREMENTAL = False
+    if len(sys.argv) == 2 + 7:
+        INCREMENTAL = bool(int(sys.argv[8]))
 
     print("dftool volsym: Begin")
     print(
@@ -147,6 +154,7 @@ Uses these envvars:
         f"\n CSV_DIR={CSV_DIR}"
         f"\n CHAINID={CHAINID}"
         f"\n RETRIES={RETRIES}"
+        f"\n INCREMENTAL={INCREMENTAL}"
         "\n"
     )
 
@@ -169,28 +177,154 @@ Uses these envvars:
 
     # main work
     rng = blockrange.create_range(chain, ST, FIN, NSAMP, SECRET_SEED)
+    checkpoint = csvs.loadVolsymCheckpoint(CSV_DIR, CHAINID) if INCREMENTAL else None
     (Vi, Ci, SYMi) = retryFunction(
-        query.queryVolsOwnersSymbols, RETRIES, 10, rng, CHAINID
+        query.queryVolsOwnersSymbols, RETRIES, 10, rng, CHAINID, checkpoint
     )
     csvs.saveNftvolsCsv(Vi, CSV_DIR, CHAINID)
     csvs.saveOwnersCsv(Ci, CSV_DIR, CHAINID)
     csvs.saveSymbolsCsv(SYMi, CSV_DIR, CHAINID)
+    if INCREMENTAL:
+        csvs.saveVolsymCheckpoint(checkpoint, CSV_DIR, CHAINID)
 
+    print(f"Subgraph queries: {graphutil.queryStats()}")
     print("dftool volsym: Done")
 
 
+# ========================================================================
+@enforce_types
+def do_volsym_all():
+    HELP = f"""Query many chains at once, output volumes, symbols, owners
+
+Usage: dftool volsym_all ST FIN NSAMP CSV_DIR CHAINIDS [RETRIES] [INCREMENTAL]
+  ST -- first block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM
+  FIN -- last block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM | latest
+  NSAMP -- # blocks to sample liquidity from, from blocks [ST, ST+1, .., FIN]
+  CSV_DIR -- output dir for nftvols-CHAINID.csv, etc
+  CHAINIDS -- comma-separated, eg 1,56,137,246,1285
+  RETRIES -- # times to retry failed queries
+  INCREMENTAL -- 1 to only query blocks after volsym-checkpoint-CHAINID.json
+    in CSV_DIR, then update it. Default 0
+
+Outputs the same files as 'dftool volsym' for each chain. The subgraph
+queries of all chains run concurrently. A chain that fails doesn't stop
+the others; the exit code is 1 if any chain failed.
+
+Uses these envvars:
+  ADDRESS_FILE -- eg: export ADDRESS_FILE={networkutil.chainIdToAddressFile(chainID=DEV_CHAINID)}
+  SECRET_SEED -- secret integer used to seed the rng
+"""
+    if len(sys.argv) not in [2 + 5, 2 + 6, 2 + 7]:
+        print(HELP)
+        sys.exit(1)
+
+    # extract inputs
+    assert sys.argv[1] == "volsym_all"
+    ST, FIN, NSAMP = sys.argv[2], sys.argv[3], int(sys.argv[4])
+    CSV_DIR = sys.argv[5]
+    CHAINIDS = [int(chainID) for chainID in sys.argv[6].split(",")]
+    RETRIES = 1
+    if len(sys.argv) >= 2 + 6:
+        RETRIES = int(sys.argv[7])
+    INCREMENTAL = False
+    if len(sys.argv) == 2 + 7:
+        INCREMENTAL = bool(int(sys.argv[8]))
+
+    print("dftool volsym_all: Begin")
+    print(
+        f"Arguments: "
+        f"\n ST={ST}\n FIN={FIN}\n NSAMP={NSAMP}"
+        f"\n CSV_DIR={CSV_DIR}"
+        f"\n CHAINIDS={CHAINIDS}"
+        f"\n RETRIES={RETRIES}"
+        f"\n INCREMENTAL={INCREMENTAL}"
+        "\n"
+    )
+
+    # extract envvars
+    ADDRESS_FILE = _getAddressEnvvarOrExit()
+    SECRET_SEED = _getSecretSeedOrExit()
+
+    # check files, prep dir
+    if not os.path.exists(CSV_DIR):
+        print(f"\nDirectory {CSV_DIR} doesn't exist; nor do rates. Exiting.")
+        sys.exit(1)
+    if not csvs.rateCsvFilenames(CSV_DIR):
+        print("\nRates don't exist. Call 'dftool getrate' first. Exiting.")
+        sys.exit(1)
+
+    errors = {}  # chainID : exception
+
+    # block ranges. Needs brownie, which is connected to one chain at a time
+    rngs = {}
+    for chainID in CHAINIDS:
+        try:
+            networkutil.connect(chainID)
+            chain = brownie.network.chain
+            recordDeployedContracts(ADDRESS_FILE)
+            rngs[chainID] = blockrange.create_range(chain, ST, FIN, NSAMP, SECRET_SEED)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            errors[chainID] = e
+    networkutil.disconnect()
+
+    # main work: subgraph queries, all chains at once
+    checkpoints = {
+        chainID: csvs.loadVolsymCheckpoint(CSV_DIR, chainID) if INCREMENTAL else None
+        for chainID in rngs
+    }
+    with ThreadPoolExecutor(max_workers=max(1, len(rngs))) as executor:
+        futures = {
+            chainID: executor.submit(
+                retryFunction,
+                query.queryVolsOwners,
+                RETRIES,
+                10,
+                rng,
+                chainID,
+                checkpoints[chainID],
+            )
+            for chainID, rng in rngs.items()
+        }
+
+    # symbols and csvs, one chain at a time
+    for chainID, future in futures.items():
+        try:
+            Vi, Ci = future.result()
+            networkutil.connect(chainID)
+            SYMi = query.querySymbols(Vi, chainID)
+            csvs.saveNftvolsCsv(Vi, CSV_DIR, chainID)
+            csvs.saveOwnersCsv(Ci, CSV_DIR, chainID)
+            csvs.saveSymbolsCsv(SYMi, CSV_DIR, chainID)
+            if INCREMENTAL:
+                csvs.saveVolsymCheckpoint(checkpoints[chainID], CSV_DIR, chainID)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            errors[chainID] = e
+    networkutil.disconnect()
+
+    print(f"Subgraph queries: {graphutil.queryStats()}")
+    for chainID, e in errors.items():
+        print(f"dftool volsym_all: chain {chainID} failed: {e}")
+    if errors:
+        sys.exit(1)
+
+    print("dftool volsym_all: Done")
+
+
 # ========================================================================
 
 
 @enforce_types
 def do_nftinfo():
     HELP = f"""Query chain, output nft info csv
-Usage: dftool nftinfo CSV_DIR CHAINID [FIN]
+Usage: dftool nftinfo CSV_DIR CHAINID [FIN] [INCREMENTAL]
     CSV_DIR -- output dir for nftinfo-CHAINID.csv
     CHAINID -- {CHAINID_EXAMPLES}
     FIN -- last block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM | latest
+    INCREMENTAL -- 1 to only query nfts created or transferred after
+      nftinfo-checkpoint-CHAINID.json in CSV_DIR, and merge them into
+      nftinfo_CHAINID.csv there. Then update both. Default 0
 """
-    if len(sys.argv) not in [4, 5]:
+    if len(sys.argv) not in [4, 5, 6]:
         print(HELP)
         sys.exit(1)
 
@@ -198,7 +332,10 @@ Usage: dftool nftinfo CSV_DIR CHAINID [FIN]
     assert sys.argv[1] == "nftinfo"
     CSV_DIR = sys.argv[2]
     CHAINID = int(sys.argv[3])
-    ENDBLOCK = sys.argv[4] if len(sys.argv) == 5 else "latest"
+    ENDBLOCK = sys.argv[4] if len(sys.argv) >= 5 else "latest"
+    INCREMENTAL = False
+    if len(sys.argv) == 6:
+        INCREMENTAL = bool(int(sys.argv[5]))
 
     print("dftool nftinfo: Begin")
     print(
@@ -206,6 +343,7 @@ Usage: dftool nftinfo CSV_DIR CHAINID [FIN]
         f"\n CSV_DIR={CSV_DIR}"
         f"\n CHAINID={CHAINID}"
         f"\n ENDBLOCK={ENDBLOCK}"
+        f"\n INCREMENTAL={INCREMENTAL}"
         "\n"
     )
 
@@ -227,10 +365,34 @@ Usage: dftool nftinfo CSV_DIR CHAINID [FIN]
     ENDBLOCK = getfinBlock(chain, ENDBLOCK)
     print("Updated ENDBLOCK, new value = {ENDBLOCK}")
 
+    # previous run, if incremental
+    checkpoint = csvs.loadNftinfoCheckpoint(CSV_DIR, CHAINID) if INCREMENTAL else {}
+    csv_file = csvs.nftinfoCsvFilename(CSV_DIR, CHAINID)
+    prev_nftinfo, prev_fin = None, None
+    if (
+        checkpoint
+        and os.path.exists(csv_file)
+        and checkpoint["fin"] <= ENDBLOCK
+        and time.time() - checkpoint["full_at"] < NFTINFO_FULL_REFRESH_S
+    ):
+        prev_nftinfo = csvs.loadNftinfoCsv(CSV_DIR, CHAINID)
+        prev_fin = checkpoint["fin"]
+    elif INCREMENTAL:
+        print("No recent nftinfo checkpoint. Doing a full query")
+        checkpoint = {"chainID": CHAINID, "full_at": time.time()}
+
     # main work
-    nftinfo = retryFunction(query.queryNftinfo, RETRIES, DELAY_S, CHAINID, ENDBLOCK)
+    nftinfo = retryFunction(
+        query.queryNftinfo, RETRIES, DELAY_S, CHAINID, ENDBLOCK, prev_nftinfo, prev_fin
+    )
+    if INCREMENTAL and os.path.exists(csv_file):
+        os.remove(csv_file)
     csvs.saveNftinfoCsv(nftinfo, CSV_DIR, CHAINID)
+    if INCREMENTAL:
+        checkpoint["fin"] = ENDBLOCK
+        csvs.saveNftinfoCheckpoint(checkpoint, CSV_DIR, CHAINID)
 
+    print(f"Subgraph queries: {graphutil.queryStats()}")
     print("dftool nftinfo: Done")
 
 
@@ -241,18 +403,22 @@ Usage: dftool nftinfo CSV_DIR CHAINID [FIN]
 def do_allocations():
     HELP = f"""Query chain, outputs allocation csv
 
-Usage: dftool allocations ST FIN NSAMP CSV_DIR CHAINID [RETRIES]
+Usage: dftool allocations ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [CONCURRENCY] [ENGINE]
   ST -- first block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM
   FIN -- last block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM | latest
   NSAMP -- # blocks to sample liquidity from, from blocks [ST, ST+1, .., FIN]
   CSV_DIR -- output dir for stakes-CHAINID.csv, etc
   CHAINID -- {CHAINID_EXAMPLES}
   RETRIES -- # times to retry failed queries
+  CONCURRENCY -- max # groups of sampled blocks to query at once. Default: {query.QUERY_CONCURRENCY}
+  ENGINE -- sample (default): average over NSAMP sampled blocks.
+    events: exact average over all blocks, from a snapshot at ST plus the
+    allocation updates after it. Only if NSAMP > 1
 
 Uses these envvars:
   SECRET_SEED -- secret integer used to seed the rng
 """
-    if len(sys.argv) not in [7, 8]:
+    if len(sys.argv) not in [7, 8, 9, 10]:
         print(HELP)
         sys.exit(1)
 
@@ -262,8 +428,17 @@ Uses these envvars:
     CSV_DIR = sys.argv[5]
     CHAINID = int(sys.argv[6])
     RETRIES = 1
-    if len(sys.argv) == 8:
+    if len(sys.argv) >= 8:
         RETRIES = int(sys.argv[7])
+    CONCURRENCY = query.QUERY_CONCURRENCY
+    if len(sys.argv) >= 9:
+        CONCURRENCY = int(sys.argv[8])
+    ENGINE = "sample"
+    if len(sys.argv) == 10:
+        ENGINE = sys.argv[9]
+    if ENGINE not in ["sample", "events"] or (ENGINE == "events" and NSAMP <= 1):
+        print(HELP)
+        sys.exit(1)
 
     print("dftool do_allocations: Begin")
     print(
@@ -272,6 +447,8 @@ Uses these envvars:
         f"\n CSV_DIR={CSV_DIR}"
         f"\n CHAINID={CHAINID}"
         f"\n RETRIES={RETRIES}"
+        f"\n CONCURRENCY={CONCURRENCY}"
+        f"\n ENGINE={ENGINE}"
         "\n"
     )
 
@@ -288,9 +465,17 @@ Uses these envvars:
 
     # main work
     rng = blockrange.create_range(chain, ST, FIN, NSAMP, SECRET_SEED)
-    allocs = retryFunction(query.queryAllocations, RETRIES, 10, rng, CHAINID)
+    if ENGINE == "events":
+        allocs = retryFunction(
+            query.queryAllocationsFromEvents, RETRIES, 10, rng, CHAINID
+        )
+    else:
+        allocs = retryFunction(
+            query.queryAllocations, RETRIES, 10, rng, CHAINID, CONCURRENCY
+        )
     csvs.saveAllocationCsv(allocs, CSV_DIR, NSAMP > 1)
 
+    print(f"Subgraph queries: {graphutil.queryStats()}")
     print("dftool allocations: Done")
 
 
@@ -301,18 +486,22 @@ Uses these envvars:
 def do_vebals():
     HELP = f"""Query chain, outputs veBalances csv
 
-Usage: dftool vebals ST FIN NSAMP CSV_DIR CHAINID [RETRIES]
+Usage: dftool vebals ST FIN NSAMP CSV_DIR CHAINID [RETRIES] [CONCURRENCY] [ENGINE]
   ST -- first block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM
   FIN -- last block # to calc on | YYYY-MM-DD | YYYY-MM-DD_HH:MM | latest
   NSAMP -- # blocks to sample liquidity from, from blocks [ST, ST+1, .., FIN]
   CSV_DIR -- output dir for stakes-CHAINID.csv, etc
   CHAINID -- {CHAINID_EXAMPLES}
   RETRIES -- # times to retry failed queries
+  CONCURRENCY -- max # groups of sampled blocks to query at once. Default: {query.QUERY_CONCURRENCY}
+  ENGINE -- sample (default): average over NSAMP sampled blocks.
+    events: exact average over all blocks, from a snapshot at ST plus the
+    lock & delegation changes after it. Only if NSAMP > 1
 
 Uses these envvars:
   SECRET_SEED -- secret integer used to seed the rng
 """
-    if len(sys.argv) not in [7, 8]:
+    if len(sys.argv) not in [7, 8, 9, 10]:
         print(HELP)
         sys.exit(1)
 
@@ -322,8 +511,17 @@ Uses these envvars:
     CSV_DIR = sys.argv[5]
     CHAINID = int(sys.argv[6])
     RETRIES = 1
-    if len(sys.argv) == 8:
+    if len(sys.argv) >= 8:
         RETRIES = int(sys.argv[7])
+    CONCURRENCY = query.QUERY_CONCURRENCY
+    if len(sys.argv) >= 9:
+        CONCURRENCY = int(sys.argv[8])
+    ENGINE = "sample"
+    if len(sys.argv) == 10:
+        ENGINE = sys.argv[9]
+    if ENGINE not in ["sample", "events"] or (ENGINE == "events" and NSAMP <= 1):
+        print(HELP)
+        sys.exit(1)
 
     print("dftool vebals: Begin")
     print(
@@ -332,6 +530,8 @@ Uses these envvars:
         f"\n CSV_DIR={CSV_DIR}"
         f"\n CHAINID={CHAINID}"
         f"\n RETRIES={RETRIES}"
+        f"\n CONCURRENCY={CONCURRENCY}"
+        f"\n ENGINE={ENGINE}"
         "\n"
     )
 
@@ -347,11 +547,16 @@ Uses these envvars:
     chain = brownie.network.chain
     rng = blockrange.create_range(chain, ST, FIN, NSAMP, SECRET_SEED)
 
+    if ENGINE == "events":
+        queryVebalances = query.queryVebalancesFromEvents
+    else:
+        queryVebalances = query.queryVebalances
     balances, locked_amt, unlock_time = retryFunction(
-        query.queryVebalances, RETRIES, 10, rng, CHAINID
+        queryVebalances, RETRIES, 10, rng, CHAINID, CONCURRENCY
     )
     csvs.saveVebalsCsv(balances, locked_amt, unlock_time, CSV_DIR, NSAMP > 1)
 
+    print(f"Subgraph queries: {graphutil.queryStats()}")
     print("dftool vebals: Done")
 
 
@@ -371,6 +576,8 @@ Usage: dftool getrate TOKEN_SYMBOL ST FIN CSV_DIR [RETRIES]
         print(HELP)
         sys.exit(1)
 
+    from util import getrate
+
     # extract inputs
     assert sys.argv[1] == "getrate"
     TOKEN_SYMBOL = sys.argv[2]
@@ -419,6 +626,8 @@ Uses these envvars:
         print(HELP)
         sys.exit(1)
 
+    from util.challenge import judge
+
     # extract inputs
     assert sys.argv[1] == "challenge_data"
     CSV_DIR = sys.argv[2]
@@ -529,6 +738,10 @@ Usage: dftool calc CSV_DIR TOT_OCEAN [START_DATE] [IGNORED]
         print(HELP)
         sys.exit(1)
 
+    from util import allocations, calcrewards
+    from util.calcrewards import calcRewards
+    from util.vesting_schedule import getActiveRewardAmountForWeekEth
+
     # extract inputs
     assert sys.argv[1] == "calc"
     CSV_DIR = sys.argv[2]
@@ -642,6 +855,8 @@ Transactions are signed with envvar 'DFTOOL_KEY`.
         print(HELP)
         sys.exit(1)
 
+    from util import calcrewards, dispense
+
     # extract inputs
     assert sys.argv[1] == "dispense_active"
     CSV_DIR = sys.argv[2]
@@ -848,7 +1063,7 @@ Uses these envvars:
         print(HELP)
         sys.exit(1)
 
-    from util import oceantestutil  # pylint: disable=import-outside-toplevel
+    from util import oceantestutil
 
     # extract inputs
     assert sys.argv[1] == "initdevwallets"
@@ -891,6 +1106,12 @@ Uses these envvars:
         print(HELP)
         sys.exit(1)
 
+    from util.oceantestutil import (
+        randomConsumeFREs,
+        randomCreateDataNFTWithFREs,
+        randomLockAndAllocate,
+    )
+
     # extract inputs
     assert sys.argv[1] == "manyrandom"
     CHAINID = int(sys.argv[2])
@@ -1172,6 +1393,9 @@ Usage: dftool dispense_passive CHAINID AMOUNT [ST]
         print(HELP)
         sys.exit(1)
 
+    from util import dispense
+    from util.vesting_schedule import getActiveRewardAmountForWeekEth
+
     CHAINID = int(sys.argv[2])
     networkutil.connect(CHAINID)
     AMOUNT = float(sys.argv[3])
@@ -1194,19 +1418,30 @@ Usage: dftool dispense_passive CHAINID AMOUNT [ST]
 def do_calculate_passive():
     HELP = f"""Calculate passive rewards
 
-Usage: dftool calculate_passive CHAINID DATE CSV_DIR
+Usage: dftool calculate_passive CHAINID DATE CSV_DIR [MODE]
     CHAINID -- {CHAINID_EXAMPLES}
     DATE -- date in format YYYY-MM-DD
     CSV_DIR -- output dir for passive-CHAINID.csv
+    MODE -- chain (default): query each balance from FeeDistributor.
+      offline: compute balances from locked_amt & unlock_time in vebals csv.
+      check: offline, then compare {N_PASSIVE_CHECKS} random balances to the
+      chain. Exits without saving if any differ
 """
-    if len(sys.argv) not in [5]:
+    if len(sys.argv) not in [5, 6]:
         print(HELP)
         sys.exit(1)
 
     CHAINID = int(sys.argv[2])
-    networkutil.connect(CHAINID)
     DATE = sys.argv[3]
     CSV_DIR = sys.argv[4]
+    MODE = "chain"
+    if len(sys.argv) == 6:
+        MODE = sys.argv[5]
+    if MODE not in ["chain", "offline", "check"]:
+        print(HELP)
+        sys.exit(1)
+
+    networkutil.connect(CHAINID)
     timestamp = int(timestrToTimestamp(DATE))
     S_PER_WEEK = 7 * 86400
     timestamp = timestamp // S_PER_WEEK * S_PER_WEEK
@@ -1221,11 +1456,24 @@ Usage: dftool calculate_passive CHAINID DATE CSV_DIR
         sys.exit(1)
     _exitIfFileExists(passive_fname)
 
-    # get addresses
-    vebals, _, _ = csvs.loadVebalsCsv(CSV_DIR, False)
-    addresses = list(vebals.keys())
+    vebals, locked_amts, unlock_times = csvs.loadVebalsCsv(CSV_DIR, False)
+
+    if MODE == "chain":
+        addresses = list(vebals.keys())
+        balances, rewards = query.queryPassiveRewards(timestamp, addresses)
+    else:
+        balances, rewards = query.calcPassiveRewards(
+            timestamp, locked_amts, unlock_times
+        )
 
-    balances, rewards = query.queryPassiveRewards(timestamp, addresses)
+    if MODE == "check" and balances:
+        mismatches = query.checkPassiveBalances(timestamp, balances, N_PASSIVE_CHECKS)
+        for addr, (balance, chain_balance) in mismatches.items():
+            print(f"Mismatch for {addr}: {balance} computed, {chain_balance} on chain")
+        if mismatches:
+            print(f"\n{len(mismatches)} balances differ from the chain. Exiting.")
+            sys.exit(1)
+        print(f"Checked {N_PASSIVE_CHECKS} random balances against the chain: OK")
 
     # save to csv
     csvs.savePassiveCsv(rewards, balances, CSV_DIR)
@@ -1276,6 +1524,40 @@ Usage: dftool checkpoint_feedist CHAINID
     print("Checkpointed FeeDistributor")
 
 
+# ========================================================================
+@enforce_types
+def do_serve():
+    HELP = """Run subcommands sent to a Unix socket, in this one process
+
+Usage: dftool serve SOCKET_PATH
+    SOCKET_PATH -- Unix socket to listen on, eg /app/data/dftool.sock
+
+The brownie project stays loaded across subcommands, and so does the chain
+connection while consecutive subcommands are on the same chain. Subcommands
+run one at a time, with the same args, output and exit code as 'dftool'.
+Stop with SIGTERM or ctrl-c.
+
+Submit a subcommand, eg from cron, with:
+  python util/dfserver.py SOCKET_PATH SUBCOMMAND ARG1 ARG2 ..
+"""
+    if len(sys.argv) not in [3]:
+        print(HELP)
+        sys.exit(1)
+
+    SOCKET_PATH = sys.argv[2]
+
+    from util import dfserver
+
+    constants.getBrownieProject()
+    networkutil.KEEP_CONNECTED = True
+
+    def _serveMain():
+        graphutil.resetQueryStats()  # so each subcommand reports its own
+        _do_main()
+
+    dfserver.serve(SOCKET_PATH, _serveMain)
+
+
 # ========================================================================
 # utilities
 
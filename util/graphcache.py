@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Optional
+
+from enforce_typing import enforce_types
+
+
+@enforce_types
+class ResponseCache:
+    """
+    On-disk cache of subgraph responses, one json file per query.
+
+    Only for queries pinned to a historical block, whose responses never
+    change. Evicts least-recently-used files once the total size exceeds
+    max_bytes. Recency is tracked with file mtimes, so it survives across
+    runs and is shared by concurrent processes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def get(self, chainID: int, block: int, query: str) -> Optional[dict]:
+        """Return the cached response, or None if not cached"""
+        filename = self._filename(chainID, block, query)
+        try:
+            with open(filename, "r") as f:
+                result = json.load(f)
+            os.utime(filename)  # mark as recently used
+        except (OSError, ValueError):  # not cached, evicted, or partial
+            return None
+        return result
+
+    def put(self, chainID: int, block: int, query: str, result: dict):
+        filename = self._filename(chainID, block, query)
+        s = json.dumps(result)
+
+        # write to a temp file then rename, so readers never see partial files
+        tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(s)
+        try:
+            old_size = os.stat(filename).st_size  # replaced, so not added again
+        except OSError:  # not cached yet
+            old_size = 0
+        os.replace(tmp_filename, filename)
+
+        with self._lock:
+            self._total_bytes += len(s) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least-recently-used files until at most 90% of max_bytes"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = 0.9 * self.max_bytes
+        for filename, size, _ in entries:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:  # removed by another process
+                pass
+            total_bytes -= size
+        self._total_bytes = total_bytes
+
+    def _entries(self) -> list:
+        """Return list of (filename, size, mtime) of the cached responses"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:  # removed by another process
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _filename(self, chainID: int, block: int, query: str) -> str:
+        normalized_query = " ".join(query.split())
+        key = f"{chainID}:{block}:{normalized_query}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{chainID}-{block}-{digest}.json")
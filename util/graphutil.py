@@ -1,15 +1,403 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from util import networkutil
+from util.graphcache import ResponseCache
+
+CHUNK_SIZE = 1000  # max # records per page, for subgraph = 1000
+
+# max # pooled keep-alive connections per subgraph host
+POOL_SIZE = int(os.getenv("SUBGRAPH_POOL_SIZE", "16"))
+
+# per-request retries on transient failures, with exponential backoff
+MAX_RETRIES = 5
+BACKOFF_S = 1.0  # delay before 1st retry. Doubles for each retry after
+MAX_BACKOFF_S = 30.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# on-disk cache of responses to queries pinned to a block. SUBGRAPH_CACHE=0
+# bypasses it
+USE_CACHE = os.getenv("SUBGRAPH_CACHE", "1") != "0"
+CACHE_DIR = os.getenv("SUBGRAPH_CACHE_DIR", "~/.dfpy/subgraph_cache")
+CACHE_MAX_BYTES = int(os.getenv("SUBGRAPH_CACHE_MAX_MB", "1000")) * 2**20
+
+# only cache responses at blocks this far below the subgraph's head, so that
+# a reorg can't change them. The head is re-queried at most every HEAD_MAX_AGE_S
+CACHE_CONFIRMATIONS = int(os.getenv("SUBGRAPH_CACHE_CONFIRMATIONS", "128"))
+HEAD_MAX_AGE_S = 60.0
+
+# paginatedQueryBlocks() packs the pages of several blocks into one request.
+# The # blocks per request adapts to keep responses near TARGET_RECORDS
+MAX_BLOCKS_PER_QUERY = int(os.getenv("SUBGRAPH_MAX_BLOCKS_PER_QUERY", "16"))
+TARGET_RECORDS = 5 * CHUNK_SIZE
+
+_SESSION: Optional[requests.Session] = None
+_CACHE: Optional[ResponseCache] = None
+_HEADS: Dict[int, Tuple[Optional[int], float]] = {}  # [chainID] : (head, t queried)
+
+# guards _SESSION, _CACHE, _HEADS, _STATS; queries run in threads
+_LOCK = threading.Lock()
+_STATS = {
+    "n_requests": 0,
+    "n_retries": 0,
+    "n_cache_hits": 0,
+    "n_bytes": 0,
+    "time_s": 0.0,
+}
+
 
+def submitQuery(query: str, chainID: int, use_cache: bool = True) -> dict:
+    """
+    @description
+      Submit a GraphQL query to the subgraph of chainID.
 
-def submitQuery(query: str, chainID: int) -> dict:
+      Responses to queries pinned to a block, "block: {number: N}", are
+      cached on disk: the state at a final block doesn't change. Only for
+      blocks CACHE_CONFIRMATIONS below the subgraph's head, and not on the
+      dev chain, which gets reset.
+
+    @arguments
+      query -- GraphQL query string
+      chainID -- chain to query
+      use_cache -- if False, always query the subgraph (but still cache)
+
+    @return
+      result -- dict, as returned by the subgraph
+    """
+    block = _pinnedBlock(query)
+    cacheable = block is not None and _isCacheable(chainID)
+    if cacheable and use_cache:
+        result = _cacheGet(chainID, block, query)
+        if result is not None:
+            return result
+
+    result = _postQuery(query, chainID)
+    if cacheable and "errors" not in result and result.get("data"):
+        if _isFinal(chainID, block):
+            _getCache().put(chainID, block, query, result)
+    return result
+
+
+def _postQuery(query: str, chainID: int) -> dict:
     subgraph_url = networkutil.chainIdToSubgraphUri(chainID)
-    request = requests.post(subgraph_url, "", json={"query": query}, timeout=30)
-    if request.status_code != 200:
-        # pylint: disable=broad-exception-raised
-        raise Exception(f"Query failed. Return code is {request.status_code}\n{query}")
+    session = _getSession()
+
+    for retry_i in range(MAX_RETRIES + 1):
+        t0 = time.time()
+        try:
+            request = session.post(subgraph_url, json={"query": query}, timeout=30)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error, request = str(e), None
+        else:
+            error = f"Return code is {request.status_code}"
+        _updateStats(time.time() - t0, request)
+
+        if request is not None and request.status_code == 200:
+            return request.json()
+
+        retryable = request is None or request.status_code in RETRY_STATUS_CODES
+        if not retryable or retry_i == MAX_RETRIES:
+            break
+
+        delay = min(MAX_BACKOFF_S, BACKOFF_S * 2**retry_i)
+        delay *= random.uniform(0.5, 1.0)  # jitter, so threads don't sync up
+        print(f"Query failed ({error}). Retry {retry_i+1} in {delay:.1f} s")
+        with _LOCK:
+            _STATS["n_retries"] += 1
+        time.sleep(delay)
+
+    # pylint: disable=broad-exception-raised
+    raise Exception(f"Query failed. {error}\n{query}")
+
+
+def queryStats() -> dict:
+    """
+    @description
+      Return counters of all submitQuery() http requests so far
+
+    @return
+      stats -- dict with n_requests, n_retries, n_cache_hits,
+        n_bytes (of responses), time_s (summed over requests)
+    """
+    with _LOCK:
+        return dict(_STATS)
+
+
+def resetQueryStats():
+    with _LOCK:
+        _STATS.update(n_requests=0, n_retries=0, n_cache_hits=0, n_bytes=0)
+        _STATS["time_s"] = 0.0
+
+
+def _getSession() -> requests.Session:
+    """Return the module-level session, so connections are kept alive"""
+    global _SESSION
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _SESSION.mount("http://", adapter)
+            _SESSION.mount("https://", adapter)
+        return _SESSION
+
+
+def _getCache() -> ResponseCache:
+    global _CACHE
+    with _LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache(CACHE_DIR, CACHE_MAX_BYTES)
+        return _CACHE
+
+
+def _isCacheable(chainID: int) -> bool:
+    """Cache except on the dev chain, which gets reset"""
+    return USE_CACHE and chainID != networkutil.DEV_CHAINID
+
+
+def _isFinal(chainID: int, block: int) -> bool:
+    """Is block at least CACHE_CONFIRMATIONS below the subgraph's head?"""
+    with _LOCK:
+        head, checked_at = _HEADS.get(chainID, (None, 0.0))
+    is_final = head is not None and block <= head - CACHE_CONFIRMATIONS
+    if is_final or time.time() - checked_at <= HEAD_MAX_AGE_S:
+        return is_final
+
+    # the head only grows, so it only needs re-querying for newer blocks
+    head = subgraphHead(chainID)
+    with _LOCK:
+        _HEADS[chainID] = (head, time.time())
+    return head is not None and block <= head - CACHE_CONFIRMATIONS
+
+
+def subgraphHead(chainID: int) -> Optional[int]:
+    """Return the latest block indexed by the subgraph, or None if unknown"""
+    result = _postQuery("{ _meta { block { number } } }", chainID)
+    try:
+        return int(result["data"]["_meta"]["block"]["number"])
+    except (KeyError, TypeError, ValueError):
+        return None
 
-    result = request.json()
 
+def _cacheGet(chainID: int, block: int, query: str) -> Optional[dict]:
+    result = _getCache().get(chainID, block, query)
+    if result is not None:
+        with _LOCK:
+            _STATS["n_cache_hits"] += 1
     return result
+
+
+def _pinnedBlock(query: str) -> Optional[int]:
+    """
+    Return N if the query is pinned to "block: {number: N}", else None.
+    Also None if it's pinned to several blocks, see paginatedQueryBlocks()
+    """
+    matches = re.findall(r"block\s*:\s*{\s*number\s*:\s*(\d+)\s*}", query)
+    return int(matches[0]) if len(matches) == 1 else None
+
+
+def _updateStats(duration_s: float, request: Optional[requests.Response]):
+    with _LOCK:
+        _STATS["n_requests"] += 1
+        _STATS["time_s"] += duration_s
+        if request is not None:
+            _STATS["n_bytes"] += len(request.content)
+
+
+def paginatedQuery(
+    entity: str,
+    fields: str,
+    chainID: int,
+    where: str = "",
+    block: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[dict]:
+    """
+    @description
+      Query all records of an entity, one page at a time.
+
+      Pages with a cursor on id (where: {id_gt: last_id}, orderBy: id)
+      rather than with skip. The subgraph executes skip in O(skip) and caps
+      it, whereas every cursor page costs the same.
+
+    @arguments
+      entity -- e.g. "orders"
+      fields -- GraphQL selection of each record, e.g. "id lockedAmount"
+      chainID -- chain to query
+      where -- extra filter, e.g. "block_gte:10, block_lte:20"
+      block -- if given, query the state at this block number
+      chunk_size -- max # records per page
+
+    @return
+      records -- iterator of dict, in id order. Raises AssertionError if the
+        subgraph returns errors or no data.
+    """
+    last_id = None
+    while True:
+        query = "{ %s }" % _pageField(entity, fields, where, block, last_id, chunk_size)
+        result = submitQuery(query, chainID)
+        if "errors" in result or not result.get("data"):
+            raise AssertionError(result)
+        records = result["data"][entity]
+
+        yield from records
+
+        if len(records) < chunk_size:
+            # means there are no records left
+            break
+        last_id = records[-1]["id"]
+
+
+def paginatedQueryBlocks(
+    entity: str,
+    fields: str,
+    chainID: int,
+    blocks: List[int],
+    where: str = "",
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[int, List[dict]]]:
+    """
+    @description
+      Query all records of an entity at each of the given blocks. Same
+      result as paginatedQuery(.., block=block) for each block, but with
+      the pages of several blocks packed into one request, as aliased root
+      fields: { b0: entity(.., block: {number: X}) {..} b1: entity(..) {..} }
+
+      The # blocks per request starts at 1, then doubles up to
+      MAX_BLOCKS_PER_QUERY while responses stay under TARGET_RECORDS
+      records, or shrinks to fit if they get bigger.
+
+      Each page is cached on its own, under the same key as the page of
+      paginatedQuery(). So both share cached responses.
+
+    @arguments
+      entity, fields, chainID, where, chunk_size -- see paginatedQuery()
+      blocks -- block numbers to query the state at
+
+    @return
+      results -- iterator of (block, records), in the order of blocks.
+        Raises AssertionError if the subgraph returns errors or no data.
+    """
+    n_per_query = 1
+    next_i = 0  # index into blocks, of the next block to start on
+    last_ids: Dict[int, Optional[str]] = {}  # [block_i] : last id, if not done
+    records: Dict[int, List[dict]] = {}  # [block_i] : records so far
+    done_i = 0  # blocks[:done_i] have been yielded
+
+    while done_i < len(blocks):
+        while len(last_ids) < n_per_query and next_i < len(blocks):
+            last_ids[next_i] = None
+            records[next_i] = []
+            next_i += 1
+
+        batch = {
+            block_i: (blocks[block_i], last_id)
+            for block_i, last_id in list(last_ids.items())[:n_per_query]
+        }
+        pages = _queryPages(entity, fields, chainID, where, batch, chunk_size)
+
+        for block_i, page in pages.items():
+            records[block_i].extend(page)
+            if len(page) < chunk_size:
+                # means there are no records left
+                del last_ids[block_i]
+            else:
+                last_ids[block_i] = page[-1]["id"]
+
+        n_records = sum(len(page) for page in pages.values())
+        fit = TARGET_RECORDS * len(pages) // max(1, n_records)
+        n_per_query = max(1, min(2 * n_per_query, fit, MAX_BLOCKS_PER_QUERY))
+
+        while done_i < next_i and done_i not in last_ids:
+            yield blocks[done_i], records.pop(done_i)
+            done_i += 1
+
+
+def _queryPages(
+    entity: str,
+    fields: str,
+    chainID: int,
+    where: str,
+    batch: Dict[int, Tuple[int, Optional[str]]],
+    chunk_size: int,
+) -> Dict[int, List[dict]]:
+    """
+    @description
+      Query one page per block in one request. Helper for
+      paginatedQueryBlocks().
+
+    @arguments
+      batch -- dict of [block_i] : (block, last id queried or None)
+
+    @return
+      pages -- dict of [block_i] : records
+    """
+    page_fields = {
+        block_i: _pageField(entity, fields, where, block, last_id, chunk_size)
+        for block_i, (block, last_id) in batch.items()
+    }
+
+    if len(batch) == 1:
+        [(block_i, page_field)] = page_fields.items()
+        result = submitQuery("{ %s }" % page_field, chainID)
+        if "errors" in result or not result.get("data"):
+            raise AssertionError(result)
+        return {block_i: result["data"][entity]}
+
+    pages: Dict[int, List[dict]] = {}
+    if _isCacheable(chainID):
+        for block_i, (block, _) in batch.items():
+            result = _cacheGet(chainID, block, "{ %s }" % page_fields[block_i])
+            if result is not None:
+                pages[block_i] = result["data"][entity]
+
+    aliased_fields = [
+        f"b{block_i}: {page_field}"
+        for block_i, page_field in page_fields.items()
+        if block_i not in pages
+    ]
+    if not aliased_fields:
+        return pages
+
+    result = submitQuery("{ %s }" % " ".join(aliased_fields), chainID)
+    if "errors" in result or not result.get("data"):
+        raise AssertionError(result)
+
+    for block_i, (block, _) in batch.items():
+        if block_i in pages:
+            continue
+        pages[block_i] = result["data"][f"b{block_i}"]
+        if _isCacheable(chainID) and _isFinal(chainID, block):
+            page_query = "{ %s }" % page_fields[block_i]
+            page_result = {"data": {entity: pages[block_i]}}
+            _getCache().put(chainID, block, page_query, page_result)
+
+    return {block_i: pages[block_i] for block_i in batch}
+
+
+def _pageField(
+    entity: str,
+    fields: str,
+    where: str,
+    block: Optional[int],
+    last_id: Optional[str],
+    chunk_size: int,
+) -> str:
+    """Return the root field that queries the page of records after last_id"""
+    filters = [where] if where else []
+    if last_id is not None:
+        filters.append(f'id_gt: "{last_id}"')
+
+    args = [f"first: {chunk_size}", "orderBy: id", "orderDirection: asc"]
+    if filters:
+        args.append("where: {%s}" % ", ".join(filters))
+    if block is not None:
+        args.append("block: {number: %d}" % block)
+
+    return "%s(%s) { id %s }" % (entity, ", ".join(args), fields)
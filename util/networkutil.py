@@ -8,6 +8,12 @@ from util.constants import CONTRACTS, MULTISIG_ADDRS
 
 _BARGE_ADDRESS_FILE = "~/.ocean/ocean-contracts/artifacts/address.json"
 
+# if True, connect() to the chain that's already connected keeps the
+# connection and its recorded contracts. Set by 'dftool serve', so that
+# consecutive subcommands on a chain don't reconnect. Not for the dev chain
+# in tests, where connect() resets the chain
+KEEP_CONNECTED = False
+
 # Development chainid is from brownie, rest are from chainlist.org
 # Chain values to fit Ocean subgraph urls as given in
 # https://v3.docs.oceanprotocol.com/concepts/networks/
@@ -121,6 +127,8 @@ def connectDev():
 def connect(chainID: int):
     network = brownie.network
     if network.is_connected():
+        if KEEP_CONNECTED and network.chain.id == chainID:
+            return
         disconnect()  # call networkutil.disconnect(), *NOT* brownie directly
     with warnings.catch_warnings():
         warnings.filterwarnings(
@@ -1,3 +1,4 @@
+import functools
 import hashlib
 import json
 import warnings
@@ -404,8 +405,35 @@ def to_32byte_hex(val: int) -> str:
     return web3.toHex(web3.toBytes(val).rjust(32, b"\0"))
 
 
+# max # (nft_addr, chainID) : did entries memoized by calcDID()
+DID_CACHE_SIZE = 2**20
+
+
 @enforce_types
 def calcDID(nft_addr: str, chainID: int) -> str:
+    return _calcDID(nft_addr.lower(), chainID)
+
+
+@enforce_types
+def calcDIDs(nft_addrs: List[str], chainID: int) -> List[str]:
+    """
+    @description
+      Return the did of each nft on chainID, like calcDID(). Each distinct
+      address is computed just once.
+
+    @return
+      dids -- list of str, in the order of nft_addrs
+    """
+    addr_to_did = {
+        nft_addr: _calcDID(nft_addr, chainID)
+        for nft_addr in {nft_addr.lower() for nft_addr in nft_addrs}
+    }
+    return [addr_to_did[nft_addr.lower()] for nft_addr in nft_addrs]
+
+
+@functools.lru_cache(maxsize=DID_CACHE_SIZE)
+def _calcDID(nft_addr: str, chainID: int) -> str:
+    """Memoized calcDID(). nft_addr must be lowercase, for one entry per nft"""
     nft_addr2 = brownie.web3.toChecksumAddress(nft_addr)
 
     # adapted from ocean.py/ocean_lib/ocean/ocean_assets.py
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import FrozenSet, Optional
+
+from enforce_typing import enforce_types
+import requests
+
+PURGATORY_URL = (
+    "https://raw.githubusercontent.com/oceanprotocol/list-purgatory/main/"
+    "list-assets.json"
+)
+PURGATORY_CACHE_FILE = os.getenv("PURGATORY_CACHE_FILE", "~/.dfpy/purgatory.json")
+
+# revalidate the list with GitHub at most this often, within a process
+PURGATORY_MAX_AGE_S = 300.0
+
+_PURGATORY: Optional["Purgatory"] = None
+_LOCK = threading.Lock()  # guards _PURGATORY
+
+
+@enforce_types
+class Purgatory:
+    """
+    Dids of data assets in purgatory, as a frozenset.
+
+    The list is cached on disk with its ETag and Last-Modified headers. It's
+    revalidated with a conditional GET, so it's only downloaded again if it
+    changed; and at most every max_age_s within a process.
+    """
+
+    def __init__(self, url: str, cache_file: str, max_age_s: float):
+        self.url = url
+        self.cache_file = os.path.expanduser(cache_file)
+        self.max_age_s = max_age_s
+        self._dids: FrozenSet[str] = frozenset()
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def dids(self) -> FrozenSet[str]:
+        """Return the dids in purgatory"""
+        with self._lock:
+            now = time.time()
+            if self._checked_at is None or now - self._checked_at > self.max_age_s:
+                # list of {'did' : 'did:op:6F7...', 'reason':'..'}
+                data = self._fetch()
+                self._dids = frozenset(item["did"] for item in data)
+                self._checked_at = now
+            return self._dids
+
+    def __contains__(self, did: str) -> bool:
+        return did in self.dids()
+
+    def _fetch(self) -> list:
+        cached = self._loadCache()
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        resp = requests.get(self.url, headers=headers, timeout=30)
+        if resp.status_code == 304 and cached is not None:  # not modified
+            return cached["data"]
+        resp.raise_for_status()
+
+        data = json.loads(resp.text)
+        self._saveCache(
+            {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "data": data,
+            }
+        )
+        return data
+
+    def _loadCache(self) -> Optional[dict]:
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):  # not cached yet, or partial
+            return None
+
+    def _saveCache(self, cached: dict):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_filename = f"{self.cache_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp_filename, self.cache_file)
+
+
+def getPurgatory() -> Purgatory:
+    """Return the Purgatory shared by the whole process"""
+    global _PURGATORY
+    with _LOCK:
+        if _PURGATORY is None:
+            _PURGATORY = Purgatory(
+                PURGATORY_URL, PURGATORY_CACHE_FILE, PURGATORY_MAX_AGE_S
+            )
+        return _PURGATORY
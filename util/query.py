@@ -1,8 +1,19 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import json
-from typing import Dict, List, Tuple
-
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 import requests
 import brownie
+from brownie._config import CONFIG
+from brownie.network.multicall import MULTICALL2_ABI
 from enforce_typing import enforce_types
 
 from util import networkutil, oceanutil
@@ -12,12 +23,59 @@ from util.constants import (
     BROWNIE_PROJECT as B,
     MAX_ALLOCATE,
 )
-from util.graphutil import submitQuery
+from util.graphutil import (
+    CHUNK_SIZE,
+    paginatedQuery,
+    paginatedQueryBlocks,
+    subgraphHead,
+)
+from util.purgatory import getPurgatory
 from util.tok import TokSet
 from util.base18 import from_wei
 
 MAX_TIME = 4 * 365 * 86400  # max lock time
 
+# default max # groups of sampled blocks to query the subgraph for at once
+QUERY_CONCURRENCY = 4
+
+# a volsym checkpoint only goes up to this many blocks below the subgraph's
+# head. Later blocks may not be indexed yet, or may reorg
+VOLS_CHECKPOINT_CONFIRMATIONS = 128
+
+# unfiltered aggregates of a volsym checkpoint, see _updateVolsCheckpoint()
+VOLS_AGGREGATES = ["vols", "owners", "gasvols", "swaps"]
+
+# max # tx hashes remembered to count each tx's gas once, see _rememberTx()
+TX_DEDUP_WINDOW = 10_000
+
+# max # ve_for_at calls per Multicall, to stay under rpc gas & size limits
+MULTICALL_CHUNK_SIZE = 500
+
+# max # Multicalls in flight at once
+MULTICALL_CONCURRENCY = 4
+
+# calcPassiveRewards() balances must match ve_for_at to this relative tolerance
+PASSIVE_CHECK_RTOL = 1e-6
+
+# dir of files of [token_addr] : symbol, one file per chain
+SYMBOLS_CACHE_DIR = os.getenv("SYMBOLS_CACHE_DIR", "~/.dfpy/symbols")
+
+# file of [did] : (asset name, time fetched), shared by all chains & runs.
+# Names older than AQUARIUS_CACHE_TTL_S get fetched again. Dids that aren't
+# in Aquarius (name "") after AQUARIUS_MISSING_TTL_S, since Aquarius may
+# index them soon after
+AQUARIUS_CACHE_FILE = os.getenv("AQUARIUS_CACHE_FILE", "~/.dfpy/aquarius_names.json")
+AQUARIUS_CACHE_TTL_S = int(os.getenv("AQUARIUS_CACHE_TTL_S", str(24 * 3600)))
+AQUARIUS_MISSING_TTL_S = int(os.getenv("AQUARIUS_MISSING_TTL_S", str(5 * 60)))
+
+# Aquarius asset name requests. A batch that keeps failing is split in two,
+# down to AQUARIUS_MIN_BATCH_SIZE dids
+AQUARIUS_BATCH_SIZE = 1000
+AQUARIUS_MIN_BATCH_SIZE = 125
+AQUARIUS_CONCURRENCY = 4
+AQUARIUS_RETRIES = 3
+AQUARIUS_BACKOFF_S = 1.0  # delay before 1st retry. Doubles for each retry after
+
 
 @enforce_types
 class SimpleDataNft:
@@ -36,7 +94,14 @@ class SimpleDataNft:
         self.owner_addr = owner_addr.lower()
         self.is_purgatory = is_purgatory
         self.name = name  # can be any mix of upper and lower case
-        self.did = oceanutil.calcDID(nft_addr, chain_id)
+        self._did: Optional[str] = None
+
+    @property
+    def did(self) -> str:
+        # computed on first access, since most nfts never need it
+        if self._did is None:
+            self._did = oceanutil.calcDID(self.nft_addr, self.chain_id)
+        return self._did
 
     def setName(self, name: str):
         self.name = name
@@ -55,12 +120,17 @@ class SimpleDataNft:
 
 @enforce_types
 def queryVolsOwnersSymbols(
-    rng: BlockRange, chainID: int
+    rng: BlockRange, chainID: int, checkpoint: Optional[dict] = None
 ) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str], Dict[str, str]]:
     """
     @description
       For given block range and chain, return each nft's {vols, owner, symbol}
 
+    @arguments
+      rng -- block range. Only rng.st and rng.fin are used
+      chainID -- chain to query
+      checkpoint -- see queryVolsOwners()
+
     @return
       nftvols_at_chain -- dict of [nativetoken/basetoken_addr][nft_addr] : vol
       owners_at_chain -- dict of [nft_addr] : owner_addr
@@ -70,27 +140,173 @@ def queryVolsOwnersSymbols(
       A stake or nftvol value is denominated in basetoken (amt of OCEAN, H2O).
       Basetoken symbols are full uppercase, addresses are full lowercase.
     """
-    Vi_unfiltered, Ci, gasvols = _queryVolsOwners(rng.st, rng.fin, chainID)
-    swaps = _querySwaps(rng.st, rng.fin, chainID)
-    Vi = _filterNftvols(Vi_unfiltered, chainID)
-    Vi = _filterbyMaxVolume(Vi, swaps)
+    Vi, Ci = queryVolsOwners(rng, chainID, checkpoint)
+    SYMi = querySymbols(Vi, chainID)
+    return (Vi, Ci, SYMi)
+
+
+@enforce_types
+def queryVolsOwners(
+    rng: BlockRange, chainID: int, checkpoint: Optional[dict] = None
+) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str]]:
+    """
+    @description
+      For given block range and chain, return each nft's {vols, owner}.
+      Only queries the subgraph (and Aquarius), so it doesn't need to be
+      connected to the chain, and can run for many chains at once.
+
+    @arguments
+      rng -- block range. Only rng.st and rng.fin are used
+      chainID -- chain to query
+      checkpoint -- unfiltered aggregates from a previous call with the same
+        rng.st, see _updateVolsCheckpoint(). If given, only the blocks after
+        it are queried, and it's updated in-place up to rng.fin, or to the
+        last confirmed block of the subgraph if that's earlier.
+
+    @return
+      nftvols_at_chain -- dict of [nativetoken/basetoken_addr][nft_addr] : vol
+      owners_at_chain -- dict of [nft_addr] : owner_addr
+    """
+    if checkpoint is None:
+        aggregates = _queryVolsDelta(rng.st, rng.fin, chainID, OrderedDict())
+    else:
+        tail = _updateVolsCheckpoint(checkpoint, rng, chainID)
+
+        # add the tail to a copy, since it's not part of the checkpoint. And
+        # the filters modify the inner dicts
+        aggregates = copy.deepcopy({key: checkpoint[key] for key in VOLS_AGGREGATES})
+        _addVolsDelta(aggregates, tail)
+    Ci = aggregates["owners"]
+
+    Vi = _filterNftvols(aggregates["vols"], chainID)
+    Vi = _filterbyMaxVolume(Vi, aggregates["swaps"])
 
     # merge Vi and gasvols
-    for basetoken in gasvols:
-        if basetoken not in Vi:
-            Vi[basetoken] = {}
-        for nft in gasvols[basetoken]:
-            if nft not in Vi[basetoken]:
-                Vi[basetoken][nft] = 0.0
-            Vi[basetoken][nft] += gasvols[basetoken][nft]
+    _addVols(Vi, aggregates["gasvols"])
+
+    return (Vi, Ci)
+
+
+@enforce_types
+def querySymbols(Vi: Dict[str, Dict[str, float]], chainID: int) -> Dict[str, str]:
+    """
+    @description
+      Return the symbols of the basetokens in Vi. Needs to be connected
+      to chainID, for any basetoken whose symbol isn't known yet.
 
+    @return
+      symbols_at_chain -- dict of [basetoken_addr] : basetoken_symbol
+    """
     # get all basetokens from Vi
+    addr_to_symbol = symbols(list(Vi.keys()), chainID)
     basetokens = TokSet()
     for basetoken in Vi:
-        _symbol = symbol(basetoken)
-        basetokens.add(chainID, basetoken, _symbol)
+        basetokens.add(chainID, basetoken, addr_to_symbol[basetoken])
     SYMi = getSymbols(basetokens, chainID)
-    return (Vi, Ci, SYMi)
+    return SYMi
+
+
+@enforce_types
+def _updateVolsCheckpoint(checkpoint: dict, rng: BlockRange, chainID: int) -> dict:
+    """
+    @description
+      Bring the checkpoint up to rng.fin, by querying only the blocks after
+      checkpoint["fin"]. If the checkpoint is empty or doesn't match rng
+      and chainID, start over from rng.st.
+
+      The checkpoint stops at the last confirmed block of the subgraph, see
+      _confirmedBlock(): the subgraph may not have indexed later blocks
+      yet, and they may reorg. Later blocks up to rng.fin are queried too,
+      but returned separately, so that the next call queries them again.
+
+    @arguments
+      checkpoint -- dict with chainID, st, fin (last block queried), and
+        the unfiltered aggregates over blocks [st, fin]: vols, owners,
+        gasvols, swaps. And txgascost, of the latest txs. Updated in-place.
+        Json-serializable.
+
+    @return
+      tail -- dict of the unfiltered aggregates over blocks
+        [checkpoint["fin"] + 1, rng.fin]: vols, owners, gasvols, swaps
+    """
+    resume = (
+        checkpoint.get("chainID") == chainID
+        and checkpoint.get("st") == rng.st
+        and checkpoint.get("fin", rng.fin + 1) <= rng.fin
+    )
+    if resume:
+        print(f"Resume volsym checkpoint at block {checkpoint['fin']}")
+    else:
+        checkpoint.clear()
+        checkpoint.update(
+            chainID=chainID,
+            st=rng.st,
+            fin=rng.st - 1,
+            txgascost={},
+            **{key: {} for key in VOLS_AGGREGATES},
+        )
+
+    # only touch the checkpoint once all queries succeeded, so it's retryable
+    st_block = checkpoint["fin"] + 1
+    confirmed_fin = min(rng.fin, _confirmedBlock(chainID))
+    if st_block <= confirmed_fin:
+        txgascost = OrderedDict(checkpoint["txgascost"])
+        delta = _queryVolsDelta(st_block, confirmed_fin, chainID, txgascost)
+        checkpoint["txgascost"] = txgascost
+        _addVolsDelta(checkpoint, delta)
+        checkpoint["fin"] = confirmed_fin
+
+    st_block = checkpoint["fin"] + 1
+    if st_block > rng.fin:
+        return {key: {} for key in VOLS_AGGREGATES}
+
+    # a copy of txgascost, since the tail isn't part of the checkpoint
+    txgascost = OrderedDict(checkpoint["txgascost"])
+    return _queryVolsDelta(st_block, rng.fin, chainID, txgascost)
+
+
+@enforce_types
+def _confirmedBlock(chainID: int) -> int:
+    """
+    Return the last block that a volsym checkpoint can go up to:
+    VOLS_CHECKPOINT_CONFIRMATIONS below the subgraph's head. -1 if the
+    head is unknown
+    """
+    head = subgraphHead(chainID)
+    if head is None:
+        return -1
+    return head - VOLS_CHECKPOINT_CONFIRMATIONS
+
+
+@enforce_types
+def _queryVolsDelta(
+    st_block: int, end_block: int, chainID: int, txgascost: OrderedDict
+) -> dict:
+    """Return dict of the unfiltered aggregates over [st_block, end_block]"""
+    vols, owners, gasvols = _queryVolsOwners(st_block, end_block, chainID, txgascost)
+    swaps = _querySwaps(st_block, end_block, chainID)
+    return {"vols": vols, "owners": owners, "gasvols": gasvols, "swaps": swaps}
+
+
+@enforce_types
+def _addVolsDelta(aggregates: dict, delta: dict):
+    """Add the aggregates of later blocks, delta, into aggregates. In-place"""
+    _addVols(aggregates["vols"], delta["vols"])
+    aggregates["owners"].update(delta["owners"])
+    _addVols(aggregates["gasvols"], delta["gasvols"])
+    _addVols(aggregates["swaps"], delta["swaps"])
+
+
+@enforce_types
+def _addVols(vols: Dict[str, Dict[str, float]], vols2: Dict[str, Dict[str, float]]):
+    """Add vols2 into vols, in-place. Each is dict of [token][nft_addr]:amt"""
+    for basetoken in vols2:
+        if basetoken not in vols:
+            vols[basetoken] = {}
+        for nft in vols2[basetoken]:
+            if nft not in vols[basetoken]:
+                vols[basetoken][nft] = 0.0
+            vols[basetoken][nft] += vols2[basetoken][nft]
 
 
 @enforce_types
@@ -129,12 +345,17 @@ def _process_delegation(
 
 @enforce_types
 def queryVebalances(
-    rng: BlockRange, CHAINID: int
+    rng: BlockRange, CHAINID: int, concurrency: int = QUERY_CONCURRENCY
 ) -> Tuple[Dict[str, float], Dict[str, float], Dict[str, int]]:
     """
     @description
       Return all ve balances
 
+    @arguments
+      rng -- block range to sample from
+      CHAINID -- chain to query
+      concurrency -- max # groups of sampled blocks to query at once
+
     @return
       vebals -- dict of [LP_addr] : veOCEAN_float
       locked_amt -- dict of [LP_addr] : locked_amt
@@ -150,103 +371,26 @@ def queryVebalances(
     unlock_times: Dict[str, int] = {}
 
     unixEpochTime = brownie.network.chain.time()
-    n_blocks = rng.numBlocks()
     n_blocks_sampled = 0
-    blocks = rng.getBlocks()
     print("queryVebalances: begin")
 
-    for block_i, block in enumerate(blocks):
-        if (block_i % 50) == 0 or (block_i == n_blocks - 1):
-            print(f"  {(block_i+1) / float(n_blocks) * 100.0:.1f}% done")
-        chunk_size = 1000
-        offset = 0
-        while True:
-            query = """
-              {
-                veOCEANs(first: %d, skip: %d,block:{number: %d}) {
-                  id
-                  lockedAmount
-                  unlockTime
-                  delegation {
-                    id
-                    receiver {
-                      id
-                    }
-                    amount
-                    expireTime
-                    timeLeftUnlock
-                    lockedAmount
-                    updates(orderBy:timestamp orderDirection:asc){
-                      timestamp
-                      sender
-                      amount
-                      type
-                    }
-                  }
-                }
-              }
-            """ % (
-                chunk_size,
-                offset,
-                block,
-            )
+    def queryAtBlocks(blocks):
+        return _queryVebalancesAtBlocks(blocks, CHAINID, unixEpochTime)
 
-            result = submitQuery(query, CHAINID)
-            if "data" in result:
-                assert "veOCEANs" in result["data"]
-                veOCEANs = result["data"]["veOCEANs"]
-            else:
-                return ({}, {}, {})
-
-            if len(veOCEANs) == 0:
-                # means there are no records left
-                break
-
-            for user in veOCEANs:
-                ve_unlock_time = int(user["unlockTime"])
-                time_left_to_unlock = (
-                    ve_unlock_time - unixEpochTime
-                )  # time left in seconds
-                if time_left_to_unlock < 0:  # check if the lock has expired
-                    continue
-
-                # initial balance before accounting in delegations
-                balance_init = (
-                    float(user["lockedAmount"]) * time_left_to_unlock / MAX_TIME
-                )
-
-                # this will the balance after accounting in delegations
-                # see the calculations below
-                balance = balance_init
-
-                for delegation in user["delegation"]:
-                    balance, delegation_amt, delegated_to = _process_delegation(
-                        delegation, balance, unixEpochTime, time_left_to_unlock
-                    )
-
-                    if delegation_amt == 0:
-                        continue
+    # merge in block order, so that results don't depend on concurrency
+    for block_result in _queryBlocks(queryAtBlocks, rng, concurrency):
+        if block_result is None:
+            return ({}, {}, {})
 
-                    vebals.setdefault(delegated_to, 0)
-                    locked_amts.setdefault(delegated_to, 0)
-                    unlock_times.setdefault(delegated_to, 0)
-                    vebals[delegated_to] += delegation_amt
+        vebals_at_block, locked_amts_at_block, unlock_times_at_block = block_result
+        for LP_addr, balance in vebals_at_block.items():
+            vebals.setdefault(LP_addr, 0)
+            vebals[LP_addr] += balance
 
-                if balance < 0:
-                    raise ValueError("balance < 0, something is wrong")
-                # set user balance
-                LP_addr = user["id"].lower()
-                vebals.setdefault(LP_addr, 0)
-                vebals[LP_addr] += balance
-
-                # set locked amount
-                locked_amts[LP_addr] = float(user["lockedAmount"])
-
-                # set unlock time
-                unlock_times[LP_addr] = ve_unlock_time
+        _mergeLocks(
+            locked_amts, unlock_times, locked_amts_at_block, unlock_times_at_block
+        )
 
-            # increase offset
-            offset += chunk_size
         n_blocks_sampled += 1
 
     assert n_blocks_sampled > 0
@@ -260,131 +404,562 @@ def queryVebalances(
     return vebals, locked_amts, unlock_times
 
 
+@enforce_types
+def queryVebalancesFromEvents(
+    rng: BlockRange, CHAINID: int, concurrency: int = QUERY_CONCURRENCY
+) -> Tuple[Dict[str, float], Dict[str, float], Dict[str, int]]:
+    """
+    @description
+      Return all ve balances, like queryVebalances(). But rather than
+      averaging over sampled blocks, take one snapshot of all veOCEANs at
+      rng.st, then replay the changes: the blocks in (rng.st, rng.fin] with
+      a lock deposit/withdraw or a delegation update, and the veOCEANs that
+      changed in each. Balances are piecewise constant between changes, so
+      vebals is the exact average over all blocks [rng.st, rng.fin].
+
+    @arguments
+      rng -- block range. Only rng.st and rng.fin are used
+      CHAINID -- chain to query
+      concurrency -- max # change blocks to query at once
+
+    @return
+      Same as queryVebalances()
+    """
+    print("queryVebalancesFromEvents: begin")
+    unixEpochTime = brownie.network.chain.time()
+
+    veOCEANs = _queryVeOCEANs(rng.st, CHAINID)
+    if veOCEANs is None:
+        return ({}, {}, {})
+    changes = _queryVeChanges(rng.st, rng.fin, CHAINID)
+    print(f"  {len(veOCEANs)} veOCEANs, changed at {len(changes)} blocks")
+
+    # [LP_addr] : sum over blocks so far of veBalance
+    vebals_sum: Dict[str, float] = {}
+
+    # [LP_addr] : (veBalance, first block with that veBalance)
+    vebals_now: Dict[str, Tuple[float, int]] = {}
+
+    # [holder_addr][LP_addr] : veBalance, incl. delegated to LP_addr
+    holder_vebals: Dict[str, Dict[str, float]] = {}
+
+    locked_amts: Dict[str, float] = {}
+    unlock_times: Dict[str, int] = {}
+
+    def replay(block, veOCEANs_changed):
+        for user in veOCEANs_changed:
+            holder_addr = user["id"].lower()
+            vebals2, locked_amts2, unlock_times2 = _vebalsFromVeOCEANs(
+                [user], unixEpochTime
+            )
+            prev_vebals2 = holder_vebals.get(holder_addr, {})
+            for LP_addr in set(vebals2) | set(prev_vebals2):
+                delta = vebals2.get(LP_addr, 0.0) - prev_vebals2.get(LP_addr, 0.0)
+                balance, since_block = vebals_now.get(LP_addr, (0.0, block))
+                vebals_sum.setdefault(LP_addr, 0.0)
+                vebals_sum[LP_addr] += balance * (block - since_block)
+                vebals_now[LP_addr] = (balance + delta, block)
+            holder_vebals[holder_addr] = vebals2
+            _mergeLocks(locked_amts, unlock_times, locked_amts2, unlock_times2)
+
+    replay(rng.st, veOCEANs)
+
+    def queryAtBlock(block):
+        return _queryVeOCEANs(block, CHAINID, changes[block])
+
+    # replay in block order
+    blocks = list(changes.keys())
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for block, veOCEANs_changed in zip(blocks, executor.map(queryAtBlock, blocks)):
+            assert veOCEANs_changed is not None
+            replay(block, veOCEANs_changed)
+
+    # get average
+    n_blocks = rng.fin - rng.st + 1
+    vebals: Dict[str, float] = {}
+    for LP_addr, (balance, since_block) in vebals_now.items():
+        vebals_sum[LP_addr] += balance * (rng.fin + 1 - since_block)
+        vebals[LP_addr] = vebals_sum[LP_addr] / n_blocks
+
+    print("queryVebalancesFromEvents: done")
+
+    return vebals, locked_amts, unlock_times
+
+
+@enforce_types
+def _queryVeChanges(st_block: int, fin_block: int, CHAINID: int) -> Dict[int, list]:
+    """
+    @description
+      Return which veOCEANs changed at which blocks in (st_block, fin_block]:
+      lock deposits & withdrawals, and updates to delegations they made.
+
+    @return
+      changes -- dict of [block] : list of veOCEAN holder addrs, sorted by block
+    """
+    changes: Dict[int, set] = {}
+    where = "block_gt: %d, block_lte: %d" % (st_block, fin_block)
+
+    for deposit in paginatedQuery("veDeposits", "provider block", CHAINID, where):
+        block = int(deposit["block"])
+        changes.setdefault(block, set()).add(deposit["provider"].lower())
+
+    fields = "block veDelegation { delegator { id } }"
+    for update in paginatedQuery("veDelegationUpdates", fields, CHAINID, where):
+        block = int(update["block"])
+        holder_addr = update["veDelegation"]["delegator"]["id"].lower()
+        changes.setdefault(block, set()).add(holder_addr)
+
+    return {block: sorted(changes[block]) for block in sorted(changes)}
+
+
+@enforce_types
+def _queryVebalancesAtBlocks(blocks: list, CHAINID: int, unixEpochTime: int) -> list:
+    """
+    @description
+      Return ve balances at each of the blocks. Helper for queryVebalances().
+
+    @return
+      block_results -- list with per block, a tuple of:
+        vebals -- dict of [LP_addr] : veOCEAN_float, incl. delegations
+        locked_amt -- dict of [LP_addr] : locked_amt. None if LP_addr only
+          received a delegation (and doesn't hold veOCEAN itself)
+        unlock_time -- dict of [LP_addr] : unlock_time
+      Or None, if the subgraph returned no data.
+    """
+    block_results: list = []
+    try:
+        for _, veOCEANs in paginatedQueryBlocks(
+            "veOCEANs", _VEOCEAN_FIELDS, CHAINID, blocks
+        ):
+            block_results.append(_vebalsFromVeOCEANs(veOCEANs, unixEpochTime))
+    except AssertionError:  # eg no veOCEAN on this chain
+        block_results += [None] * (len(blocks) - len(block_results))
+
+    return block_results
+
+
+@enforce_types
+def _vebalsFromVeOCEANs(
+    veOCEANs: list, unixEpochTime: int
+) -> Tuple[Dict[str, float], Dict[str, Optional[float]], Dict[str, int]]:
+    """
+    @description
+      Return ve balances of the given veOCEAN holders, incl. delegations.
+
+    @arguments
+      veOCEANs -- list of veOCEAN records from the subgraph, see _queryVeOCEANs()
+      unixEpochTime -- time to compute veOCEAN decay at
+
+    @return
+      Same as the per-block tuple of _queryVebalancesAtBlocks()
+    """
+    vebals: Dict[str, float] = {}
+    locked_amts: Dict[str, Optional[float]] = {}
+    unlock_times: Dict[str, int] = {}
+
+    for user in veOCEANs:
+        ve_unlock_time = int(user["unlockTime"])
+        time_left_to_unlock = ve_unlock_time - unixEpochTime  # time left in seconds
+        if time_left_to_unlock < 0:  # check if the lock has expired
+            continue
+
+        # initial balance before accounting in delegations
+        balance_init = float(user["lockedAmount"]) * time_left_to_unlock / MAX_TIME
+
+        # this will the balance after accounting in delegations
+        # see the calculations below
+        balance = balance_init
+
+        for delegation in user["delegation"]:
+            balance, delegation_amt, delegated_to = _process_delegation(
+                delegation, balance, unixEpochTime, time_left_to_unlock
+            )
+
+            if delegation_amt == 0:
+                continue
+
+            vebals.setdefault(delegated_to, 0)
+            locked_amts.setdefault(delegated_to, None)
+            vebals[delegated_to] += delegation_amt
+
+        if balance < 0:
+            raise ValueError("balance < 0, something is wrong")
+        # set user balance
+        LP_addr = user["id"].lower()
+        vebals.setdefault(LP_addr, 0)
+        vebals[LP_addr] += balance
+
+        # set locked amount
+        locked_amts[LP_addr] = float(user["lockedAmount"])
+
+        # set unlock time
+        unlock_times[LP_addr] = ve_unlock_time
+
+    return vebals, locked_amts, unlock_times
+
+
+_VEOCEAN_FIELDS = """
+  lockedAmount
+  unlockTime
+  delegation {
+    id
+    receiver {
+      id
+    }
+    amount
+    expireTime
+    timeLeftUnlock
+    lockedAmount
+    updates(orderBy:timestamp orderDirection:asc){
+      timestamp
+      sender
+      amount
+      type
+    }
+  }
+"""
+
+
+@enforce_types
+def _queryVeOCEANs(
+    block: int, CHAINID: int, ids: Optional[list] = None
+) -> Optional[List[dict]]:
+    """
+    @description
+      Return veOCEAN records (with their delegations) at the given block.
+
+    @arguments
+      block -- block number
+      CHAINID -- chain to query
+      ids -- if given, only return the records of these veOCEAN holders
+
+    @return
+      veOCEANs -- list of dict. None if there's no veOCEAN on this chain.
+    """
+    where = ""
+    if ids is not None:
+        where = "id_in: [%s]" % ", ".join(f'"{id_}"' for id_ in ids)
+    try:
+        return list(paginatedQuery("veOCEANs", _VEOCEAN_FIELDS, CHAINID, where, block))
+    except AssertionError:  # eg no veOCEAN on this chain
+        return None
+
+
+@enforce_types
+def _mergeLocks(
+    locked_amts: Dict[str, float],
+    unlock_times: Dict[str, int],
+    locked_amts2: Dict[str, Optional[float]],
+    unlock_times2: Dict[str, int],
+):
+    """
+    @description
+      Merge the locks of a later block (locked_amts2, unlock_times2, as
+      returned by _vebalsFromVeOCEANs()) into locked_amts and unlock_times,
+      in-place. Later locks win. Addresses that only received a delegation
+      get 0, unless they have a lock of their own.
+    """
+    for LP_addr, locked_amt in locked_amts2.items():
+        if locked_amt is None:  # delegation receiver only
+            locked_amts.setdefault(LP_addr, 0)
+            unlock_times.setdefault(LP_addr, 0)
+        else:
+            locked_amts[LP_addr] = locked_amt
+            unlock_times[LP_addr] = unlock_times2[LP_addr]
+
+
 @enforce_types
 def queryAllocations(
-    rng: BlockRange, CHAINID: int
+    rng: BlockRange, CHAINID: int, concurrency: int = QUERY_CONCURRENCY
 ) -> Dict[int, Dict[str, Dict[str, float]]]:
     """
     @description
       Return all allocations.
 
+    @arguments
+      rng -- block range to sample from
+      CHAINID -- chain to query
+      concurrency -- max # groups of sampled blocks to query at once
+
     @return
       allocations -- dict of [chain_id][nft_addr][LP_addr]: percent
     """
 
-    # [chain_id][nft_addr][LP_addr] : percent
-    allocs: Dict[int, Dict[str, Dict[str, float]]] = {}
+    # [(LP_addr, chain_id, nft_addr)] : sum over sampled blocks of allocated
+    allocs_sum: Dict[Tuple[str, int, str], float] = {}
 
-    n_blocks = rng.numBlocks()
     n_blocks_sampled = 0
-    blocks = rng.getBlocks()
-
-    for block_i, block in enumerate(blocks):
-        if (block_i % 50) == 0 or (block_i == n_blocks - 1):
-            print(f"  {(block_i+1) / float(n_blocks) * 100.0:.1f}% done")
-
-        offset = 0
-        chunk_size = 1000
-        while True:
-            query = """
-          {
-            veAllocateUsers(first: %d, skip: %d, block:{number:%d}) {
-              id
-              veAllocation {
-                id
-                allocated
-                chainId
-                nftAddress
-              }
-            }
-          }
-          """ % (
-                chunk_size,
-                offset,
-                block,
-            )
-            result = submitQuery(query, CHAINID)
-            if "data" in result:
-                assert "veAllocateUsers" in result["data"]
-                _allocs = result["data"]["veAllocateUsers"]
-            else:
-                return {}
 
-            if len(_allocs) == 0:
-                # means there are no records left
-                break
+    def queryAtBlocks(blocks):
+        return _queryAllocationsAtBlocks(blocks, CHAINID)
 
-            for allocation in _allocs:
-                LP_addr = allocation["id"].lower()
-                for ve_allocation in allocation["veAllocation"]:
-                    nft_addr = ve_allocation["nftAddress"].lower()
-                    chain_id = int(ve_allocation["chainId"])
-                    allocated = float(ve_allocation["allocated"])
-
-                    if chain_id not in allocs:
-                        allocs[chain_id] = {}
-                    if nft_addr not in allocs[chain_id]:
-                        allocs[chain_id][nft_addr] = {}
+    # merge in block order, so that results don't depend on concurrency
+    for block_allocs in _queryBlocks(queryAtBlocks, rng, concurrency):
+        if block_allocs is None:
+            return {}
 
-                    if LP_addr not in allocs[chain_id][nft_addr]:
-                        allocs[chain_id][nft_addr][LP_addr] = allocated
-                    else:
-                        allocs[chain_id][nft_addr][LP_addr] += allocated
+        for LP_addr, chain_id, nft_addr, allocated in block_allocs:
+            key = (LP_addr, chain_id, nft_addr)
+            allocs_sum[key] = allocs_sum.get(key, 0.0) + allocated
 
-            offset += chunk_size
         n_blocks_sampled += 1
 
     assert n_blocks_sampled > 0
 
-    # get average
-    for chain_id in allocs:
-        for nft_addr in allocs[chain_id]:
-            for LP_addr in allocs[chain_id][nft_addr]:
-                allocs[chain_id][nft_addr][LP_addr] /= n_blocks_sampled
+    return _averageAllocations(allocs_sum, n_blocks_sampled)
+
+
+@enforce_types
+def queryAllocationsFromEvents(
+    rng: BlockRange, CHAINID: int
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    @description
+      Return all allocations, like queryAllocations(). But rather than
+      averaging over sampled blocks, take one snapshot of all allocations at
+      rng.st, then replay the veAllocate allocation updates in
+      (rng.st, rng.fin] in block order. Allocations are piecewise constant
+      between updates, so the result is the exact average over all blocks
+      [rng.st, rng.fin].
+
+    @arguments
+      rng -- block range. Only rng.st and rng.fin are used
+      CHAINID -- chain to query
+
+    @return
+      allocations -- dict of [chain_id][nft_addr][LP_addr]: percent
+    """
+    [block_allocs] = _queryAllocationsAtBlocks([rng.st], CHAINID)
+    if block_allocs is None:
+        return {}
+
+    # [(LP_addr, chain_id, nft_addr)] : sum over blocks so far of allocated
+    allocs_sum: Dict[Tuple[str, int, str], float] = {}
+
+    # [(LP_addr, chain_id, nft_addr)] : (allocated, first block with it)
+    allocs_now: Dict[Tuple[str, int, str], Tuple[float, int]] = {}
+
+    def replay(block, LP_addr, chain_id, nft_addr, allocated):
+        key = (LP_addr, chain_id, nft_addr)
+        prev_allocated, since_block = allocs_now.get(key, (0.0, block))
+        allocs_sum[key] = allocs_sum.get(key, 0.0)
+        allocs_sum[key] += prev_allocated * (block - since_block)
+        allocs_now[key] = (allocated, block)
 
+    for LP_addr, chain_id, nft_addr, allocated in block_allocs:
+        replay(rng.st, LP_addr, chain_id, nft_addr, allocated)
+
+    updates = _queryAllocationUpdates(rng.st, rng.fin, CHAINID)
+    print(f"  {len(block_allocs)} allocations, {len(updates)} updates")
+    for update in updates:
+        replay(*update)
+
+    n_blocks = rng.fin - rng.st + 1
+    for key, (allocated, since_block) in allocs_now.items():
+        allocs_sum[key] += allocated * (rng.fin + 1 - since_block)
+
+    return _averageAllocations(allocs_sum, n_blocks)
+
+
+@enforce_types
+def _averageAllocations(
+    allocs_sum: Dict[Tuple[str, int, str], float], n_blocks: int
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    @description
+      Turn summed allocations into the average allocation per block, as a
+      fraction of each LP's total allocation (or of MAX_ALLOCATE, if the LP
+      allocated less than that).
+
+    @arguments
+      allocs_sum -- dict of [(LP_addr, chain_id, nft_addr)] : allocated,
+        summed over n_blocks blocks
+      n_blocks -- # blocks summed over
+
+    @return
+      allocations -- dict of [chain_id][nft_addr][LP_addr]: percent
+    """
     # get total allocs per each LP
-    lp_total = {}
-    for chain_id in allocs:
-        for nft_addr in allocs[chain_id]:
-            for LP_addr in allocs[chain_id][nft_addr]:
-                if LP_addr not in lp_total:
-                    lp_total[LP_addr] = 0.0
-                lp_total[LP_addr] += allocs[chain_id][nft_addr][LP_addr]
+    lp_total: Dict[str, float] = {}
+    for (LP_addr, _, _), allocated in allocs_sum.items():
+        lp_total[LP_addr] = lp_total.get(LP_addr, 0.0) + allocated / n_blocks
 
     for LP_addr in lp_total:
         if lp_total[LP_addr] < MAX_ALLOCATE:
             lp_total[LP_addr] = MAX_ALLOCATE
 
-    # normalize values per LP
-    for chain_id in allocs:
-        for nft_addr in allocs[chain_id]:
-            for LP_addr in allocs[chain_id][nft_addr]:
-                if lp_total[LP_addr] == 0.0:
-                    print(f"WARNING: {lp_total[LP_addr]} == 0.0")
-                    continue
-                allocs[chain_id][nft_addr][LP_addr] /= lp_total[LP_addr]
+    # [chain_id][nft_addr][LP_addr] : percent
+    allocs: Dict[int, Dict[str, Dict[str, float]]] = {}
+    for (LP_addr, chain_id, nft_addr), allocated in allocs_sum.items():
+        allocs.setdefault(chain_id, {}).setdefault(nft_addr, {})
+        allocs[chain_id][nft_addr][LP_addr] = allocated / n_blocks / lp_total[LP_addr]
 
     return allocs
 
 
 @enforce_types
-def queryNftinfo(chainID, endBlock="latest") -> List[SimpleDataNft]:
+def _queryAllocationUpdates(
+    st_block: int, fin_block: int, CHAINID: int
+) -> List[Tuple[int, str, int, str, float]]:
+    """
+    @description
+      Return the veAllocate allocation updates in (st_block, fin_block].
+
+    @return
+      updates -- list of (block, LP_addr, chain_id, nft_addr, allocated),
+        in log order. allocated is the new allocation after the update
+    """
+    # list of ((block, eventIndex), update)
+    updates: List[Tuple[Tuple[int, int], Tuple[int, str, int, str, float]]] = []
+
+    fields = """
+      block
+      eventIndex
+      allocatedTotal
+      veAllocation {
+        allocationUser {
+          id
+        }
+        chainId
+        nftAddress
+      }
+    """
+    where = "block_gt: %d, block_lte: %d" % (st_block, fin_block)
+    for update in paginatedQuery("veAllocationUpdates", fields, CHAINID, where):
+        ve_allocation = update["veAllocation"]
+        block = int(update["block"])
+        updates.append(
+            (
+                (block, int(update["eventIndex"])),
+                (
+                    block,
+                    ve_allocation["allocationUser"]["id"].lower(),
+                    int(ve_allocation["chainId"]),
+                    ve_allocation["nftAddress"].lower(),
+                    float(update["allocatedTotal"]),
+                ),
+            )
+        )
+
+    # subgraph (id) order isn't log order: ids start with the tx hash. So two
+    # txs in a block that update the same allocation need the event index
+    updates.sort(key=lambda update: update[0])
+    return [update for _, update in updates]
+
+
+@enforce_types
+def _queryAllocationsAtBlocks(blocks: list, CHAINID: int) -> list:
+    """
+    @description
+      Return allocations at each of the blocks. Helper for queryAllocations().
+
+    @return
+      block_results -- list with per block, a list of
+        (LP_addr, chain_id, nft_addr, allocated), in subgraph order.
+        Or None, if the subgraph returned no data.
+    """
+    block_results: list = []
+
+    fields = """
+      veAllocation {
+        id
+        allocated
+        chainId
+        nftAddress
+      }
+    """
+    try:
+        for _, _allocs in paginatedQueryBlocks(
+            "veAllocateUsers", fields, CHAINID, blocks
+        ):
+            block_allocs: List[Tuple[str, int, str, float]] = []
+            for allocation in _allocs:
+                LP_addr = allocation["id"].lower()
+                for ve_allocation in allocation["veAllocation"]:
+                    nft_addr = ve_allocation["nftAddress"].lower()
+                    chain_id = int(ve_allocation["chainId"])
+                    allocated = float(ve_allocation["allocated"])
+                    block_allocs.append((LP_addr, chain_id, nft_addr, allocated))
+            block_results.append(block_allocs)
+    except AssertionError:  # eg no veAllocate on this chain
+        block_results += [None] * (len(blocks) - len(block_results))
+
+    return block_results
+
+
+def _queryBlocks(query_f: Callable, rng: BlockRange, concurrency: int) -> Iterator:
+    """
+    @description
+      Split the sampled blocks in rng into up to `concurrency` groups of
+      consecutive blocks, and call query_f(blocks) for all groups at once.
+      query_f packs the blocks of its group into few requests, see
+      graphutil.paginatedQueryBlocks().
+
+    @return
+      results -- iterator of the result per block, in block order
+    """
+    assert concurrency >= 1
+    blocks = [int(block) for block in rng.getBlocks()]
+    n_blocks = len(blocks)
+    group_size = max(1, math.ceil(n_blocks / concurrency))
+    groups = [blocks[i : i + group_size] for i in range(0, n_blocks, group_size)]
+
+    block_i = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for group_results in executor.map(query_f, groups):
+            for result in group_results:
+                if (block_i % 50) == 0 or (block_i == n_blocks - 1):
+                    print(f"  {(block_i+1) / float(n_blocks) * 100.0:.1f}% done")
+                block_i += 1
+                yield result
+
+
+@enforce_types
+def queryNftinfo(
+    chainID,
+    endBlock="latest",
+    prev_nftinfo: Optional[list] = None,
+    prev_fin: Optional[int] = None,
+) -> List[SimpleDataNft]:
     """
     @description
       Fetch, filter and return all NFTs on the chain
 
+      If prev_nftinfo and prev_fin are given, only query the NFTs created or
+      transferred in blocks (prev_fin, endBlock], and merge them into
+      prev_nftinfo. Only those get re-checked in Aquarius. Purgatory status
+      is re-checked for all, since the purgatory list changes on its own.
+
+    @arguments
+      chainID -- which network
+      endBlock -- block # to query the state at, or "latest"
+      prev_nftinfo -- list of SimpleDataNft, result of the previous run
+      prev_fin -- endBlock of the previous run
+
     @return
-      nftInfo -- list of SimpleDataNft objects
+      nftInfo -- list of SimpleDataNft objects, in nft_addr order
     """
+    assert (prev_nftinfo is None) == (prev_fin is None)
+    if endBlock == "latest":
+        endBlock = networkutil.getLatestBlock(chainID)
 
-    nftinfo = _queryNftinfo(chainID, endBlock)
+    nftinfo = _queryNftinfo(chainID, endBlock, since_block=prev_fin)
+    changed_addrs = {nft.nft_addr for nft in nftinfo}
 
     if chainID != networkutil.DEV_CHAINID:
         # filter if not on dev chain
         nftinfo = _filterNftinfos(nftinfo)
-        nftinfo = _markPurgatoryNfts(nftinfo)
         nftinfo = _populateNftAssetNames(nftinfo)
 
+    if prev_nftinfo is not None:
+        # changed nfts replace their previous record, or drop it if filtered
+        unchanged = [nft for nft in prev_nftinfo if nft.nft_addr not in changed_addrs]
+        nftinfo = sorted(unchanged + nftinfo, key=lambda nft: nft.nft_addr)
+        print(f"Merged {len(changed_addrs)} changed NFTs since block {prev_fin}")
+
+    if chainID != networkutil.DEV_CHAINID:
+        nftinfo = _markPurgatoryNfts(nftinfo)
+
     return nftinfo
 
 
@@ -408,168 +983,222 @@ def _populateNftAssetNames(nftInfo: List[SimpleDataNft]) -> List[SimpleDataNft]:
 
 
 @enforce_types
-def _queryNftinfo(chainID, endBlock) -> List[SimpleDataNft]:
+def _queryNftinfo(
+    chainID, endBlock, since_block: Optional[int] = None
+) -> List[SimpleDataNft]:
     """
     @description
-      Return all NFTs on the chain
+      Return all NFTs on the chain. Or if since_block is given, only the
+      NFTs created or transferred in blocks (since_block, endBlock]
 
     @return
-      nftInfo -- list of SimpleDataNft objects
+      nftInfo -- list of SimpleDataNft objects, in nft_addr order
     """
     nftinfo = []
-    chunk_size = 1000
-    offset = 0
 
     if endBlock == "latest":
         endBlock = networkutil.getLatestBlock(chainID)
 
-    while True:
-        query = """
-      {
-         nfts(first: %d, skip: %d, block:{number:%d}) {
-            id
-            symbol
-            owner {
-              id
-            }
-        }
+    fields = """
+      symbol
+      owner {
+        id
       }
-      """ % (
-            chunk_size,
-            offset,
-            endBlock,
+    """
+    if since_block is None:
+        nft_records: Iterator[dict] = paginatedQuery(
+            "nfts", fields, chainID, block=endBlock
         )
-        result = submitQuery(query, chainID)
-        nft_records = result["data"]["nfts"]
-        if len(nft_records) == 0:
-            # means there are no records left
-            break
-
-        for nft_record in nft_records:
-            nft_addr = nft_record["id"]
-            _symbol = nft_record["symbol"]
-            owner_addr = nft_record["owner"]["id"]
-            simple_data_nft = SimpleDataNft(
-                chain_id=chainID,
-                nft_addr=nft_addr,
-                _symbol=_symbol,
-                owner_addr=owner_addr,
-            )
-            nftinfo.append(simple_data_nft)
-
-        offset += chunk_size
+    else:
+        nft_records = _queryChangedNfts(fields, chainID, since_block, endBlock)
+
+    for nft_record in nft_records:
+        nft_addr = nft_record["id"]
+        _symbol = nft_record["symbol"]
+        owner_addr = nft_record["owner"]["id"]
+        simple_data_nft = SimpleDataNft(
+            chain_id=chainID,
+            nft_addr=nft_addr,
+            _symbol=_symbol,
+            owner_addr=owner_addr,
+        )
+        nftinfo.append(simple_data_nft)
 
     return nftinfo
 
 
+@enforce_types
+def _queryChangedNfts(
+    fields: str, chainID: int, since_block: int, endBlock: int
+) -> List[dict]:
+    """
+    @description
+      Return the records of the nfts created or transferred in blocks
+      (since_block, endBlock], with their state at endBlock
+
+    @return
+      nft_records -- list of dict, in id order
+    """
+    where = f"block_gt: {since_block}"
+    created = list(paginatedQuery("nfts", fields, chainID, where, endBlock))
+
+    created_addrs = {record["id"] for record in created}
+    transfers = paginatedQuery(
+        "nftTransferHistories",
+        "nft { id }",
+        chainID,
+        f"{where}, block_lte: {endBlock}",
+        endBlock,
+    )
+    transferred_addrs = sorted(
+        {transfer["nft"]["id"] for transfer in transfers} - created_addrs
+    )
+
+    transferred = []
+    for i in range(0, len(transferred_addrs), CHUNK_SIZE):
+        ids = ", ".join(f'"{addr}"' for addr in transferred_addrs[i : i + CHUNK_SIZE])
+        transferred += paginatedQuery(
+            "nfts", fields, chainID, f"id_in: [{ids}]", endBlock
+        )
+
+    return sorted(created + transferred, key=lambda record: record["id"])
+
+
 @enforce_types
 def _queryVolsOwners(
-    st_block: int, end_block: int, chainID: int
+    st_block: int,
+    end_block: int,
+    chainID: int,
+    txgascost: Optional[OrderedDict] = None,
 ) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float], Dict[str, Dict[str, float]]]:
     """
     @description
       Query the chain for datanft volumes within the given block range.
 
+      Orders are streamed page by page into per-(basetoken, nft) sums, so
+      memory doesn't grow with the # orders.
+
+    @arguments
+      txgascost -- OrderedDict of [tx hash] : gas cost, of the latest
+        TX_DEDUP_WINDOW txs whose gas is already counted (eg in earlier
+        blocks). Updated in-place.
+
     @return
       vols (at chain) -- dict of [nativetoken/basetoken_addr][nft_addr]:vol_amt
       owners (at chain) -- dict of [nft_addr]:vol_amt
+      gasvols (at chain) -- dict of [nativetoken_addr][nft_addr]:gas_amt
     """
     print("_queryVolsOwners(): begin")
 
+    if txgascost is None:
+        txgascost = OrderedDict()  # tx hash : gas cost
+
+    fields = """
+      datatoken {
+        id
+        symbol
+        nft {
+          id
+          owner{
+            id
+          }
+        }
+        dispensers {
+          id
+        }
+      },
+      lastPriceToken{
+        id
+      },
+      lastPriceValue,
+      block,
+      gasPrice,
+      gasUsed,
+      tx
+    """
+    where = "block_gte:%s, block_lte:%s" % (st_block, end_block)
+    new_orders = paginatedQuery("orders", fields, chainID, where=where)
+    vols, owners, gasvols = _foldOrders(new_orders, chainID, txgascost)
+
+    print("_queryVolsOwners(): done")
+    return (vols, owners, gasvols)
+
+
+@enforce_types
+def _foldOrders(
+    orders: Iterable[dict], chainID: int, txgascost: OrderedDict
+) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float], Dict[str, Dict[str, float]]]:
+    """
+    @description
+      Sum a stream of orders into vols, owners and gasvols. Helper for
+      _queryVolsOwners(); see it for arguments and return values.
+    """
     vols: Dict[str, Dict[str, float]] = {}
     gasvols: Dict[str, Dict[str, float]] = {}
     owners: Dict[str, float] = {}
-    txgascost: Dict[str, float] = {}  # tx hash : gas cost
-
-    chunk_size = 1000  # max for subgraph = 1000
-    offset = 0
-    while True:
-        query = """
-        {
-          orders(where: {block_gte:%s, block_lte:%s}, skip:%s, first:%s) {
-            id,
-            datatoken {
-              id
-              symbol
-              nft {
-                id
-                owner{
-                  id
-                }
-              }
-              dispensers {
-                id
-              }
-            },
-            lastPriceToken{
-              id
-            },
-            lastPriceValue,
-            block,
-            gasPrice,
-            gasUsed,
-            tx
-          }
-        }
-        """ % (
-            st_block,
-            end_block,
-            offset,
-            chunk_size,
-        )
-        offset += chunk_size
-        result = submitQuery(query, chainID)
-        if "errors" in result:
-            raise AssertionError(result)
-        new_orders = result["data"]["orders"]
-
-        if new_orders == []:
-            break
-        for order in new_orders:
-            lastPriceValue = float(order["lastPriceValue"])
-            if len(order["datatoken"]["dispensers"]) == 0 and lastPriceValue == 0:
-                continue
-            basetoken_addr = order["lastPriceToken"]["id"].lower()
-            nft_addr = order["datatoken"]["nft"]["id"].lower()
-            owner_addr = order["datatoken"]["nft"]["owner"]["id"].lower()
 
-            # add owner
-            owners[nft_addr] = owner_addr
+    for order in orders:
+        lastPriceValue = float(order["lastPriceValue"])
+        if len(order["datatoken"]["dispensers"]) == 0 and lastPriceValue == 0:
+            continue
+        basetoken_addr = order["lastPriceToken"]["id"].lower()
+        nft_addr = order["datatoken"]["nft"]["id"].lower()
+        owner_addr = order["datatoken"]["nft"]["owner"]["id"].lower()
 
-            # Calculate gas cost
-            gasCostWei = int(order["gasPrice"]) * int(order["gasUsed"])
+        # add owner
+        owners[nft_addr] = owner_addr
 
-            # deduct 1 wei so it's not profitable for free assets
-            gasCost = from_wei(gasCostWei - 1)
-            native_token_addr = networkutil._CHAINID_TO_ADDRS[chainID].lower()
+        # Calculate gas cost
+        gasCostWei = int(order["gasPrice"]) * int(order["gasUsed"])
 
-            # add gas cost value
-            if gasCost > 0:
-                if native_token_addr not in gasvols:
-                    gasvols[native_token_addr] = {}
+        # deduct 1 wei so it's not profitable for free assets
+        gasCost = from_wei(gasCostWei - 1)
+        native_token_addr = networkutil._CHAINID_TO_ADDRS[chainID].lower()
 
-                if nft_addr not in gasvols[native_token_addr]:
-                    gasvols[native_token_addr][nft_addr] = 0
+        # add gas cost value
+        if gasCost > 0:
+            if native_token_addr not in gasvols:
+                gasvols[native_token_addr] = {}
 
-                if order["tx"] not in txgascost:
-                    txgascost[order["tx"]] = gasCost
-                    gasvols[native_token_addr][nft_addr] += gasCost
+            if nft_addr not in gasvols[native_token_addr]:
+                gasvols[native_token_addr][nft_addr] = 0
 
-            if lastPriceValue == 0:
-                continue
+            if _rememberTx(txgascost, order["tx"], gasCost):
+                gasvols[native_token_addr][nft_addr] += gasCost
 
-            # add lastPriceValue
-            if basetoken_addr not in vols:
-                vols[basetoken_addr] = {}
+        if lastPriceValue == 0:
+            continue
 
-            if nft_addr not in vols[basetoken_addr]:
-                vols[basetoken_addr][nft_addr] = 0.0
-            vols[basetoken_addr][nft_addr] += lastPriceValue
+        # add lastPriceValue
+        if basetoken_addr not in vols:
+            vols[basetoken_addr] = {}
+
+        if nft_addr not in vols[basetoken_addr]:
+            vols[basetoken_addr][nft_addr] = 0.0
+        vols[basetoken_addr][nft_addr] += lastPriceValue
 
-    print("_queryVolsOwners(): done")
     return (vols, owners, gasvols)
 
 
+@enforce_types
+def _rememberTx(txgascost: OrderedDict, tx: str, gasCost: float) -> bool:
+    """
+    @description
+      Remember tx's gas cost, unless it's already counted. Keeps only the
+      latest TX_DEDUP_WINDOW txs. That's enough: a tx's orders all have ids
+      that start with its hash, so they come in a row when paging by id.
+
+    @return
+      is_new -- True if tx wasn't counted yet
+    """
+    if tx in txgascost:
+        return False
+    txgascost[tx] = gasCost
+    if len(txgascost) > TX_DEDUP_WINDOW:
+        txgascost.popitem(last=False)
+    return True
+
+
 @enforce_types
 def _querySwaps(
     st_block: int, end_block: int, chainID: int
@@ -578,68 +1207,60 @@ def _querySwaps(
     @description
       Query the chain for datanft swaps within the given block range.
 
+      Swaps are streamed page by page into per-(basetoken, nft) sums, so
+      memory doesn't grow with the # swaps.
+
     @return
       vols (at chain) -- dict of [nativetoken/basetoken_addr][nft_addr]:vol_amt
       owners (at chain) -- dict of [nft_addr]:vol_amt
     """
     print("_querySwaps(): begin")
 
-    # base token, nft addr, vol
-    swaps: Dict[str, Dict[str, float]] = {}
-
-    chunk_size = 1000  # max for subgraph = 1000
-    offset = 0
-    while True:
-        query = """
-        {
-          fixedRateExchangeSwaps(where: {block_gte:%s, block_lte:%s}, skip:%s, first:%s) {
+    fields = """
+      baseTokenAmount
+      block
+      exchangeId {
+        id
+        baseToken {
+          id
+        }
+        datatoken {
+          id
+          symbol
+          nft {
             id
-            baseTokenAmount
-            block
-            exchangeId {
-              id
-              baseToken {
-                id
-              }
-              datatoken {
-                id
-                symbol
-                nft {
-                  id
-                }
-              }
-            }
           }
         }
-        """ % (
-            st_block,
-            end_block,
-            offset,
-            chunk_size,
-        )
-        offset += chunk_size
-        result = submitQuery(query, chainID)
-        if "errors" in result:
-            raise AssertionError(result)
-        new_swaps = result["data"]["fixedRateExchangeSwaps"]
-        if new_swaps == []:
-            break
-        for swap in new_swaps:
-            amt = float(swap["baseTokenAmount"])
-            if amt == 0:
-                continue
-            nft_addr = swap["exchangeId"]["datatoken"]["nft"]["id"].lower()
-            basetoken_addr = swap["exchangeId"]["baseToken"]["id"].lower()
-            if basetoken_addr not in swaps:
-                swaps[basetoken_addr] = {}
-            if nft_addr not in swaps[basetoken_addr]:
-                swaps[basetoken_addr][nft_addr] = 0.0
-            swaps[basetoken_addr][nft_addr] += amt
+      }
+    """
+    where = "block_gte:%s, block_lte:%s" % (st_block, end_block)
+    new_swaps = paginatedQuery("fixedRateExchangeSwaps", fields, chainID, where=where)
+    swaps = _foldSwaps(new_swaps)
 
     print("_querySwaps(): done")
     return swaps
 
 
+@enforce_types
+def _foldSwaps(new_swaps: Iterable[dict]) -> Dict[str, Dict[str, float]]:
+    """Sum a stream of swaps into dict of [basetoken_addr][nft_addr]:vol_amt"""
+    # base token, nft addr, vol
+    swaps: Dict[str, Dict[str, float]] = {}
+    for swap in new_swaps:
+        amt = float(swap["baseTokenAmount"])
+        if amt == 0:
+            continue
+        nft_addr = swap["exchangeId"]["datatoken"]["nft"]["id"].lower()
+        basetoken_addr = swap["exchangeId"]["baseToken"]["id"].lower()
+        if basetoken_addr not in swaps:
+            swaps[basetoken_addr] = {}
+        if nft_addr not in swaps[basetoken_addr]:
+            swaps[basetoken_addr][nft_addr] = 0.0
+        swaps[basetoken_addr][nft_addr] += amt
+
+    return swaps
+
+
 @enforce_types
 def queryPassiveRewards(
     timestamp: int,
@@ -662,16 +1283,13 @@ def queryPassiveRewards(
     balances: Dict[str, float] = {}
 
     fee_distributor = oceanutil.FeeDistributor()
-    ve_supply = fee_distributor.ve_supply(timestamp)
-    total_rewards = fee_distributor.tokens_per_week(timestamp)
-    ve_supply_float = from_wei(ve_supply)
-    total_rewards_float = from_wei(total_rewards)
+    ve_supply_float, total_rewards_float = _queryPassiveTotals(timestamp)
 
     if ve_supply_float == 0:
         return balances, rewards
 
-    for addr in addresses:
-        balance = fee_distributor.ve_for_at(addr, timestamp)
+    ve_balances = _queryVeForAt(fee_distributor, addresses, timestamp)
+    for addr, balance in zip(addresses, ve_balances):
         balance_float = from_wei(balance)
         balances[addr] = balance_float
         rewards[addr] = total_rewards_float * balance_float / ve_supply_float
@@ -680,6 +1298,190 @@ def queryPassiveRewards(
     return balances, rewards
 
 
+@enforce_types
+def calcPassiveRewards(
+    timestamp: int,
+    locked_amts: Dict[str, float],
+    unlock_times: Dict[str, int],
+) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    @description
+      Compute passive rewards at the given timestamp, like
+      queryPassiveRewards(), but without a ve_for_at call per address.
+
+      Each balance is computed from the address's lock, the way veOCEAN
+      does: locked_amt * (unlock_time - timestamp) / MAX_TIME, or 0 once
+      unlocked. Only the global ve_supply and tokens_per_week come from the
+      chain. Assumes locks didn't change since timestamp; see
+      checkPassiveBalances().
+
+    @params
+      timestamp -- timestamp to compute at
+      locked_amts -- dict of [addr] : locked_amt, eg from vebals_realtime.csv
+      unlock_times -- dict of [addr] : unlock_time
+
+    @return
+      balances -- dict of [addr]:balance
+      rewards -- dict of [addr]:reward_amt
+    """
+    print("calcPassiveRewards(): begin")
+    ve_supply_float, total_rewards_float = _queryPassiveTotals(timestamp)
+
+    if ve_supply_float == 0:
+        return {}, {}
+
+    addresses = list(locked_amts.keys())
+    locked = np.array([locked_amts[addr] for addr in addresses], dtype=float)
+    unlock = np.array([unlock_times[addr] for addr in addresses], dtype=float)
+
+    time_left = np.maximum(unlock - timestamp, 0.0)
+    balances_arr = locked * time_left / MAX_TIME
+    rewards_arr = total_rewards_float * balances_arr / ve_supply_float
+
+    balances = dict(zip(addresses, balances_arr.tolist()))
+    rewards = dict(zip(addresses, rewards_arr.tolist()))
+
+    print("calcPassiveRewards(): done")
+    return balances, rewards
+
+
+@enforce_types
+def checkPassiveBalances(
+    timestamp: int, balances: Dict[str, float], n_samples: int, random_seed=None
+) -> Dict[str, Tuple[float, float]]:
+    """
+    @description
+      Check balances from calcPassiveRewards() against on-chain ve_for_at,
+      for a random subset of addresses.
+
+    @params
+      timestamp -- timestamp that balances were computed at
+      balances -- dict of [addr]:balance
+      n_samples -- # addresses to check
+      random_seed -- pass in an integer for a predictable subset
+
+    @return
+      mismatches -- dict of [addr] : (balance, on-chain balance), for the
+        checked addresses that differ by more than PASSIVE_CHECK_RTOL
+    """
+    addresses = sorted(balances.keys())
+    n_samples = min(n_samples, len(addresses))
+    rng = np.random.default_rng(random_seed)
+    sampled_addrs = [
+        addresses[i] for i in rng.choice(len(addresses), n_samples, replace=False)
+    ]
+
+    fee_distributor = oceanutil.FeeDistributor()
+    ve_balances = _queryVeForAt(fee_distributor, sampled_addrs, timestamp)
+
+    mismatches = {}
+    for addr, ve_balance in zip(sampled_addrs, ve_balances):
+        chain_balance = from_wei(ve_balance)
+        if not math.isclose(
+            balances[addr], chain_balance, rel_tol=PASSIVE_CHECK_RTOL, abs_tol=1e-12
+        ):
+            mismatches[addr] = (balances[addr], chain_balance)
+    return mismatches
+
+
+@enforce_types
+def _queryPassiveTotals(timestamp: int) -> Tuple[float, float]:
+    """
+    @description
+      Return the global FeeDistributor values at the given timestamp.
+
+    @return
+      ve_supply -- total veOCEAN
+      total_rewards -- passive rewards for the week, in OCEAN
+    """
+    fee_distributor = oceanutil.FeeDistributor()
+    ve_supply = fee_distributor.ve_supply(timestamp)
+    total_rewards = fee_distributor.tokens_per_week(timestamp)
+    return from_wei(ve_supply), from_wei(total_rewards)
+
+
+def _queryVeForAt(fee_distributor, addresses: List[str], timestamp: int) -> list:
+    """
+    @description
+      Return fee_distributor.ve_for_at(addr, timestamp) for each address.
+
+      Batched with Multicall: MULTICALL_CHUNK_SIZE calls per eth_call, with
+      up to MULTICALL_CONCURRENCY eth_calls in flight at once. All at the
+      same block. Or one by one if the chain has no Multicall.
+
+    @return
+      ve_balances -- list of balance in wei, in the order of addresses
+    """
+    ve_for_at = fee_distributor.ve_for_at
+    multicall = _multicallContract()
+    if multicall is None:
+        print("No Multicall on this chain, so query balances one by one")
+        return [ve_for_at(addr, timestamp) for addr in addresses]
+
+    block = brownie.network.chain.height
+
+    def queryChunk(chunk):
+        calls = [
+            (fee_distributor.address, ve_for_at.encode_input(addr, timestamp))
+            for addr in chunk
+        ]
+        results = multicall.tryAggregate(False, calls, block_identifier=block)
+
+        chunk_balances = []
+        for addr, (success, data) in zip(chunk, results):
+            if success:
+                chunk_balances.append(ve_for_at.decode_output(data))
+            else:  # retry on its own
+                chunk_balances.append(
+                    ve_for_at(addr, timestamp, block_identifier=block)
+                )
+        return chunk_balances
+
+    chunks = [
+        addresses[i : i + MULTICALL_CHUNK_SIZE]
+        for i in range(0, len(addresses), MULTICALL_CHUNK_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=MULTICALL_CONCURRENCY) as executor:
+        return [
+            balance
+            for chunk_balances in executor.map(queryChunk, chunks)
+            for balance in chunk_balances
+        ]
+
+
+_MULTICALL_ADDRS: Dict[int, str] = {}  # [chainID] : Multicall2 address
+_MULTICALL_LOCK = threading.Lock()  # guards _MULTICALL_ADDRS
+
+
+def _multicallContract():
+    """Return the Multicall2 contract of the connected chain, or None if none.
+    Its address is resolved once per chain, see _multicallAddress()"""
+    chainID = brownie.network.chain.id
+    with _MULTICALL_LOCK:
+        address = _MULTICALL_ADDRS.get(chainID)
+        if address is not None and chainID == networkutil.DEV_CHAINID:
+            # the dev chain gets reset, and its Multicall2 with it
+            if not brownie.web3.eth.get_code(address):
+                address = None
+        if address is None:
+            address = _multicallAddress()
+            if address is None:  # no Multicall on this chain
+                return None
+            _MULTICALL_ADDRS[chainID] = address
+    return brownie.Contract.from_abi("Multicall2", address, MULTICALL2_ABI)
+
+
+def _multicallAddress() -> Optional[str]:
+    """Return the Multicall2 address of the connected chain, from brownie's
+    network config. On a dev chain without one, deploy one. None if none"""
+    active_network = CONFIG.active_network
+    if "multicall2" in active_network:
+        return active_network["multicall2"]
+    if "cmd" in active_network:  # dev chain that brownie launched
+        return brownie.multicall.deploy({"from": brownie.accounts[0]}).address
+    return None
+
+
 @enforce_types
 def _filterDids(nft_dids: List[str]) -> List[str]:
     """
@@ -703,8 +1505,8 @@ def _filterOutPurgatory(nft_dids: List[str]) -> List[str]:
     @return
       filtered_dids: list of filtered dids
     """
-    bad_dids = _didsInPurgatory()
-    filtered_dids = set(nft_dids) - set(bad_dids)
+    bad_dids = getPurgatory().dids()
+    filtered_dids = set(nft_dids) - bad_dids
     return list(filtered_dids)
 
 
@@ -721,17 +1523,17 @@ def _filterNftinfos(nftinfos: List[SimpleDataNft]) -> List[SimpleDataNft]:
       filtered_nftinfos: list of filtered SimpleDataNft objects
     """
     nft_dids = [nft.did for nft in nftinfos]
-    nft_dids = _filterToAquariusAssets(nft_dids)
+    nft_dids = set(_filterToAquariusAssets(nft_dids))
     filtered_nftinfos = [nft for nft in nftinfos if nft.did in nft_dids]
     return filtered_nftinfos
 
 
 @enforce_types
 def _markPurgatoryNfts(nftinfos: List[SimpleDataNft]) -> List[SimpleDataNft]:
-    bad_dids = _didsInPurgatory()
+    bad_dids = getPurgatory().dids()
     for nft in nftinfos:
-        if nft.did in bad_dids:
-            nft.is_purgatory = True
+        # assign, not just set: nfts of a previous run may have left purgatory
+        nft.is_purgatory = nft.did in bad_dids
     return nftinfos
 
 
@@ -774,17 +1576,15 @@ def _filterNftvols(nftvols: dict, chainID: int) -> dict:
         return nftvols2
 
     filtered_nftvols: Dict[str, Dict[str, float]] = {}
-    nft_dids = []
-
-    for basetoken_addr in nftvols:
-        for nft_addr in nftvols[basetoken_addr]:
-            nft_dids.append(oceanutil.calcDID(nft_addr, chainID))
+    nft_addrs = list({nft_addr for vols in nftvols.values() for nft_addr in vols})
+    nft_dids = oceanutil.calcDIDs(nft_addrs, chainID)
+    addr_to_did = dict(zip(nft_addrs, nft_dids))
 
-    filtered_dids = _filterDids(nft_dids)
+    filtered_dids = set(_filterDids(nft_dids))
 
     for basetoken_addr in nftvols:
         for nft_addr in nftvols[basetoken_addr]:
-            did = oceanutil.calcDID(nft_addr, chainID)
+            did = addr_to_did[nft_addr]
             if did in filtered_dids:
                 if basetoken_addr not in filtered_nftvols:
                     filtered_nftvols[basetoken_addr] = {}
@@ -819,25 +1619,6 @@ def _filterToAquariusAssets(nft_dids: List[str]) -> List[str]:
     return filtered_nft_dids
 
 
-@enforce_types
-def _didsInPurgatory() -> List[str]:
-    """
-    @description
-      Return dids of data assets that are in purgatory
-
-    @return
-      dids -- list of str
-    """
-    url = "https://raw.githubusercontent.com/oceanprotocol/list-purgatory/main/list-assets.json"
-    resp = requests.get(url, timeout=30)
-
-    # list of {'did' : 'did:op:6F7...', 'reason':'..'}
-    data = json.loads(resp.text)
-
-    dids = [item["did"] for item in data]
-    return dids
-
-
 @enforce_types
 def getSymbols(tokens: TokSet, chainID: int) -> Dict[str, str]:
     """
@@ -864,6 +1645,97 @@ def symbol(addr: str):
     return _ADDR_TO_SYMBOL[addr]
 
 
+@enforce_types
+def symbols(addrs: List[str], chainID: int) -> Dict[str, str]:
+    """
+    @description
+      Return token symbols, given their addresses on chainID.
+
+      Symbols are cached per chain in a file, across runs. The rest are
+      fetched all at once with Multicall; or one by one if the chain has
+      no Multicall. Needs to be connected to chainID for the latter.
+
+    @return
+      addr_to_symbol -- dict of [addr] : symbol
+    """
+    cache = _loadSymbolsCache(chainID)
+    addr_to_symbol = {}
+    unknown_addrs = []
+    for addr in addrs:
+        if addr in _ADDR_TO_SYMBOL:  # eg native token
+            addr_to_symbol[addr] = _ADDR_TO_SYMBOL[addr]
+        elif addr in cache:
+            addr_to_symbol[addr] = cache[addr]
+        else:
+            unknown_addrs.append(addr)
+
+    if unknown_addrs:
+        fetched = _fetchSymbols(unknown_addrs)
+        addr_to_symbol.update(fetched)
+        cache.update(fetched)
+        _saveSymbolsCache(cache, chainID)
+
+    return addr_to_symbol
+
+
+@enforce_types
+def _fetchSymbols(addrs: List[str]) -> Dict[str, str]:
+    """Return dict of [addr] : symbol, via the connected chain"""
+    # from_abi() rather than at(), since at() makes an rpc call per token
+    tokens = [
+        brownie.Contract.from_abi("Simpletoken", a, B.Simpletoken.abi) for a in addrs
+    ]
+    try:
+        with brownie.multicall():
+            results = [token.symbol() for token in tokens]
+    except brownie.exceptions.ContractNotFound:  # no Multicall on this chain
+        print("No Multicall on this chain, so fetch symbols one by one")
+        results = [None] * len(tokens)
+
+    addr_to_symbol = {}
+    for addr, token, result in zip(addrs, tokens, results):
+        # a failed call within the Multicall gives None
+        _symbol = str(result) if result else token.symbol()
+        addr_to_symbol[addr] = _symbol.upper()  # follow lower-upper rules
+    return addr_to_symbol
+
+
+@enforce_types
+def _loadSymbolsCache(chainID: int) -> Dict[str, str]:
+    """Return dict of [addr] : symbol, cached for this chain. Empty if none"""
+    filename = _symbolsCacheFilename(chainID)
+    if filename is None:
+        return {}
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):  # not cached yet, or corrupt
+        return {}
+
+
+@enforce_types
+def _saveSymbolsCache(cache: Dict[str, str], chainID: int):
+    filename = _symbolsCacheFilename(chainID)
+    if filename is None:
+        return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # unique, since concurrent runs may save the same chain's cache
+    tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_filename, filename)
+
+
+@enforce_types
+def _symbolsCacheFilename(chainID: int) -> Optional[str]:
+    """Return the symbols cache file for this chain. None for the dev chain,
+    which gets reset, so its addresses can be reused by other tokens"""
+    if chainID == networkutil.DEV_CHAINID:
+        return None
+    cache_dir = os.path.expanduser(SYMBOLS_CACHE_DIR)
+    return os.path.join(cache_dir, f"symbols-{chainID}.json")
+
+
 @enforce_types
 def queryAquariusAssetNames(
     nft_dids: List[str],
@@ -872,45 +1744,134 @@ def queryAquariusAssetNames(
     @description
       Return mapping of did -> asset name
 
+      Names are cached in memory and on disk (AQUARIUS_CACHE_FILE), for
+      AQUARIUS_CACHE_TTL_S; dids not in Aquarius only for
+      AQUARIUS_MISSING_TTL_S. So every caller in a process, and later runs,
+      share lookups. The rest are fetched from Aquarius in concurrent
+      batches, see _fetchAquariusAssetNames().
+
     @params
       nft_dids -- array of dids
 
     @return
-      did_to_asset_name -- dict of [did] : asset_name
+      did_to_asset_name -- dict of [did] : asset_name. "" if the asset
+        isn't in Aquarius
     """
-
     # Remove duplicates
     nft_dids = list(set(nft_dids))
 
-    # make a post request to Aquarius
-    url = f"{AQUARIUS_BASE_URL}/api/aquarius/assets/names"
+    with _AQUARIUS_LOCK:  # so that concurrent callers don't fetch twice
+        cache = _aquariusCache()
+        now = time.time()
+        missing_dids = [
+            did
+            for did in nft_dids
+            if did not in cache or now - cache[did][1] > _aquariusTTL(cache[did][0])
+        ]
+
+        if missing_dids:
+            fetched = _fetchAquariusAssetNames(missing_dids)
+            for did in missing_dids:
+                # Aquarius may leave out dids that it doesn't know
+                cache[did] = (fetched.get(did, ""), now)
+            _saveAquariusCache(cache)
+
+        return {did: cache[did][0] for did in nft_dids}
+
+
+@enforce_types
+def _fetchAquariusAssetNames(nft_dids: List[str]) -> Dict[str, str]:
+    """
+    @description
+      Fetch asset names from Aquarius, in batches of AQUARIUS_BATCH_SIZE
+      dids, with up to AQUARIUS_CONCURRENCY batches in flight at once.
 
-    headers = {"Content-Type": "application/json"}
+    @return
+      did_to_asset_name -- dict of [did] : asset_name
+    """
+    batches = [
+        nft_dids[i : i + AQUARIUS_BATCH_SIZE]
+        for i in range(0, len(nft_dids), AQUARIUS_BATCH_SIZE)
+    ]
+    did_to_asset_name: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=AQUARIUS_CONCURRENCY) as executor:
+        for batch_names in executor.map(_fetchAquariusBatch, batches):
+            did_to_asset_name.update(batch_names)
+    return did_to_asset_name
 
-    did_to_asset_name = {}
 
-    BATCH_SIZE = 9042
-    RETRY_ATTEMPTS = 3
+@enforce_types
+def _fetchAquariusBatch(nft_dids: List[str]) -> Dict[str, str]:
+    """
+    @description
+      Fetch the asset names of one batch of dids, retrying with exponential
+      backoff. If the batch keeps failing and is bigger than
+      AQUARIUS_MIN_BATCH_SIZE, fetch each half of it on its own instead.
 
-    error_counter = 0
-    # Send in chunks
-    for i in range(0, len(nft_dids), BATCH_SIZE):
-        # Aquarius expects "didList": ["did:op:...", ...]
-        payload = json.dumps({"didList": nft_dids[i : i + BATCH_SIZE]})
+    @return
+      did_to_asset_name -- dict of [did] : asset_name
+    """
+    url = f"{AQUARIUS_BASE_URL}/api/aquarius/assets/names"
+    n_attempts = AQUARIUS_RETRIES + 1
+    if len(nft_dids) > AQUARIUS_MIN_BATCH_SIZE:
+        n_attempts = 2  # then split
 
+    for attempt_i in range(n_attempts):
         try:
-            resp = requests.post(url, data=payload, headers=headers, timeout=30)
-            data = json.loads(resp.text)
-            did_to_asset_name.update(data)
-        # pylint: disable=broad-exception-caught
-        except Exception as e:
-            error_counter += 1
-            i -= BATCH_SIZE
-            if error_counter > RETRY_ATTEMPTS:
-                # pylint: disable=line-too-long, broad-exception-raised
-                raise Exception(
-                    f"Failed to get asset names from Aquarius after {RETRY_ATTEMPTS} attempts. Error: {e}"
-                ) from e
-        error_counter = 0
+            # Aquarius expects "didList": ["did:op:...", ...]
+            resp = requests.post(url, json={"didList": nft_dids}, timeout=30)
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.RequestException, ValueError) as e:
+            error = e
+        if attempt_i < n_attempts - 1:
+            time.sleep(AQUARIUS_BACKOFF_S * 2**attempt_i)
+
+    if len(nft_dids) > AQUARIUS_MIN_BATCH_SIZE:
+        print(f"Aquarius failed on {len(nft_dids)} dids ({error}). Split in two")
+        half = len(nft_dids) // 2
+        did_to_asset_name = _fetchAquariusBatch(nft_dids[:half])
+        did_to_asset_name.update(_fetchAquariusBatch(nft_dids[half:]))
+        return did_to_asset_name
+
+    # pylint: disable=broad-exception-raised
+    raise Exception(
+        f"Failed to get asset names from Aquarius after {n_attempts} attempts."
+        f" Error: {error}"
+    )
 
-    return did_to_asset_name
+
+@enforce_types
+def _aquariusTTL(name: str) -> int:
+    """Return how long a cached asset name is valid for, in s"""
+    return AQUARIUS_CACHE_TTL_S if name else AQUARIUS_MISSING_TTL_S
+
+
+_AQUARIUS_CACHE: Optional[Dict[str, Tuple[str, float]]] = None
+_AQUARIUS_LOCK = threading.Lock()  # guards _AQUARIUS_CACHE
+
+
+def _aquariusCache() -> Dict[str, Tuple[str, float]]:
+    """Return the in-memory cache of [did] : (asset name, time fetched).
+    Loaded from AQUARIUS_CACHE_FILE on first use. Call with _AQUARIUS_LOCK"""
+    global _AQUARIUS_CACHE
+    if _AQUARIUS_CACHE is None:
+        _AQUARIUS_CACHE = {}
+        filename = os.path.expanduser(AQUARIUS_CACHE_FILE)
+        try:
+            with open(filename, "r") as f:
+                for did, (name, fetched_at) in json.load(f).items():
+                    _AQUARIUS_CACHE[did] = (name, fetched_at)
+        except (OSError, ValueError):  # not cached yet, or corrupt
+            _AQUARIUS_CACHE = {}
+    return _AQUARIUS_CACHE
+
+
+def _saveAquariusCache(cache: Dict[str, Tuple[str, float]]):
+    filename = os.path.expanduser(AQUARIUS_CACHE_FILE)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # unique, since runs of other cron jobs may save at the same time
+    tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_filename, filename)
@@ -0,0 +1,74 @@
+# Reference implementation of calcrewards._calcRewardsUsd(): the original
+# per-cell python loop. For tests, and for tests/bench_calcrewards.py
+from enforce_typing import enforce_types
+import numpy as np
+
+from util.calcrewards import TARGET_WPY, _rankBasedAllocate
+
+STAKES_PER_LP = 3  # typical # nfts that an LP allocates to
+
+
+@enforce_types
+def calcRewardsUsdLoop(
+    S, V_USD, C, DCV_multiplier, OCEAN_avail, do_pubrewards, do_rank
+) -> np.ndarray:
+    """The original python-loop implementation of _calcRewardsUsd().
+    Kept as the reference for correctness (bit-identical) and speed."""
+    N_i, N_j = S.shape
+
+    if np.sum(V_USD) == 0.0:
+        return np.zeros((N_i, N_j), dtype=float)
+
+    if do_pubrewards:
+        S = np.copy(S)
+        for j in range(N_j):
+            if C[j] != -1:
+                S[C[j], j] *= 2.0
+
+    if do_rank:
+        perc_per_j = _rankBasedAllocate(V_USD)
+    else:
+        perc_per_j = V_USD / np.sum(V_USD)
+
+    R = np.zeros((N_i, N_j), dtype=float)
+    for j in range(N_j):
+        stake_j = sum(S[:, j])
+        DCV_j = V_USD[j]
+        if stake_j == 0.0 or DCV_j == 0.0:
+            continue
+
+        for i in range(N_i):
+            perc_at_j = perc_per_j[j]
+            stake_ij = S[i, j]
+            perc_at_ij = stake_ij / stake_j
+            R[i, j] = min(
+                perc_at_j * perc_at_ij * OCEAN_avail,
+                stake_ij * TARGET_WPY,
+                DCV_j * DCV_multiplier,
+            )
+
+    R[R < 0.000001] = 0.0
+
+    if np.sum(R) == 0.0:
+        return np.zeros((N_i, N_j), dtype=float)
+
+    sum1 = np.sum(R)
+    tol = 1e-13
+    if sum1 > OCEAN_avail:
+        R /= 1 + tol
+
+    return R
+
+
+@enforce_types
+def randomInputs(N_i: int, N_j: int, seed: int = 42) -> tuple:
+    """Return (S, V_USD, C) with each LP staking on a few random nfts"""
+    rng = np.random.default_rng(seed)
+    S = np.zeros((N_i, N_j), dtype=float)
+    n_stakes = min(STAKES_PER_LP, N_j)
+    for i in range(N_i):
+        J = rng.choice(N_j, n_stakes, replace=False)
+        S[i, J] = rng.uniform(1.0, 1e5, n_stakes)
+    V_USD = rng.uniform(1.0, 1e4, N_j)
+    C = rng.integers(-1, N_i, N_j)
+    return S, V_USD, C
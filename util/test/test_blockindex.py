@@ -0,0 +1,44 @@
+from enforce_typing import enforce_types
+
+from util import blockindex
+from util.blockindex import BlockIndex
+
+
+@enforce_types
+def test_bracket():
+    index = BlockIndex(None)
+    assert index.bracket(100) == (None, None)
+
+    for block, timestamp in [(10, 100), (30, 300), (20, 200)]:
+        index.add(block, timestamp)
+    assert len(index) == 3
+    assert index.bracket(50) == (None, (10, 100))
+    assert index.bracket(200) == ((10, 100), (20, 200))
+    assert index.bracket(250.5) == ((20, 200), (30, 300))
+    assert index.bracket(301) == ((30, 300), None)
+
+
+@enforce_types
+def test_save_load(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "1.json")
+    index = BlockIndex(cache_file)
+    index.add(10, 100)
+    index.add(20, 200)
+    index.save()
+
+    # another process adds a point
+    index2 = BlockIndex(cache_file)
+    assert len(index2) == 2
+    index2.add(30, 300)
+    index2.save()
+
+    # saving merges, rather than overwrites
+    index.add(5, 50)
+    index.save()
+    assert len(BlockIndex(cache_file)) == 4
+
+    # recent blocks aren't saved, since a reorg could change them
+    monkeypatch.setattr(blockindex, "BLOCK_INDEX_MIN_AGE_S", 10**12)
+    index.add(40, 400)
+    index.save()
+    assert len(BlockIndex(cache_file)) == 4
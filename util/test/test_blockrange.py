@@ -1,4 +1,5 @@
 from enforce_typing import enforce_types
+import numpy
 import pytest
 
 from util.blockrange import BlockRange
@@ -120,3 +121,58 @@ def test_no_sampling():
     # should return fin if num_samples is 1
     rng = BlockRange(st=10, fin=20, num_samples=1)
     assert rng.getBlocks() == [20]
+
+
+@enforce_types
+def test_isolated_rng():
+    numpy.random.seed(1)
+    expected = numpy.random.rand()
+
+    numpy.random.seed(1)
+    BlockRange(st=10, fin=5000, num_samples=100, random_seed=42)
+    assert numpy.random.rand() == expected  # global rng untouched
+
+
+@enforce_types
+def test_huge_range():
+    # memory doesn't depend on the range size
+    br = BlockRange(st=0, fin=10**15, num_samples=100, random_seed=42)
+    r = br.getBlocks()
+    assert len(set(r)) == 100
+    assert r == sorted(r)
+    assert all(isinstance(b, int) for b in r)
+    assert max(r) <= 10**15
+
+
+@enforce_types
+def test_stratified():
+    br = BlockRange(st=100, fin=1099, num_samples=10, random_seed=42, stratified=True)
+    r = br.getBlocks()
+    assert len(r) == 10
+    for i, b in enumerate(r):  # one block per stratum of 100 blocks
+        assert 100 + 100 * i <= b < 200 + 100 * i
+
+    r = BlockRange(st=10, fin=12, num_samples=10, stratified=True).getBlocks()
+    assert r == [10, 11, 12]
+
+
+@enforce_types
+def test_uniform():
+    # each block is equally likely to be sampled
+    counts = numpy.zeros(10)
+    for seed in range(2000):
+        for b in BlockRange(st=0, fin=9, num_samples=3, random_seed=seed).getBlocks():
+            counts[b] += 1
+    assert counts.sum() == 6000
+    assert counts.min() > 500 and counts.max() < 700
+
+
+@enforce_types
+def test_filter_by_max_lazy():
+    br = BlockRange(st=10, fin=5000, num_samples=100, random_seed=42)
+    before = br.getBlocks()
+
+    br.filterByMaxBlock(max_block=2500)
+    br.filterByMaxBlock(max_block=4000)  # can't widen the filter
+    assert br.getBlocks() == [b for b in before if b <= 2500]
+    assert br.numBlocks() == len(br.getBlocks())
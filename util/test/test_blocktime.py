@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from unittest.mock import Mock, patch
+
+from enforce_typing import enforce_types
+
+from util import blockindex, blocktime
+from util.blocktime import (
+    ethFindClosestBlock,
+    ethTimestamptoBlock,
+    timestampToBlock,
+)
+
+
+class FakeChain:
+    """Chain whose blocks come every 2-14 s. Counts block fetches"""
+
+    def __init__(self, n_blocks: int, chainID: int = 1):
+        self.id = chainID
+        self.timestamps = [
+            1_600_000_000 + 2 * i + 12 * (i // 7) for i in range(n_blocks)
+        ]
+        self.n_fetches = 0
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, block: int):
+        self.n_fetches += 1
+        number = range(len(self))[block]  # supports negative blocks, eg -1
+        return FakeBlock(number, self.timestamps[number])
+
+
+class FakeBlock:
+    def __init__(self, number: int, timestamp: int):
+        self.number = number
+        self.timestamp = timestamp
+
+
+@enforce_types
+def test_timestampToBlock(tmp_path, monkeypatch):
+    monkeypatch.setattr(blockindex, "BLOCK_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(blockindex, "_INDEXES", {})
+    monkeypatch.setattr(blocktime, "_HEADER_CACHE", OrderedDict())
+    chain = FakeChain(1_000_000)
+
+    for block in [0, 1, 6, 7, 8, 123_456, 999_999]:
+        assert timestampToBlock(chain, chain.timestamps[block]) == block
+        assert timestampToBlock(chain, chain.timestamps[block] - 1) == block
+    assert timestampToBlock(chain, chain.timestamps[0] - 100) == 0
+    assert timestampToBlock(chain, chain.timestamps[-1] + 1) == len(chain)
+
+    # a timestamp near one looked up before: few fetches
+    chain.n_fetches = 0
+    assert timestampToBlock(chain, chain.timestamps[500_000]) == 500_000
+    assert chain.n_fetches <= 2 * 20 + 2
+
+    # the same timestamp again, even in a new process: no fetches
+    monkeypatch.setattr(blockindex, "_INDEXES", {})
+    monkeypatch.setattr(blocktime, "_HEADER_CACHE", OrderedDict())
+    chain.n_fetches = 0
+    assert timestampToBlock(chain, chain.timestamps[500_000]) == 500_000
+    assert chain.n_fetches == 0
+
+
+@enforce_types
+def test_ethFindClosestBlock(monkeypatch):
+    monkeypatch.setattr(blocktime, "_HEADER_CACHE", OrderedDict())
+    chain = FakeChain(100_000, chainID=5)
+    for block in [0, 1, 7, 50_000, 99_999]:
+        timestamp = chain.timestamps[block]
+        for guess in [0, block, 99_999, max(0, block - 3), min(99_999, block + 5000)]:
+            assert ethFindClosestBlock(chain, guess, timestamp) == block
+            assert ethFindClosestBlock(chain, guess, timestamp + 0.9) == block
+
+    # on a tie, the later block
+    assert ethFindClosestBlock(chain, 50_000, chain.timestamps[50_001] + 1) == 50_002
+
+    assert ethFindClosestBlock(chain, 500, chain.timestamps[0] - 100) == 0
+    assert ethFindClosestBlock(chain, 500, chain.timestamps[-1] + 100) == 99_999
+
+
+@enforce_types
+def test_ethFindClosestBlock_log_distance(monkeypatch):
+    # batched requests, to a fake rpc
+    monkeypatch.setattr(blocktime, "_HEADER_CACHE", OrderedDict())
+    chain = FakeChain(2_100_000, chainID=5)
+    monkeypatch.setattr(blocktime, "_batchRpcUri", lambda chain: "http://rpc")
+    requests_ = []
+
+    def fake_post(uri, json, timeout):  # pylint: disable=unused-argument
+        requests_.append(json)
+        results = [
+            {
+                "id": call["id"],
+                "result": {
+                    "timestamp": hex(chain[int(call["params"][0], 16)].timestamp)
+                },
+            }
+            for call in json
+        ]
+        return Mock(status_code=200, json=Mock(return_value=results))
+
+    with patch("util.blocktime.requests.post", side_effect=fake_post):
+        for distance in [10, 1000, 10**6]:
+            requests_.clear()
+            target = chain.timestamps[1_000_000 + distance]
+            assert ethFindClosestBlock(chain, 1_000_000, target) == 1_000_000 + distance
+            assert len(requests_) <= 2 * distance.bit_length() // 3 + 2
+            assert all(len(calls) <= blocktime.HEADER_BATCH_SIZE for calls in requests_)
+
+
+@enforce_types
+def test_ethTimestamptoBlock_bounded(monkeypatch):
+    monkeypatch.setattr(blocktime, "_HEADER_CACHE", OrderedDict())
+    # irregular block times: estimates from the average block time are off
+    chain = FakeChain(200_000, chainID=5)
+    chain.timestamps = [
+        1_600_000_000 + 12 * i + (i % 1000) * 30 for i in range(200_000)
+    ]
+    chain.n_fetches = 0
+    block = ethTimestamptoBlock(chain, chain.timestamps[80_000])
+    assert 0 <= block < len(chain)
+    assert chain.n_fetches <= blocktime.ETH_CALC_MAX_STEPS + 1
@@ -1,4 +1,4 @@
-from util.oceanutil import calcDID
+from util.oceanutil import calcDID, calcDIDs
 
 # pylint: disable=line-too-long
 # Example: https://v4.aquarius.oceanprotocol.com/api/aquarius/assets/ddo/did:op:8d797a40e75a73a9646e48cfb14d5c0f6afb3c897f53403d00787b00e736b9f3
@@ -25,3 +25,18 @@ def test_calcDID():
         # address is not case sensitive
         assert calcDID(address.lower(), chainID) == did
         assert calcDID(address.upper(), chainID) == did
+
+
+def test_calcDIDs():
+    data = [x.split(",") for x in golden_data.split("\n")]
+    for chainID in {int(chainID) for _, chainID, _ in data}:
+        dids = [did for did, chainID2, _ in data if int(chainID2) == chainID]
+        addrs = [address for _, chainID2, address in data if int(chainID2) == chainID]
+
+        assert calcDIDs(addrs, chainID) == dids
+
+        # duplicates & mixed case
+        addrs2 = addrs + [address.lower() for address in addrs]
+        assert calcDIDs(addrs2, chainID) == dids + dids
+
+    assert calcDIDs([], 1) == []
@@ -4,11 +4,13 @@ from typing import Dict, Tuple, Union
 from enforce_typing import enforce_types
 import numpy as np
 import pytest
+import scipy
 from pytest import approx
 
 from util import calcrewards, cleancase as cc, constants, tousd
 from util.calcrewards import TARGET_WPY, _rankBasedAllocate
 from util.constants import ZERO_ADDRESS
+from util.test.calcrewards_reference import calcRewardsUsdLoop, randomInputs
 
 # for shorter lines
 RATES = {"OCEAN": 0.5, "H2O": 1.6, "PSDN": 0.01}
@@ -418,6 +420,123 @@ def test_divide_by_zero():
     assert rewardsperlp == {}
 
 
+@enforce_types
+@pytest.mark.parametrize("do_pubrewards", [False, True])
+@pytest.mark.parametrize("do_rank", [False, True])
+def test_calcRewardsUsd_matches_loop(do_pubrewards, do_rank):
+    S, V_USD, C = randomInputs(N_i=200, N_j=40)
+    S[:, 3] = 0.0  # a column without stake
+    V_USD[5] = 0.0  # a column without DCV
+    if do_rank:
+        V_USD[5] = 1e-3  # rank-based allocation needs DCV > 0 everywhere
+    for DCV_multiplier in [np.inf, 0.5, 0.001]:
+        args = (S, V_USD, C, DCV_multiplier, 10000.0, do_pubrewards, do_rank)
+        R_vec = calcrewards._calcRewardsUsd(*args)
+        R_loop = calcRewardsUsdLoop(*args)
+        assert np.array_equal(R_vec, R_loop)
+
+
+@enforce_types
+@pytest.mark.parametrize("do_pubrewards", [False, True])
+@pytest.mark.parametrize("do_rank", [False, True])
+def test_calcRewardsUsd_sparse_matches_dense(do_pubrewards, do_rank):
+    S, V_USD, C = randomInputs(N_i=200, N_j=40)
+    S[:, 3] = 0.0  # a column without stake
+    for DCV_multiplier in [np.inf, 0.5, 0.001]:
+        args = (V_USD, C, DCV_multiplier, 10000.0, do_pubrewards, do_rank)
+        R_dense = calcrewards._calcRewardsUsd(S, *args)
+        R_sparse = calcrewards._calcRewardsUsd(scipy.sparse.csc_matrix(S), *args)
+        assert scipy.sparse.issparse(R_sparse)
+        assert np.array_equal(R_sparse.toarray(), R_dense)
+
+
+@enforce_types
+def test_calcRewardsUsd_sparse_zero_vol():
+    S = scipy.sparse.csc_matrix(np.array([[1.0, 0.0], [0.0, 2.0]]))
+    V_USD = np.array([0.0, 0.0])
+    C = np.array([-1, -1])
+    R = calcrewards._calcRewardsUsd(S, V_USD, C, np.inf, 10.0, False, False)
+    assert scipy.sparse.issparse(R)
+    assert R.nnz == 0
+
+
+@enforce_types
+def test_stakeVolDictsToArrays_sparse_vs_dense():
+    stakes = {
+        C1: {NA: {LP1: 5.0, LP2: 1.0}, NB: {LP1: 5.0, LP3: 1.0}},
+        C2: {NC: {LP4: 1.0}},
+    }
+    nftvols_USD = {C1: {NA: 1.0, NB: 2.0}, C2: {NC: 3.0}}
+    keys_tup = calcrewards._getKeysTuple(stakes, nftvols_USD)
+
+    S_dense, V_dense = calcrewards._stakeVolDictsToArrays(
+        stakes, nftvols_USD, keys_tup, False
+    )
+    S_sparse, V_sparse = calcrewards._stakeVolDictsToArrays(
+        stakes, nftvols_USD, keys_tup, True
+    )
+    assert isinstance(S_dense, np.ndarray)
+    assert scipy.sparse.issparse(S_sparse)
+    assert S_sparse.nnz == 5
+    assert np.array_equal(S_sparse.toarray(), S_dense)
+    assert np.array_equal(V_sparse, V_dense)
+
+    # auto: 5 of 4x3 entries is dense
+    S_auto, _ = calcrewards._stakeVolDictsToArrays(stakes, nftvols_USD, keys_tup)
+    assert isinstance(S_auto, np.ndarray)
+
+    # rewards dicts are the same either way
+    C = calcrewards._ownerDictToArray({C1: {NA: LP1, NB: LP2}, C2: {NC: LP4}}, keys_tup)
+    args = (V_dense, C, np.inf, 10.0, True, False)
+    R_dense = calcrewards._calcRewardsUsd(S_dense, *args)
+    R_sparse = calcrewards._calcRewardsUsd(S_sparse, *args)
+    dicts_dense = calcrewards._rewardArrayToDicts(R_dense, keys_tup)
+    dicts_sparse = calcrewards._rewardArrayToDicts(R_sparse, keys_tup)
+    assert dicts_sparse == dicts_dense
+    assert list(dicts_sparse[1][C1]) == list(dicts_dense[1][C1])  # same order
+
+
+@enforce_types
+def test_stakeVolDictsToArrays_vols():
+    # vol of nft j, added once per LP i, in order: bit-identical, not N_i * vol
+    LPs = [f"0xlp{i}_addr" for i in range(37)]
+    stakes = {C1: {NA: {LPs[0]: 1.0}, NB: {LP: 1.0 for LP in LPs}}}
+    vol_A, vol_B = 0.1, 1234.5678
+    nftvols_USD = {C1: {NA: vol_A, NB: vol_B}}
+    keys_tup = calcrewards._getKeysTuple(stakes, nftvols_USD)
+    _, V_USD = calcrewards._stakeVolDictsToArrays(stakes, nftvols_USD, keys_tup)
+
+    expected_V_USD = []
+    for _, nft_addr in keys_tup[1]:
+        V_j = 0.0
+        for _ in LPs:
+            V_j += nftvols_USD[C1][nft_addr]
+        expected_V_USD.append(V_j)
+    assert V_USD.tolist() == expected_V_USD
+
+    # each (chain, nft) needs stakes
+    keys_tup = (keys_tup[0], keys_tup[1] + [(C1, NC)], keys_tup[2], keys_tup[3])
+    with pytest.raises(AssertionError):
+        calcrewards._stakeVolDictsToArrays(stakes, nftvols_USD, keys_tup)
+
+
+@enforce_types
+def test_calcRewards_sparse_auto():
+    # 100 LPs, each staking on 1 of 100 nfts: density 1%, so S is sparse
+    nfts = [f"0xnft{j}_addr" for j in range(100)]
+    LPs = [f"0xlp{i}_addr" for i in range(100)]
+    stakes = {C1: {nft: {LP: 1000.0} for nft, LP in zip(nfts, LPs)}}
+    nftvols = {C1: {OCN_ADDR: {nft: 1.0 for nft in nfts}}}
+    nftvols_USD = tousd.nftvolsToUsd(nftvols, SYMBOLS, RATES)
+    keys_tup = calcrewards._getKeysTuple(stakes, nftvols_USD)
+    S, _ = calcrewards._stakeVolDictsToArrays(stakes, nftvols_USD, keys_tup)
+    assert scipy.sparse.issparse(S)
+
+    rewardsperlp, rewardsinfo = _calcRewardsC1(stakes, nftvols, 100.0)
+    assert rewardsperlp == {LP: approx(1.0) for LP in LPs}
+    assert rewardsinfo == {nft: {LP: approx(1.0)} for nft, LP in zip(nfts, LPs)}
+
+
 # ========================================================================
 # Tests around bounding rewards by DCV
 
@@ -785,6 +904,26 @@ def test_getLpAddrs():
     assert sorted(LP_addrs) == sorted([LP1, LP2, LP3, LP4])
 
 
+@enforce_types
+def test_getKeysTuple():
+    stakes = {
+        C1: {NA: {LP1: 5.0, LP2: 1.0}, NB: {LP3: 1.0}},
+        C2: {NC: {LP1: 1.0}},
+    }
+    nftvols_USD = {C1: {NA: 1.0, NB: 1.0}, C2: {NC: 1.0}}
+    keys_tup = calcrewards._getKeysTuple(stakes, nftvols_USD)
+    LP_addrs, chain_nft_tups, LP_addr_to_i, chain_nft_to_j = keys_tup
+
+    assert LP_addrs == [LP1, LP2, LP3]
+    assert chain_nft_tups == [(C1, NA), (C1, NB), (C2, NC)]
+    assert LP_addr_to_i == {LP1: 0, LP2: 1, LP3: 2}
+    assert chain_nft_to_j == {(C1, NA): 0, (C1, NB): 1, (C2, NC): 2}
+
+    owners = {C1: {NA: LP3, NB: ZERO_ADDRESS}, C2: {NC: LP1}}
+    C = calcrewards._ownerDictToArray(owners, keys_tup)
+    assert C.tolist() == [2, -1, 0]
+
+
 @enforce_types
 def test_flattenRewards():
     rewards = {
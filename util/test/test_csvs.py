@@ -168,6 +168,18 @@ def test_nftinfo(tmp_path):
     assert nft3a == nft3
 
 
+@enforce_types
+def test_nftinfoCheckpoint(tmp_path):
+    csv_dir = str(tmp_path)
+    assert csvs.loadNftinfoCheckpoint(csv_dir, C1) == {}
+
+    checkpoint = {"chainID": C1, "fin": 20, "full_at": 1686787200.0}
+    csvs.saveNftinfoCheckpoint(checkpoint, csv_dir, C1)
+    assert csvs.loadNftinfoCheckpoint(csv_dir, C1) == checkpoint
+    assert csvs.loadNftinfoCheckpoint(csv_dir, C2) == {}
+    assert not csvs.nftinfoCsvFilenames(csv_dir)  # not mistaken for a csv
+
+
 # =================================================================
 # nftvols csvs
 
@@ -213,6 +225,35 @@ def test_nftvols_twochains(tmp_path):
     assert loaded_V == target_V
 
 
+# =================================================================
+# volsym checkpoint
+
+
+@enforce_types
+def test_volsymCheckpoint(tmp_path):
+    csv_dir = str(tmp_path)
+    assert csvs.loadVolsymCheckpoint(csv_dir, C1) == {}
+
+    checkpoint = {
+        "chainID": C1,
+        "st": 10,
+        "fin": 20,
+        "vols": {"0xbase": {"0x1": 1.5}},
+        "owners": {"0x1": "0xa"},
+        "gasvols": {},
+        "txgascost": {"0xtx": 0.1},
+        "swaps": {"0xbase": {"0x1": 2.0}},
+    }
+    csvs.saveVolsymCheckpoint(checkpoint, csv_dir, C1)
+    assert csvs.loadVolsymCheckpoint(csv_dir, C1) == checkpoint
+    assert csvs.loadVolsymCheckpoint(csv_dir, C2) == {}
+
+    # overwrite
+    checkpoint["fin"] = 30
+    csvs.saveVolsymCheckpoint(checkpoint, csv_dir, C1)
+    assert csvs.loadVolsymCheckpoint(csv_dir, C1)["fin"] == 30
+
+
 # =================================================================
 # owners csvs
 
@@ -0,0 +1,66 @@
+import io
+import sys
+import threading
+
+from enforce_typing import enforce_types
+
+from util import dfserver
+
+
+def _main():
+    """Stand-in for dftool_module._do_main"""
+    cmd = sys.argv[1]
+    if cmd == "echo":
+        print(" ".join(sys.argv[2:]))
+    elif cmd == "help":
+        print("Usage: ..")
+        sys.exit(1)
+    elif cmd == "fail":
+        raise ValueError("oops")
+    elif cmd == "exitmsg":
+        sys.exit("bad args")
+
+
+@enforce_types
+def _submit(socket_path: str, argv: list):
+    out = io.StringIO()
+    returncode = dfserver.submit(socket_path, argv, out)
+    return returncode, out.getvalue()
+
+
+@enforce_types
+def test_serve(tmp_path):
+    socket_path = str(tmp_path / "dftool.sock")
+    (tmp_path / "dftool.sock").write_text("stale")
+
+    server = dfserver.DftoolServer(socket_path, _main)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert _submit(socket_path, ["echo", "a", "b"]) == (0, "a b\n")
+        assert _submit(socket_path, ["help"]) == (1, "Usage: ..\n")
+        assert _submit(socket_path, ["exitmsg"]) == (1, "bad args\n")
+
+        returncode, output = _submit(socket_path, ["fail"])
+        assert returncode == 1
+        assert "ValueError: oops" in output
+
+        # the server's own state is untouched
+        assert sys.argv[1:] != ["echo", "a", "b"]
+        assert _submit(socket_path, ["serve", socket_path])[0] == 1
+
+        # the server still serves after all that
+        assert _submit(socket_path, ["echo", "c"]) == (0, "c\n")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    assert not (tmp_path / "dftool.sock").exists()
+
+
+@enforce_types
+def test_runCommand():
+    out = io.StringIO()
+    assert dfserver.runCommand(_main, ["echo", "x"], out) == 0
+    assert out.getvalue() == "x\n"
@@ -0,0 +1,186 @@
+import os
+import re
+import time
+from unittest.mock import patch
+
+from enforce_typing import enforce_types
+
+from util import graphutil
+from util.graphcache import ResponseCache
+
+CHAINID = 1
+QUERY = "{ nfts(first: 10, block: {number: 100}) { id } }"
+HEAD = 10_000  # subgraph head, so that blocks in QUERY are final
+
+
+@enforce_types
+def test_get_put(tmp_path):
+    cache = ResponseCache(str(tmp_path), 10**6)
+    assert cache.get(CHAINID, 100, QUERY) is None
+
+    result = {"data": {"nfts": [{"id": "0x1"}]}}
+    cache.put(CHAINID, 100, QUERY, result)
+    assert cache.get(CHAINID, 100, QUERY) == result
+
+    # whitespace doesn't matter
+    query2 = QUERY.replace(" ", "\n    ")
+    assert cache.get(CHAINID, 100, query2) == result
+
+    # chain, block and query do
+    assert cache.get(2, 100, QUERY) is None
+    assert cache.get(CHAINID, 101, QUERY) is None
+    assert cache.get(CHAINID, 100, QUERY.replace("10", "11")) is None
+
+    # persists across instances
+    cache2 = ResponseCache(str(tmp_path), 10**6)
+    assert cache2.get(CHAINID, 100, QUERY) == result
+
+
+@enforce_types
+def test_lru_eviction(tmp_path):
+    result = {"data": {"x": "a" * 1000}}
+    cache = ResponseCache(str(tmp_path), 5500)  # room for 5 responses
+
+    for block in range(5):
+        cache.put(CHAINID, block, QUERY, result)
+        _age(tmp_path)
+    assert cache.get(CHAINID, 0, QUERY) == result  # block 0 is now most recent
+    _age(tmp_path)
+
+    cache.put(CHAINID, 5, QUERY, result)  # over max_bytes
+
+    assert cache.get(CHAINID, 0, QUERY) == result
+    assert cache.get(CHAINID, 1, QUERY) is None  # least recently used
+    assert cache.get(CHAINID, 5, QUERY) == result
+    total_bytes = sum(f.stat().st_size for f in tmp_path.iterdir())
+    assert total_bytes <= 0.9 * 5500
+
+
+@enforce_types
+def test_put_overwrite_size(tmp_path):
+    result = {"data": {"x": "a" * 1000}}
+    cache = ResponseCache(str(tmp_path), 10**6)
+    for _ in range(3):
+        cache.put(CHAINID, 100, QUERY, result)
+    total_bytes = sum(f.stat().st_size for f in tmp_path.iterdir())
+    assert cache._total_bytes == total_bytes  # pylint: disable=protected-access
+
+
+@enforce_types
+def test_ignores_partial_file(tmp_path):
+    cache = ResponseCache(str(tmp_path), 10**6)
+    cache.put(CHAINID, 100, QUERY, {"data": {}})
+    (filename,) = list(tmp_path.iterdir())
+    filename.write_text('{"data": ')
+    assert cache.get(CHAINID, 100, QUERY) is None
+
+
+@enforce_types
+def test_submitQuery_cache(tmp_path):
+    result = {"data": {"nfts": []}}
+    with patch("util.graphutil._postQuery", return_value=result) as post, patch(
+        "util.graphutil._CACHE", ResponseCache(str(tmp_path), 10**6)
+    ), patch("util.graphutil.USE_CACHE", True), patch(
+        "util.graphutil._HEADS", {CHAINID: (HEAD, time.time())}
+    ):
+        assert graphutil.submitQuery(QUERY, CHAINID) == result
+        assert graphutil.submitQuery(QUERY, CHAINID) == result
+        assert post.call_count == 1
+
+        # bypass
+        graphutil.submitQuery(QUERY, CHAINID, use_cache=False)
+        assert post.call_count == 2
+
+        # not pinned to a block
+        graphutil.submitQuery("{ nfts { id } }", CHAINID)
+        graphutil.submitQuery("{ nfts { id } }", CHAINID)
+        assert post.call_count == 4
+
+        # dev chain gets reset, so never cached
+        graphutil.submitQuery(QUERY, 8996)
+        graphutil.submitQuery(QUERY, 8996)
+        assert post.call_count == 6
+
+        # errors aren't cached
+        post.return_value = {"errors": ["oops"]}
+        query2 = QUERY.replace("100", "200")
+        graphutil.submitQuery(query2, CHAINID)
+        graphutil.submitQuery(query2, CHAINID)
+        assert post.call_count == 8
+
+
+@enforce_types
+def test_paginatedQueryBlocks_cache(tmp_path):
+    def fake_postQuery(query_s, chainID):
+        # pylint: disable=unused-argument
+        aliases = re.findall(r"(\w+): nfts\(", query_s) or ["nfts"]
+        return {"data": {alias: [{"id": alias}] for alias in aliases}}
+
+    with patch("util.graphutil._postQuery", side_effect=fake_postQuery) as post, patch(
+        "util.graphutil._CACHE", ResponseCache(str(tmp_path), 10**6)
+    ), patch("util.graphutil.USE_CACHE", True), patch(
+        "util.graphutil._HEADS", {CHAINID: (HEAD, time.time())}
+    ):
+        results = list(graphutil.paginatedQueryBlocks("nfts", "", CHAINID, [1, 2, 3]))
+        assert post.call_count == 2  # block 1, then blocks 2 & 3 together
+        assert results[2] == (3, [{"id": "b2"}])
+
+        # each block's page is cached on its own, shared with paginatedQuery()
+        assert list(graphutil.paginatedQuery("nfts", "", CHAINID, block=3)) == [
+            {"id": "b2"}
+        ]
+        list(graphutil.paginatedQueryBlocks("nfts", "", CHAINID, [2, 3, 1]))
+        assert post.call_count == 2
+
+
+@enforce_types
+def test_submitQuery_only_caches_final_blocks(tmp_path):
+    result = {"data": {"nfts": []}}
+    head = 100 + graphutil.CACHE_CONFIRMATIONS - 1  # block 100 isn't final yet
+    with patch("util.graphutil._postQuery", return_value=result) as post, patch(
+        "util.graphutil._CACHE", ResponseCache(str(tmp_path), 10**6)
+    ), patch("util.graphutil.USE_CACHE", True), patch(
+        "util.graphutil._HEADS", {}
+    ), patch(
+        "util.graphutil.subgraphHead", return_value=head
+    ) as head_f:
+        graphutil.submitQuery(QUERY, CHAINID)
+        graphutil.submitQuery(QUERY, CHAINID)
+        assert post.call_count == 2
+        assert head_f.call_count == 1  # re-queried at most every HEAD_MAX_AGE_S
+
+        # the chain moved on, and the head is re-queried
+        head_f.return_value = head + 1
+        with patch("util.graphutil.HEAD_MAX_AGE_S", 0.0):
+            graphutil.submitQuery(QUERY, CHAINID)
+        assert head_f.call_count == 2
+        graphutil.submitQuery(QUERY, CHAINID)
+        assert post.call_count == 3
+
+
+@enforce_types
+def test_subgraphHead():
+    result = {"data": {"_meta": {"block": {"number": 123}}}}
+    with patch("util.graphutil._postQuery", return_value=result):
+        assert graphutil.subgraphHead(CHAINID) == 123
+    with patch("util.graphutil._postQuery", return_value={"errors": ["oops"]}):
+        assert graphutil.subgraphHead(CHAINID) is None
+
+
+@enforce_types
+def test_pinnedBlock():
+    assert graphutil._pinnedBlock(QUERY) == 100
+    assert graphutil._pinnedBlock("{ x(block:{number:7}) { id } }") == 7
+    assert graphutil._pinnedBlock("{ x(where: {block_gte:7}) { id } }") is None
+
+    # several blocks, see paginatedQueryBlocks()
+    query = "{ b0: x(block: {number: 7}) { id } b1: x(block: {number: 8}) { id } }"
+    assert graphutil._pinnedBlock(query) is None
+
+
+@enforce_types
+def _age(path):
+    """Make all files in path 10 s older, so mtimes are distinct"""
+    for f in path.iterdir():
+        t = os.stat(f).st_mtime - 10
+        os.utime(f, (t, t))
@@ -0,0 +1,221 @@
+import re
+from unittest.mock import Mock, patch
+
+from enforce_typing import enforce_types
+import pytest
+import requests
+
+from util import graphutil
+
+CHAINID = 8996
+IDS = [f"0x{i:040x}" for i in range(25)]
+
+
+@enforce_types
+def _fakeSubmitQuery(queries: list):
+    """Return a fake submitQuery() that serves IDS as 'orders' by id cursor"""
+
+    def fake_submitQuery(query_s: str, chainID: int) -> dict:
+        # pylint: disable=unused-argument
+        queries.append(query_s)
+        first = int(re.search(r"first: (\d+)", query_s).group(1))
+        id_gt = re.search(r'id_gt: "(\w+)"', query_s)
+        ids = [id_ for id_ in IDS if id_gt is None or id_ > id_gt.group(1)]
+        return {"data": {"orders": [{"id": id_} for id_ in ids[:first]]}}
+
+    return fake_submitQuery
+
+
+@enforce_types
+def test_paginatedQuery():
+    queries: list = []
+    with patch("util.graphutil.submitQuery", side_effect=_fakeSubmitQuery(queries)):
+        records = list(
+            graphutil.paginatedQuery(
+                "orders", "tx", CHAINID, where="block_gte:1", chunk_size=10
+            )
+        )
+
+    assert [r["id"] for r in records] == IDS
+    assert len(queries) == 3  # pages of 10, 10, 5
+
+    assert "skip" not in queries[0] and "id_gt" not in queries[0]
+    assert "where: {block_gte:1}" in queries[0]
+    assert f'where: {{block_gte:1, id_gt: "{IDS[9]}"}}' in queries[1]
+    assert f'id_gt: "{IDS[19]}"' in queries[2]
+    assert all("orderBy: id" in query_s for query_s in queries)
+
+
+@enforce_types
+def test_paginatedQuery_exact_pages():
+    queries: list = []
+    with patch("util.graphutil.submitQuery", side_effect=_fakeSubmitQuery(queries)):
+        records = list(graphutil.paginatedQuery("orders", "", CHAINID, chunk_size=5))
+
+    assert len(records) == 25
+    assert len(queries) == 6  # last page is empty
+    assert "where" not in queries[0]
+
+
+@enforce_types
+def test_paginatedQuery_block():
+    queries: list = []
+    with patch("util.graphutil.submitQuery", side_effect=_fakeSubmitQuery(queries)):
+        list(graphutil.paginatedQuery("orders", "", CHAINID, block=123))
+
+    assert "block: {number: 123}" in queries[0]
+
+
+@enforce_types
+def test_paginatedQuery_errors():
+    result = {"errors": [{"message": "Type `Query` has no field `orders`"}]}
+    with patch("util.graphutil.submitQuery", return_value=result):
+        with pytest.raises(AssertionError):
+            list(graphutil.paginatedQuery("orders", "", CHAINID))
+
+
+@enforce_types
+def _fakeSubmitQueryBlocks(queries: list):
+    """
+    Return a fake submitQuery() that serves IDS[:block] as 'orders' at each
+    block, incl. for queries of several blocks as aliased root fields
+    """
+
+    def fake_submitQuery(query_s: str, chainID: int) -> dict:
+        # pylint: disable=unused-argument
+        queries.append(query_s)
+        data = {}
+        for alias, args in re.findall(r"(?:(\w+): )?orders\(([^)]*)\)", query_s):
+            block = int(re.search(r"number: (\d+)", args).group(1))
+            first = int(re.search(r"first: (\d+)", args).group(1))
+            id_gt = re.search(r'id_gt: "(\w+)"', args)
+            ids = [id_ for id_ in IDS[:block] if id_gt is None or id_ > id_gt.group(1)]
+            data[alias or "orders"] = [{"id": id_} for id_ in ids[:first]]
+        return {"data": data}
+
+    return fake_submitQuery
+
+
+@enforce_types
+def test_paginatedQueryBlocks():
+    blocks = [3, 25, 10, 0, 7, 12, 20, 1]
+    queries: list = []
+    with patch(
+        "util.graphutil.submitQuery", side_effect=_fakeSubmitQueryBlocks(queries)
+    ):
+        results = list(
+            graphutil.paginatedQueryBlocks("orders", "", CHAINID, blocks, chunk_size=10)
+        )
+        n_queries = len(queries)
+
+        queries.clear()
+        for block in blocks:
+            list(graphutil.paginatedQuery("orders", "", CHAINID, block=block))
+        n_queries_single = len(queries)
+
+    assert [block for block, _ in results] == blocks
+    for block, records in results:
+        assert [r["id"] for r in records] == IDS[:block]
+
+    assert n_queries < n_queries_single
+
+
+@enforce_types
+def test_paginatedQueryBlocks_adapts(monkeypatch):
+    blocks = list(range(1, 26))
+    queries: list = []
+    fake_submitQuery = _fakeSubmitQueryBlocks(queries)
+    with patch("util.graphutil.submitQuery", side_effect=fake_submitQuery):
+        # small responses: grows up to MAX_BLOCKS_PER_QUERY
+        monkeypatch.setattr(graphutil, "MAX_BLOCKS_PER_QUERY", 4)
+        list(graphutil.paginatedQueryBlocks("orders", "", CHAINID, blocks))
+        n_blocks_per_query = [query_s.count("orders(") for query_s in queries]
+        assert n_blocks_per_query[:3] == [1, 2, 4]
+        assert max(n_blocks_per_query) == 4
+        assert "b0: " not in queries[0]  # 1 block: query as usual
+
+        # big responses: stays small
+        queries.clear()
+        monkeypatch.setattr(graphutil, "TARGET_RECORDS", 10)
+        list(graphutil.paginatedQueryBlocks("orders", "", CHAINID, blocks[10:]))
+        assert all(query_s.count("orders(") == 1 for query_s in queries)
+
+
+@enforce_types
+def test_paginatedQueryBlocks_errors():
+    result = {"errors": [{"message": "Type `Query` has no field `orders`"}]}
+    with patch("util.graphutil.submitQuery", return_value=result):
+        with pytest.raises(AssertionError):
+            list(graphutil.paginatedQueryBlocks("orders", "", CHAINID, [1, 2]))
+
+
+@enforce_types
+def _response(status_code: int, content: bytes = b'{"data": {}}'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content  # pylint: disable=protected-access
+    return response
+
+
+@enforce_types
+def test_submitQuery_retries_transient_failures():
+    session = Mock()
+    session.post.side_effect = [
+        _response(503),
+        requests.ConnectionError("reset"),
+        _response(429),
+        _response(200, b'{"data": {"x": 1}}'),
+    ]
+    graphutil.resetQueryStats()
+    with patch("util.graphutil._getSession", return_value=session), patch(
+        "util.graphutil.time.sleep"
+    ) as sleep:
+        result = graphutil.submitQuery("{ x }", CHAINID)
+
+    assert result == {"data": {"x": 1}}
+    assert session.post.call_count == 4
+
+    # exponential backoff, with jitter
+    delays = [call.args[0] for call in sleep.call_args_list]
+    assert len(delays) == 3
+    for retry_i, delay in enumerate(delays):
+        max_delay = graphutil.BACKOFF_S * 2**retry_i
+        assert max_delay / 2 <= delay <= max_delay
+
+    stats = graphutil.queryStats()
+    assert stats["n_requests"] == 4
+    assert stats["n_retries"] == 3
+    assert stats["n_bytes"] > 0
+
+
+@enforce_types
+def test_submitQuery_gives_up():
+    session = Mock()
+    session.post.return_value = _response(502)
+    with patch("util.graphutil._getSession", return_value=session), patch(
+        "util.graphutil.time.sleep"
+    ):
+        with pytest.raises(Exception) as excinfo:
+            graphutil.submitQuery("{ x }", CHAINID)
+
+    assert "Return code is 502" in str(excinfo.value)
+    assert session.post.call_count == graphutil.MAX_RETRIES + 1
+
+
+@enforce_types
+def test_submitQuery_no_retry_on_client_error():
+    session = Mock()
+    session.post.return_value = _response(400)
+    with patch("util.graphutil._getSession", return_value=session):
+        with pytest.raises(Exception):
+            graphutil.submitQuery("{ x }", CHAINID)
+
+    assert session.post.call_count == 1
+
+
+@enforce_types
+def test_getSession_is_shared():
+    session = graphutil._getSession()
+    assert graphutil._getSession() is session
+    adapter = session.get_adapter("https://v4.subgraph.mainnet.oceanprotocol.com")
+    assert adapter._pool_maxsize == graphutil.POOL_SIZE
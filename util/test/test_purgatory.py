@@ -0,0 +1,68 @@
+import json
+from unittest.mock import Mock, patch
+
+from enforce_typing import enforce_types
+
+from util import purgatory
+from util.purgatory import Purgatory
+
+URL = "https://example.com/list-assets.json"
+DIDS = ["did:op:1", "did:op:2"]
+
+
+@enforce_types
+def _response(status_code: int, dids: list, etag: str = '"v1"'):
+    resp = Mock()
+    resp.status_code = status_code
+    resp.text = json.dumps([{"did": did, "reason": "spam"} for did in dids])
+    resp.headers = {"ETag": etag, "Last-Modified": "Mon, 19 Jun 2023 00:00:00 GMT"}
+    return resp
+
+
+@enforce_types
+def test_dids(tmp_path):
+    p = Purgatory(URL, str(tmp_path / "purgatory.json"), 300.0)
+    with patch("util.purgatory.requests.get", return_value=_response(200, DIDS)) as get:
+        assert p.dids() == frozenset(DIDS)
+        assert "did:op:1" in p
+        assert "did:op:3" not in p
+
+    # downloaded once, unconditionally
+    assert get.call_count == 1
+    assert get.call_args.kwargs["headers"] == {}
+
+
+@enforce_types
+def test_revalidates_with_etag(tmp_path):
+    cache_file = str(tmp_path / "purgatory.json")
+    with patch("util.purgatory.requests.get", return_value=_response(200, DIDS)):
+        Purgatory(URL, cache_file, 300.0).dids()
+
+    # next run: not modified, so use the cached list
+    with patch("util.purgatory.requests.get", return_value=_response(304, [])) as get:
+        assert Purgatory(URL, cache_file, 300.0).dids() == frozenset(DIDS)
+    headers = get.call_args.kwargs["headers"]
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == "Mon, 19 Jun 2023 00:00:00 GMT"
+
+    # modified
+    resp = _response(200, ["did:op:3"], etag='"v2"')
+    with patch("util.purgatory.requests.get", return_value=resp):
+        assert Purgatory(URL, cache_file, 300.0).dids() == frozenset(["did:op:3"])
+    with patch("util.purgatory.requests.get", return_value=_response(304, [])) as get:
+        Purgatory(URL, cache_file, 300.0).dids()
+    assert get.call_args.kwargs["headers"]["If-None-Match"] == '"v2"'
+
+
+@enforce_types
+def test_max_age(tmp_path):
+    p = Purgatory(URL, str(tmp_path / "purgatory.json"), 0.0)
+    with patch("util.purgatory.requests.get", return_value=_response(200, DIDS)) as get:
+        p.dids()
+        p.dids()
+    assert get.call_count == 2
+
+
+@enforce_types
+def test_getPurgatory_is_shared():
+    assert purgatory.getPurgatory() is purgatory.getPurgatory()
@@ -1,10 +1,14 @@
 # mypy: disable-error-code="attr-defined"
 # pylint: disable=too-many-lines
+from collections import OrderedDict
 import os
 import random
+import re
 import time
+from unittest.mock import Mock, patch
 
 import pytest
+import requests
 import brownie
 from enforce_typing import enforce_types
 from pytest import approx
@@ -140,6 +144,7 @@ def test_all(tmp_path):
 
     # test dftool
     _test_dftool_query(tmp_path, ST, FIN)
+    _test_dftool_query_all(tmp_path, ST, FIN)
     _test_dftool_nftinfo(tmp_path, FIN)
     _test_dftool_vebals(tmp_path, ST, FIN)
     _test_dftool_allocations(tmp_path, ST, FIN)
@@ -333,6 +338,29 @@ def _test_dftool_query(tmp_path, ST, FIN):
     assert csvs.symbolsCsvFilenames(CSV_DIR)
 
 
+@enforce_types
+def _test_dftool_query_all(tmp_path, ST, FIN):
+    print("_test_dftool_query_all()...")
+    CSV_DIR = str(tmp_path)
+    _clear_dir(CSV_DIR)
+    csvs.saveRateCsv("OCEAN", 0.5, CSV_DIR)
+
+    # volsym_all for one chain should output the same as volsym
+    cmd = f"./dftool volsym {ST} {FIN} 5 {CSV_DIR} {CHAINID}"
+    os.system(cmd)
+    V0 = csvs.loadNftvolsCsv(CSV_DIR, CHAINID)
+    C0 = csvs.loadOwnersCsv(CSV_DIR, CHAINID)
+    SYM0 = csvs.loadSymbolsCsv(CSV_DIR, CHAINID)
+
+    _clear_dir(CSV_DIR)
+    csvs.saveRateCsv("OCEAN", 0.5, CSV_DIR)
+    cmd = f"./dftool volsym_all {ST} {FIN} 5 {CSV_DIR} {CHAINID}"
+    os.system(cmd)
+    assert csvs.loadNftvolsCsv(CSV_DIR, CHAINID) == V0
+    assert csvs.loadOwnersCsv(CSV_DIR, CHAINID) == C0
+    assert csvs.loadSymbolsCsv(CSV_DIR, CHAINID) == SYM0
+
+
 @enforce_types
 def _test_dftool_nftinfo(tmp_path, FIN):
     print("_test_nftinfo()...")
@@ -504,6 +532,21 @@ def _test_queryPassiveRewards(addresses):
     for _ in range(3):
         timestamp = chain.time() // WEEK * WEEK
         balances, rewards = query.queryPassiveRewards(timestamp, addresses)
+        for addr in addresses:  # Multicall gives the same as one by one
+            assert balances[addr] == from_wei(feeDistributor.ve_for_at(addr, timestamp))
+
+        # offline, from locks
+        locks = {addr: veOCEAN.locked(addr) for addr in addresses}
+        locked_amts = {addr: from_wei(lock[0]) for addr, lock in locks.items()}
+        unlock_times = {addr: int(lock[1]) for addr, lock in locks.items()}
+        balances2, rewards2 = query.calcPassiveRewards(
+            timestamp, locked_amts, unlock_times
+        )
+        for addr in addresses:
+            assert balances2[addr] == approx(balances[addr], rel=1e-6)
+            assert rewards2[addr] == approx(rewards[addr], rel=1e-6)
+        assert not query.checkPassiveBalances(timestamp, balances2, 2)
+
         alice = addresses[0]
         bob = addresses[1]
         assert balances[alice] == balances[bob]
@@ -729,6 +772,59 @@ def test_symbol():
     assert query.symbol(testToken.address) == "!@#$@!%$#^%$&~!@"
 
 
+def test_symbols():
+    addrs = [
+        B.Simpletoken.deploy(sym, "", 18, 1e26, {"from": god_acct}).address
+        for sym in ["co2", "Asd", "XYZ"]
+    ]
+    native_addr = networkutil._CHAINID_TO_ADDRS[CHAINID]
+
+    addr_to_symbol = query.symbols(addrs + [native_addr], CHAINID)
+
+    assert addr_to_symbol == {
+        addrs[0]: "CO2",
+        addrs[1]: "ASD",
+        addrs[2]: "XYZ",
+        native_addr: "OCEAN",
+    }
+
+
+@enforce_types
+def test_symbols_cache(tmp_path):
+    addr1, addr2 = "0x" + "1" * 40, "0x" + "2" * 40
+
+    def fake_fetchSymbols(addrs):
+        return {addr: f"TOK{addr[-1]}" for addr in addrs}
+
+    with patch("util.query.SYMBOLS_CACHE_DIR", str(tmp_path)), patch(
+        "util.query._fetchSymbols", side_effect=fake_fetchSymbols
+    ) as fetch:
+        assert query.symbols([addr1], 1) == {addr1: "TOK1"}
+        assert query.symbols([addr1, addr2], 1) == {addr1: "TOK1", addr2: "TOK2"}
+        assert fetch.call_args_list[1].args == ([addr2],)  # only the new one
+
+        # steady state: no fetches
+        assert query.symbols([addr2, addr1], 1) == {addr1: "TOK1", addr2: "TOK2"}
+        assert fetch.call_count == 2
+
+        # per chain
+        query.symbols([addr1], 137)
+        assert fetch.call_count == 3
+
+        # dev chain isn't cached
+        query.symbols([addr1], CHAINID)
+        query.symbols([addr1], CHAINID)
+        assert fetch.call_count == 5
+        assert sorted(os.listdir(tmp_path)) == ["symbols-1.json", "symbols-137.json"]
+
+        # corrupt, eg from an interrupted run: fetched again
+        (tmp_path / "symbols-1.json").write_text('{"0x')
+        assert query.symbols([addr1], 1) == {addr1: "TOK1"}
+        assert fetch.call_count == 6
+        assert query.symbols([addr1], 1) == {addr1: "TOK1"}
+        assert fetch.call_count == 6
+
+
 @enforce_types
 def test_queryAquariusAssetNames():
     nft_dids = [
@@ -753,6 +849,130 @@ def test_queryAquariusAssetNames():
         assert expectedAssetNames.count(assetNames[nft_dids[i]]) == 1
 
 
+@enforce_types
+def _fakeAquariusPost(posted_batches: list, fail_if=lambda dids: False):
+    """Return a fake requests.post() for Aquarius asset names"""
+
+    def fake_post(url, json, timeout):
+        # pylint: disable=unused-argument
+        dids = json["didList"]
+        posted_batches.append(dids)
+        if fail_if(dids):
+            raise requests.ConnectionError("reset")
+        resp = Mock()
+        resp.json.return_value = {did: f"name of {did}" for did in dids}
+        return resp
+
+    return fake_post
+
+
+@enforce_types
+def test_queryAquariusAssetNames_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(query, "AQUARIUS_CACHE_FILE", str(tmp_path / "names.json"))
+    monkeypatch.setattr(query, "_AQUARIUS_CACHE", None)
+    dids = [f"did:op:{i:064x}" for i in range(5)]
+
+    posted_batches: list = []
+    with patch("util.query.requests.post", _fakeAquariusPost(posted_batches)):
+        names = query.queryAquariusAssetNames(dids + dids[:2])
+        assert names == {did: f"name of {did}" for did in dids}
+        assert len(posted_batches) == 1 and sorted(posted_batches[0]) == dids
+
+        # cached: only fetch the new did
+        new_did = f"did:op:{5:064x}"
+        names = query.queryAquariusAssetNames(dids[:3] + [new_did])
+        assert len(names) == 4
+        assert posted_batches[1:] == [[new_did]]
+
+        # persists across runs
+        monkeypatch.setattr(query, "_AQUARIUS_CACHE", None)
+        assert query.queryAquariusAssetNames(dids)[dids[0]] == f"name of {dids[0]}"
+        assert len(posted_batches) == 2
+
+        # expired
+        monkeypatch.setattr(query, "AQUARIUS_CACHE_TTL_S", -1)
+        query.queryAquariusAssetNames(dids)
+        assert len(posted_batches) == 3
+
+
+@enforce_types
+def test_queryAquariusAssetNames_newly_indexed(tmp_path, monkeypatch):
+    monkeypatch.setattr(query, "AQUARIUS_CACHE_FILE", str(tmp_path / "names.json"))
+    monkeypatch.setattr(query, "_AQUARIUS_CACHE", None)
+    did = f"did:op:{1:064x}"
+    indexed: dict = {}
+
+    def fake_post(url, json, timeout):
+        # pylint: disable=unused-argument
+        resp = Mock()
+        resp.json.return_value = {
+            d: indexed[d] for d in json["didList"] if d in indexed
+        }
+        return resp
+
+    with patch("util.query.requests.post", fake_post):
+        assert query.queryAquariusAssetNames([did]) == {did: ""}
+
+        # Aquarius indexes it. Missing dids are only cached for a short time
+        indexed[did] = "name"
+        assert query.queryAquariusAssetNames([did]) == {did: ""}
+        monkeypatch.setattr(query, "AQUARIUS_MISSING_TTL_S", -1)
+        assert query.queryAquariusAssetNames([did]) == {did: "name"}
+
+
+@enforce_types
+def test_queryAquariusAssetNames_corrupt_cache(tmp_path, monkeypatch):
+    filename = tmp_path / "names.json"
+    filename.write_text('{"did:op:1": ["na')  # eg from an interrupted run
+    monkeypatch.setattr(query, "AQUARIUS_CACHE_FILE", str(filename))
+    monkeypatch.setattr(query, "_AQUARIUS_CACHE", None)
+    dids = [f"did:op:{i:064x}" for i in range(2)]
+
+    posted_batches: list = []
+    with patch("util.query.requests.post", _fakeAquariusPost(posted_batches)):
+        names = query.queryAquariusAssetNames(dids)
+    assert names == {did: f"name of {did}" for did in dids}
+    assert sorted(os.listdir(tmp_path)) == ["names.json"]  # no tmp files left
+
+
+@enforce_types
+def test_fetchAquariusAssetNames_batches(monkeypatch):
+    monkeypatch.setattr(query, "AQUARIUS_BATCH_SIZE", 10)
+    monkeypatch.setattr(query, "AQUARIUS_MIN_BATCH_SIZE", 4)
+    dids = [f"did:op:{i:064x}" for i in range(25)]
+
+    posted_batches: list = []
+    with patch("util.query.requests.post", _fakeAquariusPost(posted_batches)):
+        names = query._fetchAquariusAssetNames(dids)
+    assert len(names) == 25
+    assert sorted(len(batch) for batch in posted_batches) == [5, 10, 10]
+
+    # big batches fail, so get split; then a failing small batch is retried
+    posted_batches.clear()
+    n_fails = {"small": 0}
+
+    def fail_if(batch):
+        if len(batch) > 5:
+            return True
+        n_fails["small"] += 1
+        return n_fails["small"] == 1
+
+    with patch(
+        "util.query.requests.post", _fakeAquariusPost(posted_batches, fail_if)
+    ), patch("util.query.time.sleep"):
+        names = query._fetchAquariusAssetNames(dids)
+    assert len(names) == 25
+    assert max(len(batch) for batch in posted_batches[-3:]) == 5
+
+    # gives up
+    with patch(
+        "util.query.requests.post", _fakeAquariusPost([], lambda batch: True)
+    ), patch("util.query.time.sleep"):
+        with pytest.raises(Exception) as excinfo:
+            query._fetchAquariusAssetNames(dids)
+    assert "Failed to get asset names from Aquarius" in str(excinfo.value)
+
+
 @enforce_types
 def test_filter_to_aquarius_assets():
     # test that we can get the asset names from aquarius
@@ -877,6 +1097,57 @@ def test_populateNftAssetNames():
     assert nfts[0].name == "Take a Ballet Lesson"
 
 
+@enforce_types
+def test_queryNftinfo_incremental():
+    # nft records: id : (block created, owner at block 200)
+    nfts = {f"0x{i:040x}": (10 * i, f"0x{i + 100:040x}") for i in range(1, 16)}
+    transfers = [{"block": 150, "nft": {"id": f"0x{3:040x}"}}]  # created at 30
+
+    def fake_paginatedQuery(entity, fields, chainID, where="", block=None):
+        # pylint: disable=unused-argument
+        assert block == 200
+        if entity == "nftTransferHistories":
+            assert where == "block_gt: 100, block_lte: 200"
+            return iter(transfers)
+        records = [
+            {"id": addr, "symbol": "DN", "owner": {"id": owner}}
+            for addr, (created, owner) in nfts.items()
+            if created <= block
+        ]
+        if where.startswith("block_gt"):
+            records = [r for r in records if nfts[r["id"]][0] > 100]
+        elif where.startswith("id_in"):
+            records = [r for r in records if r["id"] in where]
+        return iter(records)
+
+    with patch("util.query.paginatedQuery", side_effect=fake_paginatedQuery):
+        full = query.queryNftinfo(CHAINID, 200)
+        assert len(full) == 15
+
+        # previous run at block 100 saw nfts 1-10, with old owners
+        prev = [
+            query.SimpleDataNft(CHAINID, addr, "DN", f"0x{0:040x}")
+            for addr in list(nfts)[:10]
+        ]
+        nftinfo = query.queryNftinfo(CHAINID, 200, prev, 100)
+
+    assert [nft.nft_addr for nft in nftinfo] == [nft.nft_addr for nft in full]
+    changed = {f"0x{i:040x}" for i in [3] + list(range(11, 16))}
+    for nft, nft_full in zip(nftinfo, full):
+        assert (nft == nft_full) == (nft.nft_addr in changed)
+
+
+@enforce_types
+def test_markPurgatoryNfts_unmarks():
+    nfts = [query.SimpleDataNft(137, f"0x{i:040x}", "DN", "0x123") for i in [1, 2]]
+    nfts[0].is_purgatory = True  # e.g. loaded from a previous run's csv
+    purgatory = Mock()
+    purgatory.dids.return_value = frozenset([nfts[1].did])
+    with patch("util.query.getPurgatory", return_value=purgatory):
+        query._markPurgatoryNfts(nfts)
+    assert [nft.is_purgatory for nft in nfts] == [False, True]
+
+
 @enforce_types
 def test_SimpleDataNFT():
     # test attributes
@@ -1009,6 +1280,511 @@ def test_process_delegations():
     ]
 
 
+@enforce_types
+def test_queryVebalances_concurrency():
+    now = 1687392001
+    LP, receiver = "0x" + "a" * 40, "0x" + "b" * 40
+    rng = BlockRange(st=100, fin=200, num_samples=20, random_seed=42)
+
+    def vebals_at_block(block):
+        delegation = {
+            "id": "x",
+            "receiver": {"id": receiver},
+            "amount": "1.0",
+            "expireTime": str(now + YEAR),
+            "timeLeftUnlock": str(YEAR),
+        }
+        return [
+            {
+                "id": LP,
+                "lockedAmount": str(block),
+                "unlockTime": str(now + YEAR),
+                "delegation": [delegation],
+            }
+        ]
+
+    fake_submitQuery = _fakeSubgraph("veOCEANs", vebals_at_block)
+    with patch.object(brownie.network.chain, "time", return_value=now), patch(
+        "util.graphutil.submitQuery", side_effect=fake_submitQuery
+    ):
+        tup1 = query.queryVebalances(rng, CHAINID, 1)
+        tup4 = query.queryVebalances(rng, CHAINID, 4)
+
+    assert tup1 == tup4  # deterministic, regardless of concurrency
+
+    vebals, locked_amts, unlock_times = tup4
+    blocks = rng.getBlocks()
+    avg_locked = sum(blocks) / len(blocks)
+    assert vebals[LP] == approx(avg_locked * YEAR / query.MAX_TIME - 1.0)
+    assert vebals[receiver] == approx(1.0)
+    assert locked_amts == {LP: float(blocks[-1]), receiver: 0}
+    assert unlock_times == {LP: now + YEAR, receiver: 0}
+
+
+@enforce_types
+def test_queryVebalancesFromEvents():
+    now = 1687392001
+    A, B, C = "0x" + "a" * 40, "0x" + "b" * 40, "0x" + "c" * 40
+    delegation = {
+        "id": "x",
+        "receiver": {"id": C},
+        "amount": "10.0",
+        "expireTime": str(now + YEAR),
+        "timeLeftUnlock": str(YEAR),
+    }
+
+    def veOCEAN(addr, locked_amt, delegations):
+        unlock_time = now + YEAR if locked_amt > 0 else 0
+        return {
+            "id": addr,
+            "lockedAmount": str(locked_amt),
+            "unlockTime": str(unlock_time),
+            "delegation": delegations,
+        }
+
+    def veOCEANs_at_block(block):
+        A_amt = 100 if block < 110 else 200  # deposit
+        A_delegations = [delegation] if block >= 120 else []  # delegate to C
+        B_amt = 50 if block < 115 else 0  # withdraw
+        return [veOCEAN(A, A_amt, A_delegations), veOCEAN(B, B_amt, [])]
+
+    events = {
+        "veDeposits": [
+            {"id": "d0", "provider": A, "block": "100"},
+            {"id": "d1", "provider": A, "block": "110"},
+            {"id": "d2", "provider": B, "block": "115"},
+        ],
+        "veDelegationUpdates": [
+            {"id": "u1", "block": "120", "veDelegation": {"delegator": {"id": A}}},
+        ],
+    }
+    veOCEANs_queries = []
+
+    def fake_paginatedQuery(entity, fields, chainID, where="", block=None):
+        # pylint: disable=unused-argument
+        if entity == "veOCEANs":
+            veOCEANs_queries.append(block)
+            ids = re.findall(r'"(0x\w+)"', where)
+            records = veOCEANs_at_block(block)
+            return [r for r in records if not ids or r["id"] in ids]
+        st, fin = [int(s) for s in re.findall(r"\d+", where)]
+        return [e for e in events[entity] if st < int(e["block"]) <= fin]
+
+    def fake_paginatedQueryBlocks(entity, fields, chainID, blocks):
+        for block in blocks:
+            yield block, fake_paginatedQuery(entity, fields, chainID, block=block)
+
+    rng = BlockRange(st=100, fin=129, num_samples=30, random_seed=42)
+    assert rng.getBlocks() == list(range(100, 130))
+    with patch.object(brownie.network.chain, "time", return_value=now), patch(
+        "util.query.paginatedQuery", side_effect=fake_paginatedQuery
+    ), patch("util.query.paginatedQueryBlocks", side_effect=fake_paginatedQueryBlocks):
+        tup_sampled = query.queryVebalances(rng, CHAINID)
+        veOCEANs_queries.clear()
+        tup_events = query.queryVebalancesFromEvents(rng, CHAINID)
+
+    # one snapshot, then one query per changed block
+    assert veOCEANs_queries == [100, 110, 115, 120]
+
+    # same as sampling every block
+    vebals_sampled, locked_amts_sampled, unlock_times_sampled = tup_sampled
+    vebals, locked_amts, unlock_times = tup_events
+    assert vebals.keys() == vebals_sampled.keys() == {A, B, C}
+    for LP_addr in vebals:
+        assert vebals[LP_addr] == approx(vebals_sampled[LP_addr])
+    assert locked_amts == locked_amts_sampled
+    assert unlock_times == unlock_times_sampled
+
+    bal = YEAR / query.MAX_TIME
+    assert vebals[C] == approx(10.0 * 10 / 30)
+    assert vebals[B] == approx(50 * bal * 15 / 30)
+
+
+@enforce_types
+def test_queryAllocations_concurrency():
+    LP, nft_addr = "0x" + "a" * 40, "0x" + "c" * 40
+    rng = BlockRange(st=100, fin=200, num_samples=20, random_seed=42)
+
+    def allocs_at_block(block):
+        alloc = {
+            "id": "x",
+            "allocated": str(block),
+            "chainId": str(CHAINID),
+            "nftAddress": nft_addr,
+        }
+        return [{"id": LP, "veAllocation": [alloc]}]
+
+    fake_submitQuery = _fakeSubgraph("veAllocateUsers", allocs_at_block)
+    with patch("util.graphutil.submitQuery", side_effect=fake_submitQuery):
+        allocs1 = query.queryAllocations(rng, CHAINID, 1)
+        allocs4 = query.queryAllocations(rng, CHAINID, 4)
+
+    assert allocs1 == allocs4  # deterministic, regardless of concurrency
+
+    blocks = rng.getBlocks()
+    avg_allocated = sum(blocks) / len(blocks)
+    assert allocs4[CHAINID][nft_addr][LP] == approx(avg_allocated / MAX_ALLOCATE)
+
+
+@enforce_types
+def test_queryAllocationsFromEvents():
+    A, B = "0x" + "a" * 40, "0x" + "b" * 40
+    nft1, nft2 = "0x" + "1" * 40, "0x" + "2" * 40
+
+    # [(LP_addr, nft_addr)] : list of (block, allocated), in block order
+    history = {
+        (A, nft1): [(90, 5000.0), (110, 2000.0)],
+        (A, nft2): [(115, 8000.0), (125, 0.0)],
+        (B, nft1): [(120, 10000.0)],
+    }
+
+    def allocated_at(key, block):
+        allocated = 0.0
+        for update_block, update_allocated in history[key]:
+            if update_block <= block:
+                allocated = update_allocated
+        return allocated
+
+    def alloc(LP_addr, nft_addr, allocated):
+        return {"chainId": str(CHAINID), "nftAddress": nft_addr, "allocated": allocated}
+
+    allocs_queries = []
+
+    def fake_paginatedQuery(entity, fields, chainID, where="", block=None):
+        # pylint: disable=unused-argument
+        if entity == "veAllocateUsers":
+            allocs_queries.append(block)
+            users = {}
+            for (LP_addr, nft_addr), updates in history.items():
+                if updates[0][0] <= block:
+                    allocated = str(allocated_at((LP_addr, nft_addr), block))
+                    users.setdefault(LP_addr, []).append(
+                        alloc(LP_addr, nft_addr, allocated)
+                    )
+            return [{"id": LP, "veAllocation": a} for LP, a in users.items()]
+
+        assert entity == "veAllocationUpdates"
+        st, fin = [int(s) for s in re.findall(r"\d+", where)]
+        return [
+            {
+                "block": str(update_block),
+                "eventIndex": 0,
+                "allocatedTotal": str(allocated),
+                "veAllocation": {
+                    "allocationUser": {"id": LP_addr},
+                    **alloc(LP_addr, nft_addr, str(allocated)),
+                },
+            }
+            for (LP_addr, nft_addr), updates in history.items()
+            for update_block, allocated in updates
+            if st < update_block <= fin
+        ]
+
+    def fake_paginatedQueryBlocks(entity, fields, chainID, blocks):
+        for block in blocks:
+            yield block, fake_paginatedQuery(entity, fields, chainID, block=block)
+
+    rng = BlockRange(st=100, fin=129, num_samples=30, random_seed=42)
+    with patch("util.query.paginatedQuery", side_effect=fake_paginatedQuery), patch(
+        "util.query.paginatedQueryBlocks", side_effect=fake_paginatedQueryBlocks
+    ):
+        allocs_sampled = query.queryAllocations(rng, CHAINID)
+        allocs_queries.clear()
+        allocs = query.queryAllocationsFromEvents(rng, CHAINID)
+
+    # one snapshot, then only the updates
+    assert allocs_queries == [100]
+
+    # same as sampling every block
+    assert allocs[CHAINID].keys() == allocs_sampled[CHAINID].keys() == {nft1, nft2}
+    for nft_addr in allocs[CHAINID]:
+        assert (
+            allocs[CHAINID][nft_addr].keys() == allocs_sampled[CHAINID][nft_addr].keys()
+        )
+        for LP_addr in allocs[CHAINID][nft_addr]:
+            assert allocs[CHAINID][nft_addr][LP_addr] == approx(
+                allocs_sampled[CHAINID][nft_addr][LP_addr]
+            )
+
+    assert allocs[CHAINID][nft1][B] == approx(10000.0 * 10 / 30 / MAX_ALLOCATE)
+
+
+@enforce_types
+def test_queryAllocationUpdates_log_order():
+    LP_addr, nft_addr = "0x" + "a" * 40, "0x" + "1" * 40
+
+    def update(block, event_index, allocated):
+        return {
+            "block": str(block),
+            "eventIndex": event_index,
+            "allocatedTotal": str(allocated),
+            "veAllocation": {
+                "allocationUser": {"id": LP_addr},
+                "chainId": str(CHAINID),
+                "nftAddress": nft_addr,
+            },
+        }
+
+    # in subgraph (id) order, ie by tx hash: not log order
+    records = [update(120, 7, 3000.0), update(120, 2, 1000.0), update(110, 5, 500.0)]
+    with patch("util.query.paginatedQuery", return_value=records):
+        updates = query._queryAllocationUpdates(100, 129, CHAINID)
+
+    assert [allocated for *_, allocated in updates] == [500.0, 1000.0, 3000.0]
+    assert updates[-1] == (120, LP_addr, CHAINID, nft_addr, 3000.0)
+
+
+@enforce_types
+def test_queryVeForAt(monkeypatch):
+    addresses = [f"0x{i:040x}" for i in range(25)]
+    timestamp = 1687392000
+
+    def ve_for_at(addr, ts, block_identifier=None):
+        # pylint: disable=unused-argument
+        return int(addr, 16) * ts
+
+    fee_distributor = Mock()
+    fee_distributor.ve_for_at.side_effect = ve_for_at
+    fee_distributor.ve_for_at.encode_input = lambda addr, ts: (addr, ts)
+    fee_distributor.ve_for_at.decode_output = lambda data: ve_for_at(*data)
+
+    def tryAggregate(require_success, calls, block_identifier):
+        # pylint: disable=unused-argument
+        time.sleep(random.random() * 0.01)  # shuffle the order of completion
+        return [(int(data[0], 16) != 7, data) for _, data in calls]  # 7 fails
+
+    multicall = Mock()
+    multicall.tryAggregate.side_effect = tryAggregate
+    monkeypatch.setattr(query, "MULTICALL_CHUNK_SIZE", 10)
+    with patch("util.query._multicallContract", return_value=multicall):
+        balances = query._queryVeForAt(fee_distributor, addresses, timestamp)
+
+    assert balances == [ve_for_at(addr, timestamp) for addr in addresses]
+    assert multicall.tryAggregate.call_count == 3
+    assert fee_distributor.ve_for_at.call_count == 1  # failed one, on its own
+
+    # no Multicall on this chain
+    with patch("util.query._multicallContract", return_value=None):
+        balances = query._queryVeForAt(fee_distributor, addresses, timestamp)
+    assert balances == [ve_for_at(addr, timestamp) for addr in addresses]
+
+
+@enforce_types
+def test_multicallContract_resolved_once(monkeypatch):
+    monkeypatch.setattr(query, "_MULTICALL_ADDRS", {})
+    monkeypatch.setattr(brownie.network, "chain", Mock(id=1))
+    monkeypatch.setattr(brownie.Contract, "from_abi", Mock())
+    address = "0x" + "c" * 40
+    with patch("util.query._multicallAddress", return_value=address) as resolve:
+        query._multicallContract()
+        query._multicallContract()
+    assert resolve.call_count == 1
+    assert brownie.Contract.from_abi.call_args.args[1] == address
+
+    # no Multicall on this chain
+    monkeypatch.setattr(brownie.network, "chain", Mock(id=2))
+    with patch("util.query._multicallAddress", return_value=None):
+        assert query._multicallContract() is None
+
+
+@enforce_types
+def test_calcPassiveRewards():
+    timestamp = 1687392000
+    A, B, C = ["0x" + c * 40 for c in "abc"]
+    locked_amts = {A: 100.0, B: 50.0, C: 10.0}
+    unlock_times = {
+        A: timestamp + query.MAX_TIME,
+        B: timestamp + query.MAX_TIME // 4,
+        C: timestamp - 1,  # already unlocked
+    }
+
+    with patch("util.query._queryPassiveTotals", return_value=(250.0, 1000.0)):
+        balances, rewards = query.calcPassiveRewards(
+            timestamp, locked_amts, unlock_times
+        )
+
+    assert balances == {A: approx(100.0), B: approx(12.5), C: 0.0}
+    assert rewards == {A: approx(400.0), B: approx(50.0), C: 0.0}
+
+    with patch("util.query._queryPassiveTotals", return_value=(0.0, 1000.0)):
+        balances, rewards = query.calcPassiveRewards(
+            timestamp, locked_amts, unlock_times
+        )
+    assert balances == rewards == {}
+
+
+@enforce_types
+def test_checkPassiveBalances():
+    timestamp = 1687392000
+    balances = {f"0x{i:040x}": float(i) for i in range(20)}
+    chain_balances = dict(balances)
+    bad_addr = f"0x{7:040x}"
+    chain_balances[bad_addr] += 0.5  # eg lock changed after timestamp
+
+    def fake_queryVeForAt(fee_distributor, addresses, ts):
+        # pylint: disable=unused-argument
+        return [to_wei(chain_balances[addr]) for addr in addresses]
+
+    with patch("util.query._queryVeForAt", side_effect=fake_queryVeForAt), patch(
+        "util.query.oceanutil.FeeDistributor"
+    ):
+        assert query.checkPassiveBalances(timestamp, balances, 20) == {
+            bad_addr: (7.0, 7.5)
+        }
+        mismatches = query.checkPassiveBalances(timestamp, balances, 5, 42)
+        assert mismatches == query.checkPassiveBalances(timestamp, balances, 5, 42)
+        assert len(mismatches) <= 1
+
+
+@enforce_types
+def _volsymRecords() -> tuple:
+    """Return (orders, swaps) of blocks 100..199, as the subgraph does"""
+    basetoken = "0x" + "1" * 40
+    orders, swaps = [], []
+    for block in range(100, 200):
+        nft_addr = f"0x{block % 7:040x}"
+        orders.append(
+            {
+                "id": f"o{block}",
+                "block": str(block),
+                "tx": f"tx{block // 2}",  # some txs span the checkpoint
+                "gasPrice": "1000000000",
+                "gasUsed": "21000",
+                "lastPriceValue": str(block % 3),
+                "lastPriceToken": {"id": basetoken},
+                "datatoken": {
+                    "nft": {"id": nft_addr, "owner": {"id": f"0x{block:040x}"}},
+                    "dispensers": [],
+                },
+            }
+        )
+        swaps.append(
+            {
+                "id": f"s{block}",
+                "block": str(block),
+                "baseTokenAmount": "1.5",
+                "exchangeId": {
+                    "baseToken": {"id": basetoken},
+                    "datatoken": {"nft": {"id": nft_addr}},
+                },
+            }
+        )
+    return orders, swaps
+
+
+@enforce_types
+def test_queryVolsOwnersSymbols_incremental():
+    orders, swaps = _volsymRecords()
+
+    queried_ranges = []
+
+    def fake_paginatedQuery(entity, fields, chainID, where):
+        # pylint: disable=unused-argument
+        st, fin = [int(s) for s in re.findall(r"\d+", where)]
+        queried_ranges.append((entity, st, fin))
+        records = orders if entity == "orders" else swaps
+        return [r for r in records if st <= int(r["block"]) <= fin]
+
+    with patch("util.query.paginatedQuery", side_effect=fake_paginatedQuery), patch(
+        "util.query.symbols",
+        side_effect=lambda addrs, _: {addr: addr[-4:].upper() for addr in addrs},
+    ), patch("util.query.subgraphHead", return_value=10_000):
+        full = query.queryVolsOwnersSymbols(BlockRange(100, 199, 10, 42), CHAINID)
+
+        checkpoint: dict = {}
+        query.queryVolsOwnersSymbols(BlockRange(100, 150, 10, 42), CHAINID, checkpoint)
+        assert checkpoint["fin"] == 150
+
+        queried_ranges.clear()
+        incr = query.queryVolsOwnersSymbols(
+            BlockRange(100, 199, 10, 42), CHAINID, checkpoint
+        )
+        assert queried_ranges == [
+            ("orders", 151, 199),
+            ("fixedRateExchangeSwaps", 151, 199),
+        ]
+        assert checkpoint["fin"] == 199
+
+        # different st: start over
+        query.queryVolsOwnersSymbols(BlockRange(120, 199, 10, 42), CHAINID, checkpoint)
+        assert checkpoint["st"] == 120 and queried_ranges[-1][1] == 120
+
+    (V_full, C_full, SYM_full), (V_incr, C_incr, SYM_incr) = full, incr
+    assert V_full.keys() == V_incr.keys()
+    for token in V_full:
+        assert V_incr[token] == approx(V_full[token])
+    assert C_incr == C_full
+    assert SYM_incr == SYM_full
+
+
+@enforce_types
+def test_queryVolsOwnersSymbols_incremental_lagging_subgraph(monkeypatch):
+    monkeypatch.setattr(query, "VOLS_CHECKPOINT_CONFIRMATIONS", 10)
+    orders, swaps = _volsymRecords()
+    indexed = {"head": 185}  # the subgraph is behind the chain
+    queried_ranges = []
+
+    def fake_paginatedQuery(entity, fields, chainID, where):
+        # pylint: disable=unused-argument
+        st, fin = [int(s) for s in re.findall(r"\d+", where)]
+        queried_ranges.append((st, fin))
+        records = orders if entity == "orders" else swaps
+        return [
+            r for r in records if st <= int(r["block"]) <= min(fin, indexed["head"])
+        ]
+
+    rng = BlockRange(100, 199, 10, 42)
+    with patch("util.query.paginatedQuery", side_effect=fake_paginatedQuery), patch(
+        "util.query.subgraphHead", side_effect=lambda _: indexed["head"]
+    ):
+        checkpoint: dict = {}
+        query.queryVolsOwners(rng, CHAINID, checkpoint)
+        assert checkpoint["fin"] == 175  # not rng.fin
+        assert queried_ranges == [(100, 175), (100, 175), (176, 199), (176, 199)]
+
+        # the subgraph caught up: blocks it lacked before get queried now
+        indexed["head"] = 199
+        queried_ranges.clear()
+        V_incr, C_incr = query.queryVolsOwners(rng, CHAINID, checkpoint)
+        assert checkpoint["fin"] == 189
+        assert queried_ranges == [(176, 189), (176, 189), (190, 199), (190, 199)]
+
+        V_full, C_full = query.queryVolsOwners(rng, CHAINID)
+
+    assert V_full.keys() == V_incr.keys()
+    for token in V_full:
+        assert V_incr[token] == approx(V_full[token])
+    assert C_incr == C_full
+
+
+@enforce_types
+def test_foldOrders_bounded(monkeypatch):
+    monkeypatch.setattr(query, "TX_DEDUP_WINDOW", 3)
+    nft_addr = "0x" + "2" * 40
+
+    def orders():  # a stream, never held in memory as a whole
+        for i in range(1000):
+            yield {
+                "tx": f"tx{i // 2}",  # 2 orders per tx, in a row
+                "gasPrice": "1000000000",
+                "gasUsed": "21000",
+                "lastPriceValue": "1",
+                "lastPriceToken": {"id": "0x" + "1" * 40},
+                "datatoken": {
+                    "nft": {"id": nft_addr, "owner": {"id": "0x" + "3" * 40}},
+                    "dispensers": [],
+                },
+            }
+
+    txgascost: OrderedDict = OrderedDict()
+    vols, _, gasvols = query._foldOrders(orders(), CHAINID, txgascost)
+
+    assert list(txgascost) == ["tx497", "tx498", "tx499"]
+    native_token_addr = networkutil._CHAINID_TO_ADDRS[CHAINID].lower()
+    assert gasvols[native_token_addr][nft_addr] == approx(500 * 21000e-9)
+    assert list(vols.values())[0][nft_addr] == 1000.0
+
+
 # ===========================================================================
 # support functions
 
@@ -1070,6 +1846,30 @@ def _clear_dir(csv_dir: str):
     os.system(cmd)
 
 
+@enforce_types
+def _fakeSubgraph(entity: str, records_at_block):
+    """
+    Return a fake submitQuery() that serves `entity` records per block.
+    Handles queries of several blocks at once, as aliased root fields
+    """
+
+    def fake_submitQuery(query_s: str, chainID: int) -> dict:
+        # pylint: disable=unused-argument
+        data = {}
+        for alias, args in re.findall(r"(?:(\w+): )?%s\(([^)]*)\)" % entity, query_s):
+            block = int(re.search(r"number: ?(\d+)", args).group(1))
+            first = int(re.search(r"first: ?(\d+)", args).group(1))
+            id_gt = re.search(r'id_gt: ?"(\w*)"', args)
+            records = sorted(records_at_block(block), key=lambda r: r["id"])
+            if id_gt:
+                records = [r for r in records if r["id"] > id_gt.group(1)]
+            data[alias or entity] = records[:first]
+        time.sleep(random.random() * 0.01)  # shuffle the order of completion
+        return {"data": data}
+
+    return fake_submitQuery
+
+
 @enforce_types
 def setup_function():
     global god_acct, PREV, OCEAN, veOCEAN, chain